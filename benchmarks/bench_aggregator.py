@@ -0,0 +1,58 @@
+# bench_aggregator.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of aggregating a flowbysector df with flow weighted data quality columns, in asv format.
+Run directly to compare the run time of aggregator with and without legacy_weighted_avg.
+EX: python -m benchmarks.bench_aggregator --rows 100000
+"""
+
+import time
+import argparse
+import numpy as np
+from flowsa.flowbyfunctions import aggregator, fbs_default_grouping_fields
+from benchmarks.synthetic import make_flowbysector
+
+fbs = None
+# aggregate county flows to state flows, so each group has many rows
+state_grouping_fields = [c for c in fbs_default_grouping_fields if c != 'Location'] + ['State']
+
+
+def setup():
+    global fbs
+    fbs = make_flowbysector(20000)
+    fbs['State'] = fbs['Location'].str[0:2]
+
+
+def time_aggregator():
+    aggregator(fbs, state_grouping_fields)
+
+
+def time_aggregator_legacy():
+    aggregator(fbs, state_grouping_fields, legacy_weighted_avg=True)
+
+
+time_aggregator_legacy.timeout = 600
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-r", "--rows", type=int, default=100000, help="Number of rows in the synthetic flowbysector df")
+    args = ap.parse_args()
+
+    df = make_flowbysector(args.rows)
+    df['State'] = df['Location'].str[0:2]
+    start = time.perf_counter()
+    vectorized = aggregator(df, state_grouping_fields)
+    vectorized_time = time.perf_counter() - start
+    start = time.perf_counter()
+    legacy = aggregator(df, state_grouping_fields, legacy_weighted_avg=True)
+    legacy_time = time.perf_counter() - start
+
+    print("rows in: " + str(len(df)) + ", groups: " + str(len(vectorized)))
+    print("aggregator: {:.2f} s".format(vectorized_time))
+    print("aggregator, legacy weighted averages: {:.2f} s".format(legacy_time))
+    print("speedup: {:.1f}x".format(legacy_time / vectorized_time))
+    numeric = vectorized.select_dtypes('number').columns
+    print("matching results: " + str(np.allclose(vectorized[numeric].values, legacy[numeric].values.astype(float),
+                                                 equal_nan=True)))
@@ -0,0 +1,42 @@
+# bench_flowbyfunctions.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of aggregating flowbyactivity dfs geographically and by sector, and of creating allocation ratios,
+in asv format
+"""
+
+from flowsa.flowbyfunctions import agg_by_geoscale, sector_aggregation_generalized, allocate_by_sector, \
+    fba_default_grouping_fields
+from benchmarks.synthetic import make_flowbyactivity, make_flowbyactivity_with_sectors
+
+# allocation grouping columns, as in allocate_by_sector
+sector_grouping_fields = [e for e in fba_default_grouping_fields
+                          if e not in ('ActivityProducedBy', 'ActivityConsumedBy', 'FlowName')] + ['Sector']
+
+
+class TimeAggByGeoscale:
+    params = [('county', 'state'), ('county', 'national'), ('state', 'national')]
+    param_names = ['from_scale, to_scale']
+
+    def setup(self, scales):
+        self.fba = make_flowbyactivity(200000, geoscale=scales[0])
+        self.names = self.fba['ActivityProducedBy'].unique().tolist()
+
+    def time_agg_by_geoscale(self, scales):
+        agg_by_geoscale(self.fba, scales[0], scales[1], fba_default_grouping_fields, self.names)
+
+
+class TimeSectorAllocation:
+    params = ['national', 'state', 'county']
+    param_names = ['geoscale']
+    timeout = 600
+
+    def setup(self, geoscale):
+        self.fba = make_flowbyactivity_with_sectors(20000, geoscale=geoscale)
+
+    def time_sector_aggregation_generalized(self, geoscale):
+        sector_aggregation_generalized(self.fba, sector_grouping_fields)
+
+    def time_allocate_by_sector(self, geoscale):
+        allocate_by_sector(self.fba, 'proportional')
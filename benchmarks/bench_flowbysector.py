@@ -0,0 +1,53 @@
+# bench_flowbysector.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmark of creating a flowbysector dataset end to end, from synthetic USGS_NWIS_WU and BLS_QCEW flowbyactivity
+parquets stored in a temporary directory, in asv format
+"""
+
+import os
+import shutil
+import tempfile
+import yaml
+import flowsa
+import flowsa.flowbysector
+from flowsa.cache import clear_cache
+from benchmarks.synthetic import make_water_method_inputs
+
+method_name = 'bench_Water_national_2015'
+paths = {}
+stored_paths = {}
+
+
+def setup():
+    paths['dir'] = tempfile.mkdtemp() + '/'
+    stored_paths.update({'fbaoutputpath': flowsa.fbaoutputpath,
+                         'fbsoutputpath': flowsa.flowbysector.fbsoutputpath,
+                         'flowbyactivitymethodpath': flowsa.flowbysector.flowbyactivitymethodpath,
+                         'fbs_shard_path': flowsa.flowbysector.fbs_shard_path})
+    method = make_water_method_inputs(paths['dir'])
+    with open(paths['dir'] + method_name + '.yaml', 'w') as f:
+        yaml.safe_dump(method, f)
+    flowsa.fbaoutputpath = paths['dir']
+    flowsa.flowbysector.fbsoutputpath = paths['dir']
+    flowsa.flowbysector.flowbyactivitymethodpath = paths['dir']
+    flowsa.flowbysector.fbs_shard_path = paths['dir'] + 'shards/'
+
+
+def teardown():
+    flowsa.fbaoutputpath = stored_paths['fbaoutputpath']
+    flowsa.flowbysector.fbsoutputpath = stored_paths['fbsoutputpath']
+    flowsa.flowbysector.flowbyactivitymethodpath = stored_paths['flowbyactivitymethodpath']
+    flowsa.flowbysector.fbs_shard_path = stored_paths['fbs_shard_path']
+    if os.path.isdir(paths.get('dir', '')):
+        shutil.rmtree(paths['dir'])
+
+
+def time_flowbysector_main():
+    # read the flowbyactivity parquets from disk on each run, as a new process would
+    clear_cache()
+    flowsa.flowbysector.main(method_name, full_rebuild=True)
+
+
+time_flowbysector_main.timeout = 1200
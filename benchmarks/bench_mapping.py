@@ -0,0 +1,42 @@
+# bench_mapping.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of expanding activity to sector crosswalks and adding sectors to flowbyactivity dfs, in asv format
+"""
+
+from flowsa.mapping import expand_naics_list, add_sectors_to_flowbyactivity, get_activitytosector_mapping, \
+    get_sector_mapping, get_sector_prefix_index, build_sector_mapping
+from benchmarks.synthetic import make_flowbyactivity
+
+crosswalk = None
+
+
+def setup():
+    global crosswalk
+    crosswalk = get_activitytosector_mapping('BLS_QCEW')
+    # build the prefix index outside of the timed expansion
+    get_sector_prefix_index('NAICS_2012_Code')
+
+
+def time_expand_naics_list():
+    expand_naics_list(crosswalk.copy(), 'NAICS_2012_Code')
+
+
+def time_build_sector_mapping():
+    # usgs activities are not sectors, so its crosswalk is expanded to the more disaggregated sectors
+    build_sector_mapping('USGS_NWIS_WU', False, 'NAICS_2012_Code', 'disagg')
+
+
+class TimeAddSectors:
+    params = [['national', 'state', 'county'], ['agg', 'disagg']]
+    param_names = ['geoscale', 'levelofSectoragg']
+
+    def setup(self, geoscale, levelofSectoragg):
+        self.fba = make_flowbyactivity(200000, geoscale=geoscale)
+        # load the mapping, so the merge with the flowbyactivity is timed
+        get_sector_mapping('BLS_QCEW', 'NAICS_2012_Code', levelofSectoragg)
+
+    def time_add_sectors_to_flowbyactivity(self, geoscale, levelofSectoragg):
+        add_sectors_to_flowbyactivity(self.fba, sectorsourcename='NAICS_2012_Code',
+                                      levelofSectoragg=levelofSectoragg)
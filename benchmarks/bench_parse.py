@@ -0,0 +1,34 @@
+# bench_parse.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of parsing data source responses into flowbyactivity format, in asv format
+"""
+
+from flowsa.USGS_NWIS_WU import usgs_parse
+from flowsa.USDA_CoA_Cropland import coa_cropland_parse
+from benchmarks.synthetic import make_usgs_nwis_wu_responses, make_coa_cropland_responses
+
+
+class TimeUsgsParse:
+    params = [('national', 'state'), ('national', 'state', 'county')]
+    param_names = ['geoscales']
+    timeout = 600
+
+    def setup(self, geoscales):
+        self.responses = make_usgs_nwis_wu_responses(geoscales)
+
+    def time_usgs_parse(self, geoscales):
+        # usgs_parse adds columns to the responses, so parse copies
+        usgs_parse([df.copy() for df in self.responses], {'year': '2015'})
+
+
+class TimeCoaCroplandParse:
+    params = ['state', 'county']
+    param_names = ['geoscale']
+
+    def setup(self, geoscale):
+        self.responses = make_coa_cropland_responses(100000, geoscale=geoscale)
+
+    def time_coa_cropland_parse(self, geoscale):
+        coa_cropland_parse(self.responses, {'year': '2017'})
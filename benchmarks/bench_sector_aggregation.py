@@ -0,0 +1,54 @@
+# bench_sector_aggregation.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of aggregating flowbysector dfs to every sector level, in asv format.
+Run directly to compare the sector_aggregation and sector_aggregation_legacy run times.
+EX: python -m benchmarks.bench_sector_aggregation --rows 20000
+"""
+
+import time
+import argparse
+from flowsa.flowbyfunctions import sector_aggregation, sector_aggregation_legacy, fbs_default_grouping_fields
+from benchmarks.synthetic import make_flowbysector
+
+fbs = None
+
+
+def setup():
+    global fbs
+    # without the data quality columns, so the sector matching is timed rather than the weighted averages
+    fbs = make_flowbysector(10000, data_quality=False)
+
+
+def time_sector_aggregation():
+    sector_aggregation(fbs, fbs_default_grouping_fields)
+
+
+def time_sector_aggregation_legacy():
+    sector_aggregation_legacy(fbs, fbs_default_grouping_fields)
+
+
+time_sector_aggregation_legacy.timeout = 600
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-r", "--rows", type=int, default=20000, help="Number of rows in the synthetic flowbysector df")
+    ap.add_argument("--data-quality", action='store_true',
+                    help="Include the data quality columns, which are aggregated by weighted averages")
+    args = ap.parse_args()
+
+    df = make_flowbysector(args.rows, data_quality=args.data_quality)
+    start = time.perf_counter()
+    vectorized = sector_aggregation(df, fbs_default_grouping_fields)
+    vectorized_time = time.perf_counter() - start
+    start = time.perf_counter()
+    legacy = sector_aggregation_legacy(df, fbs_default_grouping_fields)
+    legacy_time = time.perf_counter() - start
+
+    print("rows in: " + str(len(df)) + ", rows out: " + str(len(vectorized)))
+    print("sector_aggregation: {:.2f} s".format(vectorized_time))
+    print("sector_aggregation_legacy: {:.2f} s".format(legacy_time))
+    print("speedup: {:.1f}x".format(legacy_time / vectorized_time))
+    print("identical results: " + str(vectorized.equals(legacy)))
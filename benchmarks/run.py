@@ -0,0 +1,150 @@
+# run.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Runs the asv format benchmarks without asv, offline and in the current environment, and compares the run times
+to a saved run to catch performance regressions between releases.
+Benchmarks are the time_ functions of the bench_ modules and the time_ methods of their classes, with the
+setup and teardown functions and the params of asv.
+EX: python -m benchmarks.run --save results_v0.1.json
+    python -m benchmarks.run --bench "parse|aggregator" --compare results_v0.1.json
+"""
+
+import re
+import sys
+import json
+import time
+import inspect
+import argparse
+import platform
+import importlib
+import itertools
+import pkgutil
+import pandas as pd
+import benchmarks
+
+
+def parse_args():
+    """Make benchmark runner parameters"""
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-b", "--bench", default=None, help="Only run benchmarks with names matching this regex")
+    ap.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs of each benchmark")
+    ap.add_argument("-s", "--save", default=None, help="Save the run times to this json file")
+    ap.add_argument("-c", "--compare", default=None, help="Compare the run times to a json file saved with --save")
+    ap.add_argument("-t", "--threshold", type=float, default=1.25,
+                    help="Ratio of run time to compared run time reported as a regression")
+    args = vars(ap.parse_args())
+    return args
+
+
+def get_param_combinations(params):
+    """
+    Parameter combinations of an asv benchmark
+    :param params: asv params, a list of values or a list of lists of values for several parameters
+    :return: list of tuples of arguments
+    """
+    if not params:
+        return [()]
+    if all(isinstance(p, list) for p in params):
+        return list(itertools.product(*params))
+    return [(p,) for p in params]
+
+
+def collect_benchmarks(pattern=None):
+    """
+    Lists the benchmarks of the bench_ modules in the benchmarks package
+    :param pattern: regex, only benchmarks with names matching it are returned
+    :return: list of dicts with the benchmark name, the module, the class (or None) and the method name,
+    and the params
+    """
+    found = []
+    for m in sorted(pkgutil.iter_modules(benchmarks.__path__), key=lambda m: m.name):
+        if not m.name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + m.name)
+        for name, obj in inspect.getmembers(module):
+            if name.startswith('time_') and inspect.isfunction(obj) and obj.__module__ == module.__name__:
+                found.append({'name': m.name + '.' + name, 'module': module, 'cls': None, 'method': name,
+                              'params': getattr(obj, 'params', None)})
+            elif inspect.isclass(obj) and obj.__module__ == module.__name__:
+                for method in [a for a in dir(obj) if a.startswith('time_')]:
+                    found.append({'name': m.name + '.' + name + '.' + method, 'module': module, 'cls': obj,
+                                  'method': method, 'params': getattr(obj, 'params', None)})
+    if pattern is not None:
+        found = [b for b in found if re.search(pattern, b['name'])]
+    return found
+
+
+def run_benchmark(bench, repeat=3):
+    """
+    Runs a benchmark for each parameter combination, calling setup once before the timed runs and teardown after
+    :param bench: dict of the benchmark, see collect_benchmarks
+    :param repeat: int, number of timed runs
+    :return: list of dicts with the benchmark name, the params, and the fastest run time in seconds, or the
+    error if the benchmark failed
+    """
+    results = []
+    for args in get_param_combinations(bench['params']):
+        owner = bench['module'] if bench['cls'] is None else bench['cls']()
+        result = {'benchmark': bench['name'], 'params': ', '.join(map(str, args)), 'seconds': None,
+                  'error': None}
+        try:
+            if hasattr(owner, 'setup'):
+                owner.setup(*args)
+            try:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    getattr(owner, bench['method'])(*args)
+                    times.append(time.perf_counter() - start)
+                result['seconds'] = min(times)
+            finally:
+                if hasattr(owner, 'teardown'):
+                    owner.teardown(*args)
+        except Exception as e:
+            result['error'] = repr(e)
+        print(result['benchmark'] + ('(' + result['params'] + ')' if result['params'] else '') + ': ' +
+              ('{:.4f} s'.format(result['seconds']) if result['error'] is None else 'failed, ' + result['error']),
+              flush=True)
+        results.append(result)
+    return results
+
+
+def compare_results(results, compared, threshold=1.25):
+    """
+    Compares run times to a saved run
+    :param results: df of run times, see run_benchmark
+    :param compared: df of the saved run times
+    :param threshold: float, ratio of run time to saved run time reported as a regression
+    :return: df of the benchmarks in both runs, with the ratio of the run times and a regression column
+    """
+    df = results.merge(compared[['benchmark', 'params', 'seconds']], on=['benchmark', 'params'],
+                       suffixes=('', '_compared'))
+    df['ratio'] = df['seconds'] / df['seconds_compared']
+    df['regression'] = df['ratio'] > threshold
+    return df
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = []
+    for bench in collect_benchmarks(args['bench']):
+        results.extend(run_benchmark(bench, args['repeat']))
+    results = pd.DataFrame(results, columns=['benchmark', 'params', 'seconds', 'error'])
+
+    if args['save'] is not None:
+        with open(args['save'], 'w') as f:
+            json.dump({'python': platform.python_version(), 'pandas': pd.__version__,
+                       'machine': platform.machine(), 'results': results.to_dict(orient='records')}, f, indent=2)
+    failed = results['error'].notnull().any()
+    if args['compare'] is not None:
+        with open(args['compare'], 'r') as f:
+            compared = pd.DataFrame(json.load(f)['results'])
+        comparison = compare_results(results, compared, args['threshold'])
+        print(comparison[['benchmark', 'params', 'seconds_compared', 'seconds', 'ratio', 'regression']].to_string(
+            index=False))
+        if comparison['regression'].any():
+            print(str(comparison['regression'].sum()) + " benchmarks are more than " + str(args['threshold']) +
+                  " times slower")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,163 @@
+# synthetic.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Generators of synthetic flowsa datasets for benchmarks, at national, state, or county scale. Locations are real
+FIPS codes and activities and sectors are real NAICS codes, so the datasets run through the flowsa functions
+the same way as stored data, without network access.
+"""
+
+import numpy as np
+import pandas as pd
+from flowsa.common import flow_by_sector_fields, load_sector_length_crosswalk
+# the generators of the flowbyactivity inputs of a flowbysector method are shared with the tests
+from tests.synthetic_inputs import get_locations, make_flowbyactivity, make_usgs_nwis_wu_responses, \
+    make_water_method_inputs
+
+# share of activities reported at each NAICS length, most data is reported at 5 and 6 digits
+naics_depth_weights = {2: 0.03, 3: 0.07, 4: 0.2, 5: 0.25, 6: 0.45}
+
+
+def make_sector_codes(n_codes, length=6, seed=0):
+    """
+    Random NAICS-like sector codes that share parent codes, like a real sector hierarchy
+    :param n_codes: int, number of codes
+    :param length: int, number of digits in each code
+    :return: sorted list of unique codes
+    """
+    rng = np.random.default_rng(seed)
+    codes = set()
+    while len(codes) < n_codes:
+        # few parents at the short levels, more at the longer levels
+        digits = [str(rng.integers(1, 10))] + [str(rng.integers(0, min(10, 2 + 2 * d))) for d in range(1, length)]
+        codes.add(''.join(digits))
+    return sorted(codes)
+
+
+def make_flowbysector(n_rows, n_locations=3000, n_sectors=600, data_quality=True, seed=0):
+    """
+    Synthetic flowbysector df with county locations. Most flows are consumed by 6 digit sectors, some are produced
+    and consumed by sectors, and some are already reported at 4 digit sectors.
+    :param n_rows: int, number of rows
+    :param n_locations: int, number of county FIPS
+    :param n_sectors: int, number of 6 digit sectors
+    :param data_quality: bool, False to drop the optional spread and data quality columns
+    :return: df with the flowbysector fields
+    """
+    rng = np.random.default_rng(seed)
+    sectors = np.array(make_sector_codes(n_sectors, seed=seed), dtype=object)
+    locations = np.array(['{:05d}'.format(f) for f in rng.choice(np.arange(1001, 56046), n_locations,
+                                                                 replace=False)], dtype=object)
+    # pick unique location and sector pairs, so rows do not duplicate each other
+    pair = rng.choice(len(locations) * len(sectors), n_rows, replace=n_rows > len(locations) * len(sectors))
+    location = locations[pair // len(sectors)]
+    consumed = sectors[pair % len(sectors)]
+    produced = np.full(n_rows, 'None', dtype=object)
+    kind = rng.random(n_rows)
+    both = kind < 0.15
+    produced[both] = sectors[rng.integers(0, len(sectors), both.sum())]
+    four_digit = kind > 0.9
+    consumed[four_digit] = np.array([c[0:4] for c in consumed[four_digit]], dtype=object)
+
+    df = pd.DataFrame({'Flowable': 'Water', 'Class': 'Water', 'SectorProducedBy': produced,
+                       'SectorConsumedBy': consumed, 'Context': 'resource/water', 'Location': location,
+                       'LocationSystem': 'FIPS_2015', 'FlowAmount': rng.gamma(1.0, 100.0, n_rows),
+                       'Unit': 'Mgal', 'FlowType': 'ELEMENTARY_FLOW', 'Year': 2015})
+    for k, v in flow_by_sector_fields.items():
+        if k not in df.columns:
+            df[k] = '' if v[0]['dtype'] == 'str' else rng.integers(1, 6, n_rows).astype(float)
+    df = df[list(flow_by_sector_fields.keys())]
+    if not data_quality:
+        df = df[[k for k, v in flow_by_sector_fields.items() if v[0]['dtype'] != 'float' or k == 'FlowAmount']]
+    return df
+
+
+def sample_naics_codes(n_codes, seed=0, depth_weights=None):
+    """
+    NAICS 2012 codes sampled from the sector crosswalk, with lengths drawn from depth_weights
+    :param n_codes: int, number of codes to sample, with replacement
+    :param depth_weights: dict of the share of codes at each length, defaults to naics_depth_weights
+    :return: array of codes
+    """
+    rng = np.random.default_rng(seed)
+    depth_weights = depth_weights or naics_depth_weights
+    cw = load_sector_length_crosswalk()
+    depths = rng.choice(list(depth_weights), n_codes, p=np.array(list(depth_weights.values())) /
+                        sum(depth_weights.values()))
+    codes = np.empty(n_codes, dtype=object)
+    for d in depth_weights:
+        level = cw['NAICS_' + str(d)].dropna().unique()
+        codes[depths == d] = rng.choice(level, (depths == d).sum())
+    return codes
+
+
+def make_flowbyactivity_with_sectors(n_rows, geoscale='county', seed=0):
+    """
+    Synthetic allocation flowbyactivity df with a single 'Sector' column of NAICS codes at realistic depths,
+    as created by generalize_activity_field_names for allocate_by_sector
+    :param n_rows: int, number of rows
+    :param geoscale: 'national', 'state', or 'county'
+    :return: df with the flowbyactivity fields and a Sector column in place of the activity fields
+    """
+    sectors = pd.unique(sample_naics_codes(max(n_rows // 10, 100), seed=seed))
+    df = make_flowbyactivity(n_rows, geoscale=geoscale, activities=sectors, seed=seed)
+    return df.rename(columns={'ActivityProducedBy': 'Sector'}).drop(columns=['ActivityConsumedBy', 'Description'])
+
+
+# usda census of agriculture columns that are dropped by coa_cropland_parse
+coa_unused_columns = ['agg_level_desc', 'location_desc', 'state_alpha', 'sector_desc', 'country_code', 'begin_code',
+                      'watershed_code', 'reference_period_desc', 'asd_desc', 'county_name', 'source_desc',
+                      'congr_district_code', 'asd_code', 'week_ending', 'freq_desc', 'load_time', 'zip_5',
+                      'watershed_desc', 'region_desc', 'state_ansi', 'state_name', 'country_name', 'county_ansi',
+                      'end_code']
+
+# group, commodity, and class of usda census of agriculture crops, including crops dropped by coa_cropland_parse
+coa_cropland_commodities = [('FIELD CROPS', 'CORN', 'ALL CLASSES'), ('FIELD CROPS', 'SOYBEANS', 'ALL CLASSES'),
+                            ('FIELD CROPS', 'WHEAT', 'ALL CLASSES'), ('FIELD CROPS', 'WHEAT', 'WINTER'),
+                            ('FIELD CROPS', 'HAY', 'ALL CLASSES'), ('FIELD CROPS', 'COTTON', 'UPLAND'),
+                            ('FRUIT & TREE NUTS', 'ORCHARDS', 'ALL CLASSES'),
+                            ('FRUIT & TREE NUTS', 'BERRY TOTALS', 'ALL CLASSES'),
+                            ('FRUIT & TREE NUTS', 'APPLES', 'ALL CLASSES'),
+                            ('HORTICULTURE', 'CUT CHRISTMAS TREES', 'ALL CLASSES'),
+                            ('VEGETABLES', 'VEGETABLE TOTALS', 'ALL CLASSES'),
+                            ('FARMS & LAND & ASSETS', 'AG LAND', 'ALL CLASSES'),
+                            ('CROP TOTALS', 'CROP TOTALS', 'ALL CLASSES')]
+
+
+def make_coa_cropland_responses(n_rows, geoscale='county', year=2017, seed=0):
+    """
+    Synthetic USDA_CoA_Cropland quickstats responses, as returned by coa_cropland_call
+    :param n_rows: int, number of rows across all responses
+    :param geoscale: 'national', 'state', or 'county'
+    :return: list of dfs, one per state, to pass to coa_cropland_parse
+    """
+    rng = np.random.default_rng(seed)
+    locations = get_locations(geoscale, year=2015)
+    location = locations[rng.integers(0, len(locations), n_rows)]
+    commodity = np.array(coa_cropland_commodities, dtype=object)[rng.integers(0, len(coa_cropland_commodities),
+                                                                              n_rows)]
+    operations = rng.random(n_rows) < 0.3
+    irrigated = rng.random(n_rows) < 0.5
+    # quickstats values have thousands separators, and (D) and (Z) for withheld and small values
+    values = np.array(['{:,}'.format(v) for v in rng.integers(1, 100000, n_rows)], dtype=object)
+    values[rng.random(n_rows) < 0.1] = '(D)'
+    values[rng.random(n_rows) < 0.02] = '(Z)'
+    cv = np.char.mod('%.1f', rng.gamma(2.0, 5.0, n_rows)).astype(object)
+    cv = np.where(rng.random(n_rows) < 0.1, rng.choice(['(H)', '(L)', '', '(D)'], n_rows), cv)
+
+    df = pd.DataFrame({'domain_desc': np.where(operations, 'TOTAL', 'AREA HARVESTED'),
+                       'group_desc': commodity[:, 0], 'commodity_desc': commodity[:, 1],
+                       'class_desc': commodity[:, 2],
+                       'short_desc': [c[1] + (' - OPERATIONS WITH AREA HARVESTED' if o else ' - ACRES HARVESTED')
+                                      for c, o in zip(commodity, operations)],
+                       'unit_desc': np.where(operations, 'OPERATIONS', 'ACRES'),
+                       'statisticcat_desc': 'AREA HARVESTED',
+                       'util_practice_desc': 'ALL UTILIZATION PRACTICES',
+                       'prodn_practice_desc': np.where(irrigated, 'IRRIGATED', 'ALL PRODUCTION PRACTICES'),
+                       'domaincat_desc': 'NOT SPECIFIED',
+                       'state_fips_code': [l[0:2] if l != '00000' else '99' for l in location],
+                       'county_code': [l[2:5] if l[2:5] != '000' else '' for l in location],
+                       'Value': values, 'CV (%)': cv, 'year': year})
+    for c in coa_unused_columns:
+        df[c] = ''
+    return [d.reset_index(drop=True) for _, d in df.groupby('state_fips_code', sort=True)]
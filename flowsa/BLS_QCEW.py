@@ -15,7 +15,17 @@ import pandas as pd
 import numpy as np
 import io
 import zipfile
-from flowsa.common import log, get_all_state_FIPS_2
+from flowsa.common import log, get_all_state_FIPS_2, spool_http_response
+
+# columns kept from the api csv files
+bls_qcew_columns = ['area_fips', 'own_code', 'industry_code', 'year',
+                    'annual_avg_estabs', 'annual_avg_emplvl', 'total_annual_wages']
+# columns read from the pre-2014 zipped csv files, and their data types
+bls_qcew_zip_dtypes = {'area_fips': 'str', 'own_code': 'int64', 'industry_code': 'str', 'year': 'int64',
+                       'annual_avg_estabs_count': 'float64', 'annual_avg_emplvl': 'float64',
+                       'total_annual_wages': 'float64'}
+# ownership codes kept: federal, state, and local government, and private
+bls_qcew_own_codes = [1, 2, 3, 5]
 
 
 def BLS_QCEW_URL_helper(build_url, config, args):
@@ -35,30 +45,41 @@ def BLS_QCEW_URL_helper(build_url, config, args):
             urls.append(url)
     return urls
 
+
+def read_bls_qcew_zip(fp, chunksize=100000):
+    """
+    Reads the state totals of a pre-2014 annual_by_area zip one csv at a time, in chunks of rows, so memory
+    does not grow with the size of the archive
+    :param fp: seekable binary file of the zip
+    :param chunksize: int, rows read from a csv at once
+    :return: df of the Statewide csvs, with the columns of the 2014+ data and only the kept own_codes
+    """
+    chunks = []
+    with zipfile.ZipFile(fp, "r") as f:
+        # the zip holds ~4000 csv files, only want state info
+        for name in [n for n in f.namelist() if "Statewide" in n]:
+            with f.open(name) as data:
+                for chunk in pd.read_csv(data, header=0, usecols=list(bls_qcew_zip_dtypes),
+                                         dtype=bls_qcew_zip_dtypes, chunksize=chunksize):
+                    chunks.append(chunk[chunk['own_code'].isin(bls_qcew_own_codes)])
+    if len(chunks) == 0:
+        df = pd.DataFrame({c: pd.Series(dtype=t) for c, t in bls_qcew_zip_dtypes.items()})
+    else:
+        df = pd.concat(chunks, ignore_index=True, sort=False)
+    # change column name to match format for 2014+
+    df = df.rename(columns={'annual_avg_estabs_count': 'annual_avg_estabs'})
+    return df[bls_qcew_columns]
+
+
 def bls_qcew_call(url, qcew_response, args):
     if args["year"] < '2014':
-        # initiate dataframes list
-        df_list = []
-        # unzip folder that contains bls data in ~4000 csv files
-        with zipfile.ZipFile(io.BytesIO(qcew_response.content), "r") as f:
-            # read in file names
-            for name in f.namelist():
-                # Only want state info
-                if "Statewide" in name:
-                    data = f.open(name)
-                    df_state = pd.read_csv(data, header=0)
-                    df_list.append(df_state)
-                    # concat data into single dataframe
-                    df = pd.concat(df_list, sort=False)
-                    df = df[['area_fips', 'own_code', 'industry_code', 'year',
-                             'annual_avg_estabs_count', 'annual_avg_emplvl', 'total_annual_wages']]
-                    # change column name to match format for 2014+
-                    df = df.rename(columns={'annual_avg_estabs_count': 'annual_avg_estabs'})
-            return df
+        # stream the zip to disk rather than holding it in memory
+        with spool_http_response(qcew_response) as fp:
+            df = read_bls_qcew_zip(fp)
+        return df
     else:
         df = pd.read_csv(io.StringIO(qcew_response.content.decode('utf-8')))
-        df = df[['area_fips', 'own_code', 'industry_code', 'year',
-                 'annual_avg_estabs', 'annual_avg_emplvl', 'total_annual_wages']]
+        df = df[bls_qcew_columns]
         return df
 
 
@@ -66,7 +87,7 @@ def bls_qcew_parse(dataframe_list, args):
     # Concat dataframes
     df = pd.concat(dataframe_list, sort=False)
     # Keep owner_code = 1, 2, 3, 5
-    df = df[df.own_code.isin([1, 2, 3, 5])]
+    df = df[df.own_code.isin(bls_qcew_own_codes)]
     # Aggregate annual_avg_estabs and annual_avg_emplvl by area_fips, industry_code, year, flag
     df = df.groupby(['area_fips', 'industry_code', 'year'])[['annual_avg_estabs',
                                                              'annual_avg_emplvl',
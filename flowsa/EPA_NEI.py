@@ -4,31 +4,126 @@
 """
 Pulls EPA National Emissions Inventory (NEI) data for nonpoint sources
 """
+import os
+import shutil
+import zipfile
 import pandas as pd
 import numpy as np
-import zipfile
-import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+from flowsa.common import log, fbaoutputpath, flow_by_activity_fields, spool_http_response, convert_fba_unit
+from flowsa.flowbyfunctions import add_missing_flow_by_fields
+
+# columns read from the NEI csv files, and their data types. Pollutants, sccs and fips codes repeat across
+# millions of rows, so are read as categories
+epa_nei_dtypes = {'fips code': 'category',
+                  'scc': 'category',
+                  'pollutant code': 'category',
+                  'pollutant desc': 'category',
+                  'total emissions': 'float64',
+                  'emissions uom': 'category'}
+# rows read from a csv at once
+epa_nei_chunksize = 500000
+
+
+def read_epa_nei_chunks(fp, chunksize=epa_nei_chunksize):
+    """
+    Reads the csv files of an NEI zip in chunks of rows, with only the columns in epa_nei_dtypes
+    :param fp: seekable binary file of the zip
+    :param chunksize: int, rows read from a csv at once
+    :return: generator of dfs
+    """
+    with zipfile.ZipFile(fp, "r") as z:
+        # retain only those files that are in .csv format
+        for name in [s for s in z.namelist() if '.csv' in s]:
+            with z.open(name) as data:
+                for chunk in pd.read_csv(data, usecols=list(epa_nei_dtypes), dtype=epa_nei_dtypes,
+                                         chunksize=chunksize):
+                    yield chunk
+
+
+def concat_categorical_chunks(chunks):
+    """
+    Concatenates dfs once, keeping categorical columns categorical by giving every df the union of the
+    categories of each column
+    :param chunks: list of dfs with the same columns
+    :return: df
+    """
+    if len(chunks) == 0:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in epa_nei_dtypes.items()})
+    for c in chunks[0].columns:
+        if isinstance(chunks[0][c].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([chunk[c] for chunk in chunks]).categories
+            for chunk in chunks:
+                chunk[c] = chunk[c].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True, sort=False)
+
 
 def epa_nei_call(url, response_load, args):
     """
-    Takes the .zip archive returned from the url call and extracts
-    the individual .csv files. The .csv files are read into a dataframe and 
-    concatenated into one master dataframe containing all 10 EPA regions.
+    Takes the .zip archive returned from the url call and reads the individual .csv files, one chunk of rows
+    at a time, into one dataframe containing all 10 EPA regions. Only the columns kept by the parse
+    function are read.
     """
-    z = zipfile.ZipFile(io.BytesIO(response_load.content))
-    # create a list of files contained in the zip archive
-    znames = z.namelist()
-    # retain only those files that are in .csv format
-    znames = [s for s in znames if '.csv' in s]
-    # initialize the dataframe
-    df = pd.DataFrame()
-    # for all of the .csv data files in the .zip archive,
-    # read the .csv files into a dataframe
-    # and concatenate with the master dataframe
-    for i in range(len(znames)):
-        df = pd.concat([df, pd.read_csv(z.open(znames[i]))])
+    # read the zip from disk rather than from memory
+    with spool_http_response(response_load) as fp:
+        df = concat_categorical_chunks(list(read_epa_nei_chunks(fp)))
     return df
 
+
+def get_partition_schema(table):
+    """
+    Schema every chunk written to the NEI partition is cast to. Categorical columns are stored as dictionaries,
+    whose index width pandas picks from the number of categories in each chunk, so the indices are widened
+    to int32 for all chunks
+    :param table: pyarrow Table of the first chunk
+    :return: pyarrow Schema
+    """
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        fields.append(field)
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def store_epa_nei_onroad_partition(response_load, args, chunksize=epa_nei_chunksize):
+    """
+    Parses the NEI zip one chunk of rows at a time and writes each chunk straight to the Year partition of
+    the EPA_NEI_Onroad FlowByActivity dataset (fbaoutputpath/EPA_NEI_Onroad/Year=<year>/), so the full table
+    is never held in memory. Unlike flowbyactivity.main, rows are stored in the order of the csv files.
+    Run with flowbyactivity.py --source EPA_NEI_Onroad --year 2017 --stream
+    :param response_load: a requests Response of the NEI zip
+    :param args: dictionary of the year
+    :param chunksize: int, rows read and written at once
+    :return: int, number of rows stored
+    """
+    source = 'EPA_NEI_Onroad'
+    path = fbaoutputpath + source + '/Year=' + str(args['year']) + '/'
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    f = path + source + '_' + str(args['year']) + '.parquet'
+    rows = 0
+    writer = None
+    try:
+        with spool_http_response(response_load) as fp:
+            for chunk in read_epa_nei_chunks(fp, chunksize):
+                df = add_missing_flow_by_fields(epa_nei_onroad_parse([chunk], args), flow_by_activity_fields)
+                # the year is stored in the directory name, so is dropped from the file
+                table = pa.Table.from_pandas(convert_fba_unit(df).drop(columns='Year'), preserve_index=False)
+                if writer is None:
+                    schema = get_partition_schema(table)
+                    writer = pq.ParquetWriter(f, schema)
+                writer.write_table(table.cast(schema), row_group_size=chunksize)
+                rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    log.info("Saved " + str(rows) + " rows of " + source + " to " + f)
+    return rows
+
+
 def epa_nei_onroad_parse(dataframe_list, args):
     """
     Modifies the raw data to meet the flowbyactivity criteria. 
@@ -70,6 +165,6 @@ def epa_nei_onroad_parse(dataframe_list, args):
                           'reporting period',
                           'emissions operating type',
                           'data set',
-                          'pollutant type(s)'])
+                          'pollutant type(s)'], errors='ignore')
 
     return df
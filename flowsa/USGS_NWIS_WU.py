@@ -37,22 +37,14 @@ def usgs_URL_helper(build_url, config, args):
 
 
 def usgs_call(url, usgs_response, args):
-    """Remove the metadata at beginning of files (lines start with #)"""
-    usgs_data = []
-    metadata = []
-    with io.StringIO(usgs_response.text) as fp:
-        for line in fp:
-            if line[0] != '#':
-                if "16s" not in line:
-                    usgs_data.append(line)
-            else:
-                metadata.append(line)
-    # convert response to dataframe
-    df_init = pd.DataFrame(data=usgs_data)
-    # split line data into columns by tab separation
-    df_init = df_init[0].str.split('\t').apply(pd.Series)
-    # make first row column names
-    df_usgs = pd.DataFrame(df_init.values[1:], columns=df_init.iloc[0])
+    """Reads the tab delimited (rdb) response, skipping the metadata at beginning of files (lines start with #)
+    and the row of column formats that follows the column names"""
+    # convert response to dataframe, keeping every value as text
+    df_usgs = pd.read_csv(io.BytesIO(usgs_response.content), sep='\t', comment='#', dtype=str,
+                          keep_default_na=False, encoding=usgs_response.encoding or 'utf-8')
+    # drop the row of column formats (ex. 5s, 16s, 12n)
+    if len(df_usgs) > 0 and df_usgs.iloc[0].str.fullmatch(r'\d+[sdn]').all():
+        df_usgs = df_usgs.iloc[1:].reset_index(drop=True)
     # add column denoting geography, used to help parse data
     if "County" in url:
         df_usgs.insert(0, "geo", "county")
@@ -92,8 +84,10 @@ def usgs_parse(dataframe_list, args):
                     var_name="Description", value_name="FlowAmount")
     # merge national and state/county dataframes
     df = pd.concat([df_n, df_sc], sort=True)
+    # descriptions are column headers, so each unique description is parsed once and mapped back to the rows
+    descriptions = pd.Series(pd.unique(df['Description']), dtype=object)
     # drop any rows associated with commercial data (because only exists for 3 states)
-    df = df[~df['Description'].str.lower().str.contains('commercial')]
+    df = df[~df['Description'].isin(descriptions[descriptions.str.lower().str.contains('commercial')])]
     # drop rows that don't have a record and strip values that have extra symbols
     df['FlowAmount'] = df['FlowAmount'].str.strip()
     df["FlowAmount"] = df['FlowAmount'].str.replace("a", "", regex=True)
@@ -104,31 +98,21 @@ def usgs_parse(dataframe_list, args):
     df['Location'] = df['state_cd'] + df['county_cd']
     # drop unused columns
     df = df.drop(columns=['county_cd', 'county_nm', 'geo', 'state_cd', 'state_name'])
-    # create new columns based on description
-    df['Unit'] = df['Description'].str.rsplit(',').str[-1]
-    # create flow name column
-    df['FlowName'] = pd.np.where(df.Description.str.contains("fresh"), "fresh",
-                     pd.np.where(df.Description.str.contains("saline"), "saline",
-                     pd.np.where(df.Description.str.contains("wastewater"), "wastewater", "total")))
-    # create flow name column
-    df['Compartment'] = pd.np.where(df.Description.str.contains("ground"), "ground",
-                        pd.np.where(df.Description.str.contains("Ground"), "ground",
-                        pd.np.where(df.Description.str.contains("surface"), "surface",
-                        pd.np.where(df.Description.str.contains("Surface"), "surface",
-                        pd.np.where(df.Description.str.contains("consumptive"), "air",
-                        pd.np.where(df.Description.str.contains("total"), "total", "total"))))))
-    # drop rows of data that are not water use/day. also drop "in" in unit column
-    df['Unit'] = df['Unit'].str.strip()
-    df["Unit"] = df['Unit'].str.replace("in ", "", regex=True)
-    df["Unit"] = df['Unit'].str.replace("In ", "", regex=True)
+    # create new columns based on description, dropping "in" from the units
+    units = descriptions.str.rsplit(',').str[-1].str.strip()
+    units = units.str.replace("in ", "", regex=True).str.replace("In ", "", regex=True)
+    df['Unit'] = df['Description'].map(dict(zip(descriptions, units)))
+    df['FlowName'] = df['Description'].map(dict(zip(descriptions, usgs_flow_name(descriptions))))
+    df['Compartment'] = df['Description'].map(dict(zip(descriptions, usgs_compartment(descriptions))))
+    # drop rows of data that are not water use/day
     df = df[~df['Unit'].isin(["millions", "gallons/person/day", "thousands", "thousand acres", "gigawatt-hours"])]
     df = df[~df['Unit'].str.contains("number of")]
     df.loc[df['Unit'].isin(['Mgal/', 'Mgal']), 'Unit'] = 'Mgal/d'
     df = df.reset_index(drop=True)
     # assign activities to produced or consumed by, using functions defined below
-    activities = df['Description'].apply(activity)
-    activities.columns = ['ActivityProducedBy', 'ActivityConsumedBy']
-    df = df.join(activities)
+    activities = {d: activity(d) for d in pd.unique(df['Description'])}
+    df['ActivityProducedBy'] = df['Description'].map({k: v[0] for k, v in activities.items()})
+    df['ActivityConsumedBy'] = df['Description'].map({k: v[1] for k, v in activities.items()})
     # rename year column
     df = df.rename(columns={"year": "Year"})
     # add location system based on year of data
@@ -143,24 +127,10 @@ def usgs_parse(dataframe_list, args):
     # hardcode column information
     df['Class'] = 'Water'
     df['SourceName'] = 'USGS_NWIS_WU'
-    # Assign data quality scores
-    df.loc[df['ActivityConsumedBy'].isin(['Public Supply', 'Public supply']), 'DataReliability'] = '2'
-    df.loc[df['ActivityConsumedBy'].isin(['Aquaculture', 'Livestock', 'Total Thermoelectric Power',
-                                          'Thermoelectric power', 'Thermoelectric Power Once-through cooling',
-                                          'Thermoelectric Power Closed-loop cooling',
-                                          'Wastewater Treatment']), 'DataReliability'] = '3'
-    df.loc[df['ActivityConsumedBy'].isin(['Domestic', 'Self-supplied domestic', 'Industrial', 'Self-supplied industrial',
-                                          'Irrigation, Crop', 'Irrigation, Golf Courses', 'Irrigation, Total',
-                                          'Irrigation', 'Mining']), 'DataReliability'] = '4'
-    df.loc[df['ActivityConsumedBy'].isin(['Total withdrawals', 'Total Groundwater',
-                                          'Total Surface water']), 'DataReliability'] = '5'
-    df.loc[df['ActivityProducedBy'].isin(['Public Supply']), 'DataReliability'] = '2'
-    df.loc[df['ActivityProducedBy'].isin(['Aquaculture', 'Livestock', 'Total Thermoelectric Power',
-                                          'Thermoelectric Power Once-through cooling',
-                                          'Thermoelectric Power Closed-loop cooling',
-                                          'Wastewater Treatment']), 'DataReliability'] = '3'
-    df.loc[df['ActivityProducedBy'].isin(['Domestic', 'Industrial', 'Irrigation, Crop', 'Irrigation, Golf Courses',
-                                          'Irrigation, Total', 'Mining']), 'DataReliability'] = '4'
+    # Assign data quality scores, scores of the producing activity take precedence over the consuming activity
+    consumed_reliability = df['ActivityConsumedBy'].map(activity_consumed_reliability)
+    produced_reliability = df['ActivityProducedBy'].map(activity_produced_reliability)
+    df['DataReliability'] = produced_reliability.where(produced_reliability.notnull(), consumed_reliability)
     # remove commas from activity names
     df['ActivityConsumedBy'] = df['ActivityConsumedBy'].str.replace(", ", " ", regex=True)
     df['ActivityProducedBy'] = df['ActivityProducedBy'].str.replace(", ", " ", regex=True)
@@ -171,6 +141,47 @@ def usgs_parse(dataframe_list, args):
     return df
 
 
+# data reliability scores of activities, see usgs_parse
+activity_consumed_reliability = {
+    **dict.fromkeys(['Public Supply', 'Public supply'], '2'),
+    **dict.fromkeys(['Aquaculture', 'Livestock', 'Total Thermoelectric Power', 'Thermoelectric power',
+                     'Thermoelectric Power Once-through cooling', 'Thermoelectric Power Closed-loop cooling',
+                     'Wastewater Treatment'], '3'),
+    **dict.fromkeys(['Domestic', 'Self-supplied domestic', 'Industrial', 'Self-supplied industrial',
+                     'Irrigation, Crop', 'Irrigation, Golf Courses', 'Irrigation, Total', 'Irrigation', 'Mining'], '4'),
+    **dict.fromkeys(['Total withdrawals', 'Total Groundwater', 'Total Surface water'], '5')}
+activity_produced_reliability = {
+    **dict.fromkeys(['Public Supply'], '2'),
+    **dict.fromkeys(['Aquaculture', 'Livestock', 'Total Thermoelectric Power',
+                     'Thermoelectric Power Once-through cooling', 'Thermoelectric Power Closed-loop cooling',
+                     'Wastewater Treatment'], '3'),
+    **dict.fromkeys(['Domestic', 'Industrial', 'Irrigation, Crop', 'Irrigation, Golf Courses', 'Irrigation, Total',
+                     'Mining'], '4')}
+
+
+def usgs_flow_name(descriptions):
+    """
+    Flow names of usgs descriptions
+    :param descriptions: array of descriptions
+    :return: array of 'fresh', 'saline', 'wastewater', or 'total'
+    """
+    d = pd.Series(descriptions, dtype=object)
+    return np.select([d.str.contains("fresh"), d.str.contains("saline"), d.str.contains("wastewater")],
+                     ["fresh", "saline", "wastewater"], "total")
+
+
+def usgs_compartment(descriptions):
+    """
+    Compartments of usgs descriptions
+    :param descriptions: array of descriptions
+    :return: array of 'ground', 'surface', 'air', or 'total'
+    """
+    d = pd.Series(descriptions, dtype=object)
+    return np.select([d.str.contains("ground|Ground"), d.str.contains("surface|Surface"),
+                      d.str.contains("consumptive")],
+                     ["ground", "surface", "air"], "total")
+
+
 def activity(name):
     """Create rules to assign activities to produced by or consumed by"""
 
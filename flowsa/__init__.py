@@ -6,29 +6,136 @@ Public functions for flowsa
 For standard dataframe formats, see https://github.com/USEPA/flowsa/tree/master/format%20specs
 """
 
+import os
 import pandas as pd
-from flowsa.common import fbaoutputpath, fbsoutputpath, datapath, log
+from flowsa.common import fbaoutputpath, fbsoutputpath, datapath, log, get_geoscale_FIPS, get_FIPS_year, \
+    flow_by_activity_fields, categorical_read_args, conform_categorical_fields
+from flowsa.cache import read_parquet_cached
 
 
-def getFlowByActivity(flowclass, years, datasource):
+def getFlowByActivity(flowclass, years, datasource, columns=None, locations=None, activities=None,
+                      geoscale=None):
     """
-    Retrieves stored data in the FlowByActivity format
+    Retrieves stored data in the FlowByActivity format. Reads are cached in memory for the process,
+    see flowsa.cache.
     :param flowclass: list, a list of`Class' of the flow. required. E.g. ['Water'] or
      ['Land', 'Other']
     :param year: list, a list of years [2015], or [2010,2011,2012]
     :param datasource: str, the code of the datasource.
+    :param columns: list, optional subset of FlowByActivity columns to read. E.g. ['Location', 'FlowAmount']
+    :param locations: list, optional list of FIPS codes to read. E.g. ['00000', '06000']
+    :param activities: list, optional list of activity names to read, matched in either ActivityProducedBy
+     or ActivityConsumedBy. E.g. ['Irrigation Crop']
+    :param geoscale: str, optional geoscale of Locations to read: 'national', 'state', or 'county'
     :return: a pandas DataFrame in FlowByActivity format
     """
-    fbas = pd.DataFrame()
+    # filters are created for each year, as the FIPS codes of a geoscale change between years
+    filters = {}
     for y in years:
+        filters[y] = create_fba_filters(flowclass, locations, activities, geoscale, y)
+        if filters[y] is None:
+            log.error("No locations in " + datasource + " " + str(y) + " match both the locations and the " +
+                      str(geoscale) + " geoscale requested")
+    years = [y for y in years if filters[y] is not None]
+    if len(years) == 0:
+        return pd.DataFrame()
+
+    # years stored in the Year-partitioned dataset are read in a single scan
+    partitioned_years = []
+    if os.path.isdir(fbaoutputpath + datasource) and all(str(y).isdigit() for y in years):
+        partitioned_years = [y for y in years if os.path.isdir(fbaoutputpath + datasource + '/Year=' + str(int(y)))]
+
+    fba_list = []
+    if len(partitioned_years) > 0:
+        # the filters of each year are combined, selecting the year in each
+        dataset_filters = [f + [('Year', '=', int(y))] for y in partitioned_years for f in filters[y]]
+        fba = read_flowbyactivity_dataset(datasource, partitioned_years, columns, dataset_filters)
+        if len(partitioned_years) == len(years):
+            return fba
+        fba_list.append(fba)
+    # other years are read from the file for each year, and concatenated once
+    for y in years:
+        if y in partitioned_years:
+            continue
         try:
-            fba = pd.read_parquet(fbaoutputpath + datasource + "_" + str(y) + ".parquet")
-            fba = fba[fba['Class'].isin(flowclass)]
-            fbas = pd.concat([fbas, fba], sort=False)
+            # filters and columns are pushed down to pyarrow, so unused row groups and columns are not decoded
+            fba = read_parquet_cached(fbaoutputpath + datasource + "_" + str(y) + ".parquet",
+                                      columns=columns, filters=filters[y], **categorical_read_args())
+            fba_list.append(fba)
         except FileNotFoundError:
             log.error("No parquet file found for datasource " + datasource + "and year " + str(
                 y) + " in flowsa")
-    return fbas
+    if len(fba_list) == 0:
+        return pd.DataFrame()
+    fbas = pd.concat(fba_list, sort=False)
+    # years with different categories are concatenated as str, and files may be stored with either schema
+    return conform_categorical_fields(fbas)
+
+
+def read_flowbyactivity_dataset(datasource, years, columns=None, filters=None):
+    """
+    Retrieves data for several years from a FlowByActivity dataset partitioned by Year, stored in
+    fbaoutputpath/<datasource>/Year=<year>/
+    :param datasource: str, the code of the datasource.
+    :param years: list, a list of years [2015], or [2010,2011,2012]
+    :param columns: list, optional subset of FlowByActivity columns to read
+    :param filters: list, optional row filters created by create_fba_filters
+    :return: a pandas DataFrame in FlowByActivity format
+    """
+    path = fbaoutputpath + datasource
+    years = [int(y) for y in years]
+    for y in years:
+        if not os.path.isdir(path + '/Year=' + str(y)):
+            log.error("No parquet file found for datasource " + datasource + "and year " + str(
+                y) + " in flowsa")
+    if filters is None:
+        filters = [[]]
+    filters = [f + [('Year', 'in', years)] for f in filters]
+    fbas = read_parquet_cached(path, columns=columns, filters=filters, **categorical_read_args())
+    fbas = conform_categorical_fields(fbas)
+    # the partition column is read as a category and appended, so restore type and column order
+    if 'Year' in fbas.columns:
+        fbas['Year'] = fbas['Year'].astype(int)
+    if columns is not None:
+        fbas = fbas[columns]
+    else:
+        fbas = fbas[[c for c in flow_by_activity_fields.keys() if c in fbas.columns] +
+                    [c for c in fbas.columns if c not in flow_by_activity_fields.keys()]]
+    return fbas.reset_index(drop=True)
+
+
+def create_fba_filters(flowclass, locations=None, activities=None, geoscale=None, year='2015'):
+    """
+    Create pyarrow row filters for reading a FlowByActivity parquet
+    :param flowclass: list, a list of`Class' of the flow
+    :param locations: list, optional list of FIPS codes
+    :param activities: list, optional list of activity names, matched in either activity column
+    :param geoscale: str, optional 'national', 'state', or 'county'
+    :param year: str or int, year of the data, selecting the FIPS codes of the geoscale, see get_FIPS_year
+    :return: filters in disjunctive normal form (a list of lists of tuples), or None if no location can match
+    """
+    conditions = [('Class', 'in', list(flowclass))]
+
+    location_list = None
+    if locations is not None:
+        location_list = list(locations)
+    if geoscale is not None:
+        geoscale_fips = get_geoscale_FIPS(geoscale, get_FIPS_year(year))
+        if location_list is None:
+            location_list = geoscale_fips
+        else:
+            geoscale_fips = set(geoscale_fips)
+            location_list = [l for l in location_list if l in geoscale_fips]
+    if location_list is not None:
+        if len(location_list) == 0:
+            return None
+        conditions.append(('Location', 'in', location_list))
+
+    # an activity can be found in either activity column, so create one set of conditions for each column
+    if activities is not None:
+        return [conditions + [('ActivityProducedBy', 'in', list(activities))],
+                conditions + [('ActivityConsumedBy', 'in', list(activities))]]
+    return [conditions]
 
 
 def getFlowBySector(methodname):
@@ -39,7 +146,8 @@ def getFlowBySector(methodname):
     """
     fbs = pd.DataFrame()
     try:
-        fbs = pd.read_parquet(fbsoutputpath + methodname + ".parquet")
+        fbs = read_parquet_cached(fbsoutputpath + methodname + ".parquet", **categorical_read_args())
+        fbs = conform_categorical_fields(fbs)
     except FileNotFoundError:
         log.error("No parquet file found for datasource " + methodname + " in flowsa")
     return fbs
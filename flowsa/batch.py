@@ -0,0 +1,123 @@
+# batch.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Builds many FlowByActivity datasets, one source and year per worker process, and reports the wall time, number
+of rows and file size of each dataset.
+Sources are source yaml names in flowsa/data/sourceconfig or glob patterns of names, optionally with a year
+(SOURCE:YEAR). Without a year, every year listed in the source yaml is built.
+EX: --source USGS_NWIS_WU "USDA_CoA_*" BLS_QCEW:2015 --workers 4
+"""
+
+import os
+import glob
+import time
+import fnmatch
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from flowsa.common import log, sourceconfigpath, fbaoutputpath, load_sourceconfig
+
+
+def parse_args():
+    """Make batch script parameters"""
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-s", "--source", nargs='+', required=True,
+                    help="Data source codes or glob patterns to build, optionally as SOURCE:YEAR")
+    ap.add_argument("-y", "--year", nargs='+', default=None,
+                    help="Only build these years. Defaults to every year in each source yaml")
+    ap.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                    help="Number of datasets built at once")
+    ap.add_argument("-r", "--report", default=None, help="Save the summary of the batch to this csv file")
+    ap.add_argument("-p", "--partitioned", action='store_true',
+                    help="Also save to the Year-partitioned dataset for each source")
+    ap.add_argument("--offline", action='store_true',
+                    help="Only use responses stored in the http cache, do not call urls")
+    ap.add_argument("--resume", action='store_true',
+                    help="Resume failed data pulls, skipping urls already called")
+    args = vars(ap.parse_args())
+    return args
+
+
+def get_batch_datasets(source_patterns, years=None):
+    """
+    Lists the source and year pairs to build
+    :param source_patterns: list of source names or glob patterns, each optionally followed by ':year'
+    :param years: list of years to build, or None for every year in each source yaml
+    :return: list of (source, year) tuples, with year as a str
+    """
+    available = sorted(os.path.splitext(os.path.basename(f))[0] for f in glob.glob(sourceconfigpath + '*.yaml'))
+    if years is not None:
+        years = [str(y) for y in years]
+    datasets = []
+    for pattern in source_patterns:
+        pattern, _, pattern_year = pattern.partition(':')
+        sources = fnmatch.filter(available, pattern)
+        if len(sources) == 0:
+            log.error("No source yaml found matching " + pattern)
+        for source in sources:
+            if pattern_year:
+                source_years = [pattern_year]
+            else:
+                source_years = [str(y) for y in load_sourceconfig(source).get('years', [])]
+            for y in source_years:
+                if (years is None or y in years) and (source, y) not in datasets:
+                    datasets.append((source, y))
+    return datasets
+
+
+def build_dataset(source, year, partitioned=False, offline=False, resume=False):
+    """
+    Builds one FlowByActivity dataset, run in a worker process
+    :return: dict summarizing the build, with the wall time, rows, and bytes of the stored parquet
+    """
+    from flowsa.flowbyactivity import main
+
+    summary = {'source': source, 'year': year, 'status': 'ok', 'wall_time': None, 'rows': None,
+               'bytes': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        flow_df = main(source, year, partitioned=partitioned, offline=offline, resume=resume)
+        summary['rows'] = len(flow_df)
+        f = fbaoutputpath + source + '_' + str(year) + '.parquet'
+        if os.path.isfile(f):
+            summary['bytes'] = os.path.getsize(f)
+    except Exception as e:
+        log.error("Failed to build " + source + " " + str(year) + "\n" + traceback.format_exc())
+        summary['status'] = 'failed'
+        summary['error'] = repr(e)
+    summary['wall_time'] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def batch_main(datasets, workers=None, partitioned=False, offline=False, resume=False):
+    """
+    Builds FlowByActivity datasets across a pool of worker processes
+    :param datasets: list of (source, year) tuples, see get_batch_datasets
+    :param workers: int, number of worker processes, defaults to the number of cpus
+    :return: df summarizing each dataset build, in the order of the datasets list
+    """
+    log.info("Building " + str(len(datasets)) + " flowbyactivity datasets")
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_dataset, source, year, partitioned, offline, resume): (source, year)
+                   for source, year in datasets}
+        for future in as_completed(futures):
+            summary = future.result()
+            log.info("Finished " + summary['source'] + " " + summary['year'] + " (" + summary['status'] + ") in " +
+                     str(summary['wall_time']) + " seconds")
+            summaries[futures[future]] = summary
+    summary_df = pd.DataFrame([summaries[d] for d in datasets],
+                              columns=['source', 'year', 'status', 'wall_time', 'rows', 'bytes', 'error'])
+    return summary_df
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    datasets = get_batch_datasets(args['source'], args['year'])
+    summary = batch_main(datasets, workers=args['workers'], partitioned=args['partitioned'],
+                         offline=args['offline'], resume=args['resume'])
+    log.info("Batch summary\n" + summary.to_string(index=False))
+    if args['report'] is not None:
+        summary.to_csv(args['report'], index=False)
@@ -0,0 +1,115 @@
+# cache.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+In-process, least recently used cache of FlowByActivity and FlowBySector parquet reads.
+Cached dataframes are invalidated when the parquet file (or partitioned dataset) is modified, and
+the cache is bounded by the memory used by the stored dataframes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from flowsa.common import log
+
+# maximum memory, in bytes, of the dataframes held in the cache. Set to 0 to disable the cache.
+cache_max_bytes = int(os.environ.get('FLOWSA_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'bytes': 0}
+
+
+def read_parquet_cached(path, **kwargs):
+    """
+    Reads a parquet file or dataset through the cache. Entries are keyed by the path and the read arguments
+    (columns and row filters), and are dropped if the path was modified since the entry was stored.
+    :param path: str, path to a parquet file or a partitioned parquet dataset directory
+    :param kwargs: arguments passed on to pd.read_parquet, like columns and filters
+    :return: a copy of the cached dataframe, safe for the caller to modify
+    """
+    mtime = get_path_mtime(path)
+    if cache_max_bytes <= 0:
+        return pd.read_parquet(path, engine="pyarrow", **kwargs)
+
+    key = (path, repr(sorted(kwargs.items())))
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry['mtime'] == mtime:
+            _cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return copy_cached_frame(entry['df'])
+        if entry is not None:
+            _remove_entry(key)
+            _cache_stats['invalidations'] += 1
+        _cache_stats['misses'] += 1
+
+    df = pd.read_parquet(path, engine="pyarrow", **kwargs)
+    nbytes = int(df.memory_usage(index=True, deep=True).sum())
+    if nbytes > cache_max_bytes:
+        log.debug("Not caching " + path + ", the dataframe is larger than the cache")
+        return df
+
+    with _cache_lock:
+        if key in _cache:
+            _remove_entry(key)
+        _cache[key] = {'df': df, 'mtime': mtime, 'bytes': nbytes}
+        _cache_stats['bytes'] += nbytes
+        # evict least recently used dataframes until under the memory limit
+        while _cache_stats['bytes'] > cache_max_bytes:
+            _remove_entry(next(iter(_cache)))
+            _cache_stats['evictions'] += 1
+    return copy_cached_frame(df)
+
+
+def get_path_mtime(path):
+    """
+    Last modification time of a parquet file, or the latest modification time of the files in a dataset directory
+    :param path: str, path to a file or directory
+    :return: float, modification time. Raises FileNotFoundError if the path does not exist
+    """
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    mtime = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for f in dirs + files:
+            mtime = max(mtime, os.path.getmtime(os.path.join(root, f)))
+    return mtime
+
+
+def copy_cached_frame(df):
+    """
+    Copy of a cached dataframe for a caller. When pandas copy-on-write is enabled, a shallow copy shares the
+    cached data until either frame is modified. Otherwise a deep copy is made so the cached data cannot be changed.
+    """
+    try:
+        copy_on_write = pd.get_option('mode.copy_on_write')
+    except KeyError:
+        copy_on_write = False
+    return df.copy(deep=not copy_on_write)
+
+
+def _remove_entry(key):
+    entry = _cache.pop(key)
+    _cache_stats['bytes'] -= entry['bytes']
+
+
+def cache_info():
+    """
+    Summary of the cache use in this process
+    :return: dict with hits, misses, evictions, invalidations, entries, bytes, and max_bytes
+    """
+    with _cache_lock:
+        info = dict(_cache_stats)
+        info['entries'] = len(_cache)
+    info['max_bytes'] = cache_max_bytes
+    return info
+
+
+def clear_cache():
+    """Drops all cached dataframes and resets the counters"""
+    with _cache_lock:
+        _cache.clear()
+        for k in _cache_stats:
+            _cache_stats[k] = 0
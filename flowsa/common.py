@@ -7,9 +7,18 @@
 
 import sys
 import os
+import io
+import json
+import time
+import hashlib
+import tempfile
+import threading
 import yaml
 import requests
 import requests_ftp
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
 import pandas as pd
 import numpy as np
 import logging as log
@@ -38,6 +47,31 @@ fbsoutputpath = outputpath + 'FlowBySector/'
 
 local_storage_path = appdirs.user_data_dir()
 
+# on-disk cache of http responses, see make_http_request
+http_cache_path = local_storage_path + '/flowsa/http_cache/'
+http_cache_enabled = True
+# if True, urls are not called and responses are only returned from the http cache
+http_offline = os.environ.get('FLOWSA_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+# parsed url responses of in-progress flowbyactivity pulls, see flowbyactivity.call_urls
+fba_shard_path = local_storage_path + '/flowsa/fba_shards/'
+
+# activity to sector mappings, keyed by the hash of the crosswalks, see mapping.get_sector_mapping
+mapping_cache_path = local_storage_path + '/flowsa/mapping_cache/'
+
+# flowbysector data of each activity set, with the fingerprint of their inputs, see flowbysector.main
+fbs_shard_path = local_storage_path + '/flowsa/fbs_shards/'
+
+# pooled http sessions, one per host, see get_http_session
+http_pool_size = int(os.environ.get('FLOWSA_HTTP_POOL_SIZE', 10))
+http_retries = 5
+http_backoff_factor = 1
+http_retry_status = (429, 500, 502, 503, 504)
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+# held while bodies are added to and removed from the http cache
+_http_cache_lock = threading.Lock()
+
 US_FIPS = "00000"
 fips_number_key = {"national": 0,
                    "state": 2,
@@ -71,21 +105,240 @@ def load_api_key(api_source):
     return key
 
 
-def make_http_request(url):
-    r = []
+def make_http_request(url, cache_ttl=None, offline=None):
+    """
+    Calls a url, storing the response in the on-disk http cache (see http_cache_path). Responses are stored once
+    per url and content addressed by the sha256 of the response body. A cached response younger than cache_ttl
+    is returned without calling the url. An older cached response is revalidated with its ETag and Last-Modified
+    headers, so unchanged data are not downloaded again.
+    :param url: str, url to call
+    :param cache_ttl: float, number of days a cached response is used without revalidation. Defaults to 0, so
+     every call sends a conditional request to the server, and the cached body is only reused if the server
+     reports it unchanged. Sources set http_cache_ttl in their yaml to skip revalidation of recent responses.
+    :param offline: bool, only return cached responses and never call the url. Defaults to http_offline.
+    :return: a requests Response. The body of a cached response is read from the cache file when accessed.
+     Raises a requests RequestException if the url fails after retries and there is no cached response.
+    """
+    if offline is None:
+        offline = http_offline
+    if not http_cache_enabled:
+        return fetch_url(url)
+
+    entry = load_http_cache_entry(url)
+    if entry is not None:
+        age = time.time() - entry['fetched']
+        if offline or age < float(cache_ttl or 0) * 86400:
+            log.info("Using cached response for " + url)
+            return load_cached_response(entry, url)
+    elif offline:
+        log.error("No cached response for " + url + " in offline mode")
+        raise requests.exceptions.ConnectionError("No cached response for " + url + " in offline mode")
+
+    # revalidate the cached response, if there is one
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
     try:
-        r = requests.get(url)
-    except requests.exceptions.InvalidSchema: # if url is ftp rather than http
-        requests_ftp.monkeypatch_session()
-        r = requests.Session().get(url)
-    except requests.exceptions.ConnectionError:
-        log.error("URL Connection Error for " + url)
+        r = fetch_url(url, headers=headers, stream=True)
+    except requests.exceptions.RequestException:
+        if entry is None:
+            raise
+        log.warning("Using stale cached response for " + url)
+        return load_cached_response(entry, url)
+
+    if entry is not None and r.status_code == 304:
+        log.info("Cached response for " + url + " is not modified")
+        entry['fetched'] = time.time()
+        save_http_cache_entry(entry)
+        return load_cached_response(entry, url)
+    return store_http_response(url, r)
+
+
+def get_http_session(url):
+    """
+    Gets the pooled requests Session for the host of a url, creating it on first use. Sessions keep connections
+    alive between calls and retry with exponential backoff when a call fails or returns one of http_retry_status.
+    :param url: str, url to call
+    :return: a requests Session
+    """
+    parsed = urlparse(url)
+    host = parsed.scheme + '://' + parsed.netloc
+    with _http_sessions_lock:
+        if host not in _http_sessions:
+            session = requests.Session()
+            retry = Retry(total=http_retries, backoff_factor=http_backoff_factor,
+                          status_forcelist=http_retry_status, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size, max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.mount('ftp://', requests_ftp.FTPAdapter())
+            _http_sessions[host] = session
+        return _http_sessions[host]
+
+
+def fetch_url(url, headers=None, stream=False):
+    """
+    Calls a url with the pooled session for its host
+    :return: a requests Response. Raises a requests RequestException if the url could not be called, or still
+     returned an error status after retrying.
+    """
     try:
+        r = get_http_session(url).get(url, headers=headers, stream=stream)
         r.raise_for_status()
+    except requests.exceptions.ConnectionError:
+        log.error("URL Connection Error for " + url)
+        raise
     except requests.exceptions.HTTPError:
-        log.error('Error in URL request!')
+        log.error('Error in URL request! ' + str(r.status_code) + ' returned for ' + url)
+        raise
     return r
 
+
+def http_cache_key(url):
+    """
+    Name of the http cache index entry for a url. The url itself is not stored in the cache, as it can include
+    an api key.
+    """
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def load_http_cache_entry(url):
+    """
+    Loads the http cache index entry for a url
+    :return: dict with key, content_hash, etag, last_modified, fetched, content_type and encoding, or None if
+     the url has no cached response
+    """
+    f = http_cache_path + 'index/' + http_cache_key(url) + '.json'
+    try:
+        with open(f, 'r') as fp:
+            entry = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    if not os.path.isfile(http_cache_path + 'content/' + entry['content_hash']):
+        return None
+    # entries saved before urls were left out of the cache are saved again without them
+    entry.pop('url', None)
+    entry['key'] = http_cache_key(url)
+    return entry
+
+
+def save_http_cache_entry(entry):
+    """Saves an http cache index entry, replacing any existing entry for the url"""
+    os.makedirs(http_cache_path + 'index/', exist_ok=True)
+    f = http_cache_path + 'index/' + entry['key']
+    with open(f + '.tmp' + str(threading.get_ident()), 'w') as fp:
+        json.dump(entry, fp)
+    os.replace(f + '.tmp' + str(threading.get_ident()), f + '.json')
+
+
+def remove_unreferenced_http_content(content_hash):
+    """
+    Deletes a body from the http cache if no index entry refers to it. Bodies are content addressed, so one
+    body can be stored for several urls.
+    :param content_hash: str, sha256 of the body
+    """
+    index_path = http_cache_path + 'index/'
+    for f in os.listdir(index_path):
+        if not f.endswith('.json'):
+            continue
+        try:
+            with open(index_path + f, 'r') as fp:
+                if json.load(fp).get('content_hash') == content_hash:
+                    return
+        except (IOError, ValueError):
+            continue
+    try:
+        os.remove(http_cache_path + 'content/' + content_hash)
+    except OSError:
+        # already removed, or still open on windows
+        pass
+
+
+def store_http_response(url, r):
+    """
+    Streams the body of a response into the content addressed http cache and indexes it by the hash of the url.
+    The body the url was cached with before is deleted if no other url refers to it.
+    :param url: str, url called
+    :param r: a requests Response, called with stream=True
+    :return: the cached response
+    """
+    content_path = http_cache_path + 'content/'
+    os.makedirs(content_path, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=content_path, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fp:
+        for chunk in r.iter_content(chunk_size=1024 * 1024):
+            sha.update(chunk)
+            fp.write(chunk)
+    content_hash = sha.hexdigest()
+    entry = {'key': http_cache_key(url),
+             'content_hash': content_hash,
+             'etag': r.headers.get('ETag'),
+             'last_modified': r.headers.get('Last-Modified'),
+             'content_type': r.headers.get('Content-Type'),
+             'encoding': r.encoding,
+             'fetched': time.time()}
+    with _http_cache_lock:
+        previous = load_http_cache_entry(url)
+        os.replace(tmp, content_path + content_hash)
+        save_http_cache_entry(entry)
+        if previous is not None and previous['content_hash'] != content_hash:
+            remove_unreferenced_http_content(previous['content_hash'])
+        return load_cached_response(entry, url)
+
+
+class CachedContentFile(io.BufferedReader):
+    """
+    Body of a cached response, read from its cache file. requests does not close the raw file of a response
+    once its content is read, so the file closes itself when read to the end.
+    """
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if not data and size != 0:
+            self.close()
+        return data
+
+
+def load_cached_response(entry, url):
+    """
+    Creates a requests Response from an http cache entry. The body is read from the cache file when the response
+    content is accessed, and can be streamed with iter_content. The file is closed once the body is read, or
+    when the response is closed.
+    :param entry: dict of the http cache index entry, see load_http_cache_entry
+    :param url: str, url of the response
+    """
+    r = requests.models.Response()
+    r.status_code = 200
+    r.reason = 'OK'
+    r.url = url
+    if entry.get('content_type'):
+        r.headers['Content-Type'] = entry['content_type']
+    r.encoding = entry.get('encoding')
+    r.raw = CachedContentFile(io.FileIO(http_cache_path + 'content/' + entry['content_hash'], 'rb'))
+    return r
+
+
+def spool_http_response(r):
+    """
+    Gets a seekable file of the body of a response, without reading the body into memory. A cached response
+    is read from its cache file, any other response is streamed to a temporary file on disk.
+    :param r: a requests Response whose content has not been accessed
+    :return: binary file object positioned at the start of the body, closed by the caller
+    """
+    if hasattr(r.raw, 'seekable') and r.raw.seekable():
+        r.raw.seek(0)
+        return r.raw
+    fp = tempfile.TemporaryFile()
+    for chunk in r.iter_content(chunk_size=1024 * 1024):
+        fp.write(chunk)
+    fp.seek(0)
+    return fp
+
+
 def load_sector_crosswalk():
     cw = pd.read_csv(datapath + "NAICS_07_to_17_Crosswalk.csv", dtype="str")
     return cw
@@ -154,6 +407,106 @@ flow_by_sector_fields = {'Flowable': [{'dtype': 'str'}, {'required': True}],
                          'DataCollection': [{'dtype': 'float'}, {'required': True}]
                          }
 
+# text fields of the flowbyactivity and flowbysector formats that repeat a few values across many rows. With the
+# categorical schema, these are pandas categoricals in memory and arrow dictionaries in parquet, otherwise they
+# are plain str columns
+categorical_flow_by_fields = ['Class', 'SourceName', 'FlowName', 'Flowable', 'Unit', 'ActivityProducedBy',
+                              'ActivityConsumedBy', 'SectorProducedBy', 'SectorConsumedBy', 'Compartment',
+                              'Context', 'Location', 'LocationSystem', 'FlowType', 'MeasureofSpread',
+                              'DistributionType']
+categorical_schema = os.environ.get('FLOWSA_CATEGORICAL', '').lower() in ('1', 'true', 'yes')
+
+
+def set_categorical_schema(enabled=True):
+    """Turns the categorical schema of flowbyactivity and flowbysector text fields on, or off for plain str"""
+    global categorical_schema
+    categorical_schema = enabled
+
+
+def cast_flow_by_field(s, field, dtype):
+    """
+    Casts a column to the data type of its flowbyactivity or flowbysector field, as a category if the field is in
+    categorical_flow_by_fields and the categorical schema is on
+    :param s: series of the column
+    :param field: str, name of the field
+    :param dtype: str, data type of the field in flow_by_activity_fields or flow_by_sector_fields
+    :return: series, the same series if it already has the data type of the field
+    """
+    if categorical_schema and field in categorical_flow_by_fields:
+        if isinstance(s.dtype, pd.CategoricalDtype) and not s.isna().any() and \
+                all(isinstance(c, str) for c in s.cat.categories):
+            return s
+        # as str first, so missing values are the same 'None' as with plain str columns
+        return s.astype(str).astype('category')
+    if dtype == 'str':
+        # astype(str) also converts the values of object columns that are not str, like None
+        if s.dtype == object and pd.api.types.infer_dtype(s, skipna=False) == 'string':
+            return s
+    elif s.dtype == np.dtype(dtype):
+        return s
+    return s.astype(dtype)
+
+
+def missing_flow_by_field(field, dtype, index):
+    """
+    Creates a column for a flowbyactivity or flowbysector field missing from a df, with the values
+    cast_flow_by_field gives a column of None
+    :param field: str, name of the field
+    :param dtype: str, data type of the field in flow_by_activity_fields or flow_by_sector_fields
+    :param index: index of the df
+    :return: series
+    """
+    if categorical_schema and field in categorical_flow_by_fields:
+        values = pd.Categorical.from_codes(np.zeros(len(index), dtype=np.int8), categories=['None'])
+    elif dtype == 'str':
+        values = np.full(len(index), 'None', dtype=object)
+    elif dtype == 'float':
+        values = np.full(len(index), np.nan)
+    else:
+        return cast_flow_by_field(pd.Series(None, index=index, dtype=object, name=field), field, dtype)
+    return pd.Series(values, index=index, name=field)
+
+
+def fill_missing_values(df, value):
+    """
+    Fills missing values like df.fillna, first adding the fill value to the categories of categorical columns
+    :param df: df
+    :param value: scalar, or dict of the fill value of each column
+    :return: df
+    """
+    values = value if isinstance(value, dict) else dict.fromkeys(df.columns, value)
+    added = {c: df[c].cat.add_categories([values[c]]) for c in df.columns
+             if c in values and isinstance(df[c].dtype, pd.CategoricalDtype) and
+             values[c] not in df[c].cat.categories and df[c].isna().any()}
+    if len(added) > 0:
+        df = df.assign(**added)
+    return df.fillna(value)
+
+
+def categorical_read_args():
+    """Arguments of pd.read_parquet to read the categorical_flow_by_fields as categories with the categorical schema"""
+    if categorical_schema:
+        return {'read_dictionary': categorical_flow_by_fields}
+    return {}
+
+
+def conform_categorical_fields(df):
+    """
+    Casts the categorical_flow_by_fields of a df read from parquet to categories if the categorical schema is on,
+    or to plain str if it is off
+    :param df: flowbyactivity or flowbysector df
+    :return: df
+    """
+    for c in categorical_flow_by_fields:
+        if c not in df.columns:
+            continue
+        is_categorical = isinstance(df[c].dtype, pd.CategoricalDtype)
+        if categorical_schema and not is_categorical:
+            df[c] = df[c].astype('category')
+        elif not categorical_schema and is_categorical:
+            df[c] = df[c].astype(object)
+    return df
+
 # A list of activity fields in each flow data format
 activity_fields = {'ProducedBy': [{'flowbyactivity':'ActivityProducedBy'},
                                   {'flowbysector': 'SectorProducedBy'}],
@@ -192,11 +545,11 @@ def generalize_activity_field_names(df):
 
     # if an activity field column is all 'none', drop the column and rename renaming activity columns to generalize
     for k, v in activity_fields.items():
-        if df[v[0]["flowbyactivity"]].all() == 'None':
+        if (df[v[0]["flowbyactivity"]] == 'None').all():
             df = df.drop(columns=[v[0]["flowbyactivity"]])
         else:
             df = df.rename(columns={v[0]["flowbyactivity"]: 'Activity'})
-        if df[v[1]["flowbysector"]].all() == 'None':
+        if (df[v[1]["flowbysector"]] == 'None').all():
             df = df.drop(columns=[v[1]["flowbysector"]])
         else:
             df = df.rename(columns={v[1]["flowbysector"]: 'Sector'})
@@ -253,6 +606,37 @@ def read_stored_FIPS(year='2015'):
     return df
 
 
+# indices of the FIPS crosswalk, built once per year, see get_FIPS_index
+FIPS_indices = {}
+
+
+def get_FIPS_index(year='2015'):
+    """
+    Index of the FIPS crosswalk for a year, read once per process
+    :param year: '2010', '2013', or '2015'
+    :return: dict of the FIPS df ('FIPS'), the state and county FIPS dfs ('state', 'county'), FIPS codes by
+    (State, County) name, with County None for state codes ('codes'), and the lists ('state_FIPS', 'county_FIPS')
+    of state and county FIPS codes
+    """
+    year = str(year)
+    if year in FIPS_indices:
+        return FIPS_indices[year]
+
+    fips = read_stored_FIPS(year)
+    state = fips.drop_duplicates(subset='State')
+    state = state[state['State'].notnull()]
+    county = fips.drop_duplicates(subset='FIPS')
+    county = county[county['County'].notnull()]
+    # first FIPS of each state and county name, in FIPS order
+    codes = {}
+    for s, c, f in zip(fips['State'], fips['County'], fips['FIPS']):
+        codes.setdefault((s, None if pd.isna(c) else c), f)
+
+    FIPS_indices[year] = {'FIPS': fips, 'state': state, 'county': county, 'codes': codes,
+                          'state_FIPS': state['FIPS'].tolist(), 'county_FIPS': county['FIPS'].tolist()}
+    return FIPS_indices[year]
+
+
 def getFIPS(state=None, county=None, year='2015'):
     """
     Pass a state or state and county name to get the FIPS.
@@ -262,23 +646,23 @@ def getFIPS(state=None, county=None, year='2015'):
     :param year: str. '2010', '2013', '2015'
     :return: str. A five digit 2017 FIPS code
     """
-    FIPS_df = read_stored_FIPS(year)
+    codes = get_FIPS_index(year)['codes']
 
+    code = None
     if county is None:
         if state is not None:
             state = clean_str_and_capitalize(state)
-            code = FIPS_df.loc[(FIPS_df["State"] == state) & (FIPS_df["County"].isna()), "FIPS"]
+            code = codes.get((state, None))
     else:
         if state is None:
             log.error("To get county FIPS, state name must be passed in 'state' param")
         else:
             state = clean_str_and_capitalize(state)
             county = clean_str_and_capitalize(county)
-            code = FIPS_df.loc[(FIPS_df["State"] == state) & (FIPS_df["County"] == county), "FIPS"]
-    if code.empty:
+            code = codes.get((state, county))
+    if code is None:
         log.info("No FIPS code found")
     else:
-        code = code.values[0]
         return code
 
 
@@ -305,19 +689,45 @@ def get_state_FIPS(year='2015'):
     Filters FIPS df for state codes only
     :return: FIPS df with only state level records
     """
-    fips = read_stored_FIPS(year)
-    fips = fips.drop_duplicates(subset='State')
-    fips = fips[fips['State'].notnull()]
-    return fips
+    return get_FIPS_index(year)['state'].copy()
 
 def get_county_FIPS(year='2015'):
     """
     Filters FIPS df for county codes only
     :return: FIPS df with only county level records
     """
-    fips = read_stored_FIPS(year)
-    fips = fips.drop_duplicates(subset='FIPS')
-    fips = fips[fips['County'].notnull()]
+    return get_FIPS_index(year)['county'].copy()
+
+
+# years of the FIPS codes in the FIPS crosswalk
+FIPS_years = ['2010', '2013', '2015']
+
+
+def get_FIPS_year(year):
+    """
+    Year of the FIPS codes in the FIPS crosswalk to use for data of a year, the latest crosswalk year not after
+    the data year
+    :param year: str or int, year of data
+    :return: '2010', '2013', or '2015'
+    """
+    earlier = [y for y in FIPS_years if int(y) <= int(year)]
+    return earlier[-1] if len(earlier) > 0 else FIPS_years[0]
+
+
+def get_geoscale_FIPS(geoscale, year='2015'):
+    """
+    Create a list of FIPS associated with given geoscale
+    :param geoscale: 'national', 'state', or 'county'
+    :param year: '2010', '2013', or '2015'
+    :return: list of relevant FIPS
+    """
+    fips = []
+    if geoscale == "national":
+        fips.append(US_FIPS)
+    elif geoscale == "state":
+        fips = list(get_FIPS_index(year)['state_FIPS'])
+    elif geoscale == "county":
+        fips = list(get_FIPS_index(year)['county_FIPS'])
     return fips
 
 
@@ -328,7 +738,7 @@ def get_all_state_FIPS_2(year='2015'):
     """
 
     state_fips = get_state_FIPS(year)
-    state_fips['FIPS_2'] = state_fips['FIPS'].apply(lambda x: x[0:2])
+    state_fips['FIPS_2'] = state_fips['FIPS'].str[0:2]
     state_fips = state_fips[['State','FIPS_2']]
     return state_fips
 
@@ -392,18 +802,80 @@ us_state_abbrev = {
 abbrev_us_state = dict(map(reversed, us_state_abbrev.items()))
 
 
+# unit conversions of each conversion set, loaded from the unit registry, see load_unit_conversions
+unit_conversions = {}
+
+
+def load_unit_conversions(conversion):
+    """
+    Loads the unit conversions of a conversion set from the unit registry, datapath/Unit_Conversions.csv.
+    A conversion with no Class applies to flows of any Class, and is overridden by a conversion for the Class.
+    :param conversion: str, name of the conversion set, like 'flowbyactivity' or 'harmonize'
+    :return: df with the Class, SourceUnit, TargetUnit and Factor of each conversion
+    """
+    if conversion not in unit_conversions:
+        registry = pd.read_csv(datapath + 'Unit_Conversions.csv', dtype={'Class': str, 'SourceUnit': str,
+                                                                          'TargetUnit': str, 'Factor': float})
+        conversions = registry[registry['Conversion'] == conversion]
+        duplicated = conversions.duplicated(['Class', 'SourceUnit'])
+        if duplicated.any():
+            log.error("Unit registry lists " + ', '.join(conversions.loc[duplicated, 'SourceUnit']) +
+                      " more than once for the " + conversion + " conversion, the first is used")
+        unit_conversions[conversion] = conversions[~duplicated][['Class', 'SourceUnit', 'TargetUnit', 'Factor']]
+    return unit_conversions[conversion]
+
+
+def convert_units(df, conversion):
+    """
+    Converts the FlowAmount and Unit of a flowbyactivity or flowbysector df with a conversion set of the unit
+    registry, in a single pass. The Class and Unit columns are factorized and the factor and target unit of each
+    combination are looked up once, then mapped to the rows by their codes.
+    :param df: Either flowbyactivity or flowbysector
+    :param conversion: str, name of the conversion set, see load_unit_conversions
+    :return: Df with converted units
+    """
+    conversions = load_unit_conversions(conversion)
+    unit_codes, units = pd.factorize(df['Unit'])
+    units = pd.Index(units).astype(object)
+    if not units.isin(conversions['SourceUnit']).any():
+        return df
+    if 'Class' in df.columns:
+        class_codes, classes = pd.factorize(df['Class'])
+        classes = pd.Index(classes).astype(object)
+    else:
+        class_codes, classes = np.zeros(len(df), dtype=np.intp), pd.Index([None], dtype=object)
+
+    # factor and target unit of each class and unit combination, with missing classes and units (code -1) in the
+    # last row and column
+    factors = np.ones((len(classes) + 1, len(units) + 1))
+    targets = np.empty((len(classes) + 1, len(units) + 1), dtype=object)
+    targets[:, :len(units)] = np.asarray(units)
+    targets[:, len(units)] = np.nan
+    # conversions for any class first, so conversions for a class replace them
+    for _, row in conversions.sort_values('Class', na_position='first').iterrows():
+        u = units.get_indexer([row['SourceUnit']])[0]
+        if u < 0:
+            continue
+        c = slice(None) if pd.isnull(row['Class']) else classes.get_indexer([row['Class']])[0]
+        if not isinstance(c, slice) and c < 0:
+            continue
+        factors[c, u] = row['Factor']
+        targets[c, u] = row['TargetUnit']
+
+    df['FlowAmount'] = df['FlowAmount'] * factors[class_codes, unit_codes]
+    target_units = pd.Index(pd.unique(targets.ravel())).dropna()
+    target_codes = target_units.get_indexer(targets.ravel()).reshape(targets.shape)
+    unit = pd.Categorical.from_codes(target_codes[class_codes, unit_codes], categories=target_units)
+    df['Unit'] = unit if isinstance(df['Unit'].dtype, pd.CategoricalDtype) else np.asarray(unit, dtype=object)
+    return df
+
+
 def convert_fba_unit(df):
     """
-    Convert unit to standard
+    Convert unit to standard, with the 'flowbyactivity' conversions of the unit registry
     :param df: Either flowbyactivity
     :return: Df with standarized units
     """
     # remove temporal aspect of unit and want all flows in Mgal
-    df['FlowAmount'] = np.where(df['Unit'] == 'Bgal/d', df['FlowAmount'] * 1000 * 365, df['FlowAmount'])
-    df['Unit'] = np.where(df['Unit'] == 'Bgal/d', 'Mgal', df['Unit'])
-
-    df['FlowAmount'] = np.where(df['Unit'] == 'Mgal/d', df['FlowAmount'] * 365, df['FlowAmount'])
-    df['Unit'] = np.where(df['Unit'] == 'Mgal/d', 'Mgal', df['Unit'])
-
-    return df
+    return convert_units(df, 'flowbyactivity')
 
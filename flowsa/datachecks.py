@@ -9,7 +9,7 @@ import pandas as pd
 from flowsa.mapping import get_activitytosector_mapping
 from flowsa.flowbyfunctions import fba_fill_na_dict, harmonize_units, fba_activity_fields, filter_by_geoscale, \
     fba_default_grouping_fields, fbs_default_grouping_fields, aggregator, sector_aggregation
-from flowsa.common import US_FIPS
+from flowsa.common import US_FIPS, fill_missing_values
 from flowsa.USGS_NWIS_WU import standardize_usgs_nwis_names
 
 
@@ -26,7 +26,7 @@ def geoscale_flow_comparison(flowclass, years, datasource, activitynames=['all']
                                      years=years,
                                      datasource=datasource)
     # fill null values
-    flows = flows.fillna(value=fba_fill_na_dict)
+    flows = fill_missing_values(flows, fba_fill_na_dict)
     # convert units
     flows = harmonize_units(flows)
 
@@ -148,25 +148,28 @@ def sector_flow_comparision(fbs_df):
         # if the dataframe is not empty, run through sector aggregation code
         if len(df) != 0:
             # assign the sector column for aggregation
-            if (df['SectorProducedBy'].all() == 'None') or (
-                    (df['SectorProducedBy'].all() == '221310') & (df['SectorConsumedBy'].all() != 'None')):
+            if (df['SectorProducedBy'] == 'None').all() or (
+                    (df['SectorProducedBy'] == '221310').all() and (df['SectorConsumedBy'] != 'None').all()):
                 sector = 'SectorConsumedBy'
-            elif (df['SectorConsumedBy'].all() == 'None') or (
-                    (df['SectorConsumedBy'].all() == '221310') & (df['SectorProducedBy'].all() != 'None')):
+            elif (df['SectorConsumedBy'] == 'None').all() or (
+                    (df['SectorConsumedBy'] == '221310').all() and (df['SectorProducedBy'] != 'None').all()):
                 sector = 'SectorProducedBy'
+            else:
+                raise ValueError("Unable to find the sector column to compare, the subset of the flowbysector "
+                                 "has produced and consumed by sectors that are neither 'None' nor 221310")
 
             # find max length of sector column
             df['SectorLength'] = df[sector].apply(lambda x: len(x))
 
             # reassign sector consumed/produced by to help wth grouping
             # assign the sector column for aggregation
-            if df['SectorProducedBy'].all() == 'None':
+            if (df['SectorProducedBy'] == 'None').all():
                 df['SectorConsumedBy'] = 'All'
-            elif (df['SectorProducedBy'].all() == '221310') & (df['SectorConsumedBy'].all() != 'None'):
+            elif (df['SectorProducedBy'] == '221310').all() and (df['SectorConsumedBy'] != 'None').all():
                 df['SectorConsumedBy'] = 'All'
-            elif df['SectorConsumedBy'].all() == 'None':
+            elif (df['SectorConsumedBy'] == 'None').all():
                 df['SectorProducedBy'] = 'All'
-            elif (df['SectorConsumedBy'].all() == '221310') & (df['SectorProducedBy'].all() != 'None'):
+            elif (df['SectorConsumedBy'] == '221310').all() and (df['SectorProducedBy'] != 'None').all():
                 df['SectorProducedBy'] = 'All'
 
             # append to df
@@ -178,7 +181,7 @@ def sector_flow_comparision(fbs_df):
     # sum df based on sector length
     grouping = fbs_default_grouping_fields.copy()
     grouping.append('SectorLength')
-    sector_comparison = df_agg.groupby(grouping, as_index=False)[["FlowAmount"]].agg("sum")
+    sector_comparison = df_agg.groupby(grouping, as_index=False, observed=True)[["FlowAmount"]].agg("sum")
 
     # drop columns not needed for comparison
     sector_comparison = sector_comparison.drop(columns=['DistributionType', 'MeasureofSpread'])
@@ -6,11 +6,17 @@ Methods for pulling data from http sources
 File configuration requires a year for the data pull and a data source (yaml file name) as parameters
 EX: --year 2015 --source USGS_NWIS_WU
 """
+import os
+import shutil
+import tempfile
 import pandas as pd
+import pyarrow as pa
 import argparse
 import yaml
 import requests
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 from flowsa.common import *
@@ -30,11 +36,26 @@ from flowsa.USDA_IWMS import *
 from flowsa.USGS_NWIS_WU import *
 
 
+# number of rows per parquet row group. main sorts the data by Class and Location before saving, so row group
+# statistics allow those columns to be filtered without decoding the full file. store_flowbyactivity and the
+# partition writers do not sort, so data saved by other callers only skip row groups if sorted the same way
+fba_row_group_size = 50000
+
+
 def parse_args():
     """Make year and source script parameters"""
     ap = argparse.ArgumentParser()
     ap.add_argument("-y", "--year", required=True, help="Year for data pull and save")
     ap.add_argument("-s", "--source", required=True, help="Data source code to pull and save")
+    ap.add_argument("-p", "--partitioned", action='store_true',
+                    help="Also save to the Year-partitioned dataset for the source")
+    ap.add_argument("--offline", action='store_true',
+                    help="Only use responses stored in the http cache, do not call urls")
+    ap.add_argument("--resume", action='store_true',
+                    help="Resume a failed data pull, skipping urls already called")
+    ap.add_argument("--stream", action='store_true',
+                    help="Parse responses in chunks straight into the Year-partitioned dataset, for sources with a "
+                         "partition_response_fxn. The single parquet file for the year is not saved")
     args = vars(ap.parse_args())
     return args
 
@@ -46,13 +67,68 @@ def store_flowbyactivity(result, source, year=None):
     else:
         f = fbaoutputpath + source + '.parquet'
     try:
-        result.to_parquet(f, engine="pyarrow")
+        # write several row groups so row filters in getFlowByActivity can skip the groups that do not match
+        result.to_parquet(f, engine="pyarrow", row_group_size=fba_row_group_size)
     except:
         log.error('Failed to save '+source + "_" + str(year) +' file.')
 
 
-def build_url_for_query(urlinfo):
+def store_flowbyactivity_partitions(result, source):
+    """
+    Prints the data frame into a parquet dataset partitioned by Year, stored as
+    fbaoutputpath/<source>/Year=<year>/<source>_<year>.parquet. Existing partitions for the years in the data
+    frame are replaced, so multi-year panels can be read by getFlowByActivity in a single scan. Each partition
+    is written to a temporary directory and renamed into place, so a failed write keeps the previous partition.
+    """
+    dataset_path = fbaoutputpath + source + '/'
+    for y, df in result.groupby('Year'):
+        path = dataset_path + 'Year=' + str(y)
+        tmp = None
+        try:
+            os.makedirs(dataset_path, exist_ok=True)
+            # pyarrow skips directories starting with '_' when reading the dataset
+            tmp = tempfile.mkdtemp(prefix='_tmp_Year=' + str(y), dir=dataset_path)
+            # the year is stored in the directory name, so is dropped from the file
+            df.drop(columns='Year').reset_index(drop=True).to_parquet(
+                tmp + '/' + source + '_' + str(y) + '.parquet', engine="pyarrow", index=False,
+                row_group_size=fba_row_group_size)
+            old = tmp + '_old'
+            if os.path.isdir(path):
+                os.rename(path, old)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # put the previous partition back
+                if os.path.isdir(old):
+                    os.rename(old, path)
+                raise
+            tmp = None
+            shutil.rmtree(old, ignore_errors=True)
+        except (OSError, ValueError, pa.ArrowException):
+            log.error('Failed to save ' + source + ' partition for ' + str(y) + '.')
+        finally:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+
+def partition_stored_flowbyactivity(source, years):
+    """
+    Copies stored FlowByActivity parquet files, one per year, into the Year-partitioned dataset for the source
+    :param source: str, the code of the datasource
+    :param years: list, a list of years, like [2010, 2015]
+    """
+    for y in years:
+        try:
+            df = pd.read_parquet(fbaoutputpath + source + "_" + str(y) + ".parquet", engine="pyarrow")
+        except FileNotFoundError:
+            log.error("No parquet file found for datasource " + source + " and year " + str(y) + " in flowsa")
+            continue
+        store_flowbyactivity_partitions(df, source)
+
+
+def build_url_for_query(config, args):
     """Creates a base url which requires string substitutions that depend on data source"""
+    urlinfo = config['url']
     # if there are url parameters defined in the yaml, then build a url, else use "base_url"
     if 'url_params' in urlinfo:
         params = ""
@@ -84,50 +160,152 @@ def assemble_urls_for_query(build_url, config, args):
     return urls
 
 
-def call_urls(url_list, args):
+def call_urls(url_list, args, config):
     """This method calls all the urls that have been generated.
     It then calls the processing method to begin processing the returned data. The processing method is specific to
-    the data source, so this function relies on a function in source.py"""
+    the data source, so this function relies on a function in source.py.
+    If 'url_concurrency' is set in the source yaml, up to that many urls are called at once, and each response
+    is processed as it arrives. The returned list is in the same order as the url list.
+    The dataframe of each url is also saved as a parquet shard, so a failed pull can be restarted with --resume,
+    which skips the urls that already have a shard. Shards are only read for the skipped urls, the dataframes
+    of the urls called are used as returned by the call_response_fxn."""
+    if args.get('resume'):
+        urls_to_call = [url for url in url_list if not os.path.isfile(get_url_shard_file(url, args))]
+        log.info("Resuming data pull, " + str(len(url_list) - len(urls_to_call)) + " of " + str(len(url_list)) +
+                 " urls already called")
+    else:
+        urls_to_call = url_list
+
+    called = {}
+    max_workers = int(config.get('url_concurrency', 1))
+    if max_workers <= 1 or len(urls_to_call) <= 1:
+        for url in urls_to_call:
+            called[url] = call_url_to_shard(url, args, config)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(call_url_to_shard, url, args, config): url for url in urls_to_call}
+            for future in as_completed(futures):
+                called[futures[future]] = future.result()
+
     data_frames_list = []
     for url in url_list:
-        log.info("Calling " + url)
-        r = make_http_request(url)
-        if hasattr(sys.modules[__name__], config["call_response_fxn"]):
-            df = getattr(sys.modules[__name__], config["call_response_fxn"])(url, r, args)
-        data_frames_list.append(df)
+        if url in called:
+            data_frames_list.append(called[url])
+        else:
+            data_frames_list.append(pd.read_parquet(get_url_shard_file(url, args), engine="pyarrow"))
     return data_frames_list
 
 
-def parse_data(dataframe_list, args):
+def call_url(url, args, config):
+    """Calls a single url and converts the response to a dataframe with the source specific call_response_fxn"""
+    log.info("Calling " + url)
+    r = make_http_request(url, cache_ttl=config.get('http_cache_ttl'), offline=args.get('offline'))
+    if hasattr(sys.modules[__name__], config["call_response_fxn"]):
+        df = getattr(sys.modules[__name__], config["call_response_fxn"])(url, r, args)
+    return df
+
+
+def call_url_to_shard(url, args, config):
+    """
+    Calls a single url and saves the dataframe as a parquet shard. If the shard can not be saved, the pull
+    continues, but the url is called again if the pull is resumed.
+    :return: the dataframe of the url
+    """
+    df = call_url(url, args, config)
+    if not isinstance(df, pd.DataFrame):
+        return df
+    f = get_url_shard_file(url, args)
+    try:
+        os.makedirs(os.path.dirname(f), exist_ok=True)
+        df.to_parquet(f + '.tmp', engine="pyarrow")
+        os.replace(f + '.tmp', f)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        log.error("Unable to save a shard for " + url + ": " + str(e))
+    return df
+
+
+def get_url_shard_file(url, args):
+    """Path of the parquet shard for a url, stored in fba_shard_path by source and year"""
+    return fba_shard_path + args['source'] + '_' + args['year'] + '/' + \
+           hashlib.sha256(url.encode('utf-8')).hexdigest() + '.parquet'
+
+
+def clear_url_shards(args):
+    """Deletes the parquet shards of a source and year, once the flowbyactivity is stored"""
+    shutil.rmtree(fba_shard_path + args['source'] + '_' + args['year'], ignore_errors=True)
+
+
+def parse_data(dataframe_list, args, config):
     """Calls on functions defined in source.py files, as parsing rules are specific to the data source."""
     if hasattr(sys.modules[__name__], config["parse_response_fxn"]):
         df = getattr(sys.modules[__name__], config["parse_response_fxn"])(dataframe_list, args)
         return df
 
 
-if __name__ == '__main__':
-    # assign arguments
-    args = parse_args()
+def store_streamed_partition(urls, args, config):
+    """
+    Calls the partition_response_fxn of a source, which parses a url response one chunk at a time and writes it
+    straight to the Year partition of the source, so the full dataset is never held in memory
+    :return: int, number of rows stored
+    """
+    if len(urls) != 1:
+        log.error("Only sources with a single url can be streamed, " + args['source'] + " has " + str(len(urls)))
+        return 0
+    r = make_http_request(urls[0], cache_ttl=config.get('http_cache_ttl'), offline=args.get('offline'))
+    return getattr(sys.modules[__name__], config["partition_response_fxn"])(r, args)
+
+
+def main(source, year, partitioned=False, offline=False, resume=False, stream=False):
+    """
+    Pulls, parses and stores a FlowByActivity dataset
+    :param source: str, data source code, matching a source yaml in sourceconfig
+    :param year: str, year of data to pull
+    :param partitioned: bool, also save to the Year-partitioned dataset for the source
+    :param offline: bool, only use responses stored in the http cache
+    :param resume: bool, skip urls called by a previous, failed pull
+    :param stream: bool, only save to the Year-partitioned dataset, parsing the response in chunks with the
+    partition_response_fxn of the source, see store_streamed_partition
+    :return: the flowbyactivity df, or None if streamed
+    """
+    args = {'source': source, 'year': str(year), 'partitioned': partitioned, 'offline': offline,
+            'resume': resume}
     # assign yaml parameters (common.py fxn)
     config = load_sourceconfig(args['source'])
     # build the base url with strings that will be replaced
-    build_url = build_url_for_query(config['url'])
+    build_url = build_url_for_query(config, args)
     # replace parts of urls with specific instructions from source.py
     urls = assemble_urls_for_query(build_url, config, args)
+    if stream:
+        if "partition_response_fxn" not in config:
+            log.error(args['source'] + " has no partition_response_fxn, so can not be streamed")
+        else:
+            store_streamed_partition(urls, args, config)
+        return None
     # create a list with data from all source urls
-    dataframe_list = call_urls(urls, args)
+    dataframe_list = call_urls(urls, args, config)
     # concat the dataframes and parse data with specific instructions from source.py
-    df = parse_data(dataframe_list, args)
+    df = parse_data(dataframe_list, args, config)
     # log that data was retrieved
     log.info("Retrieved data for " + args['source'])
     # add any missing columns of data and cast to appropriate data type
     flow_df = add_missing_flow_by_fields(df, flow_by_activity_fields)
-    # modify flow units
-    flow_df = convert_fba_unit(flow_df)
+    # modify flow units, keeping the categorical schema of the modified columns
+    flow_df = conform_categorical_fields(convert_fba_unit(flow_df))
     # sort df and reset index
     flow_df = flow_df.sort_values(['Class', 'Location', 'ActivityProducedBy', 'ActivityConsumedBy', 'FlowName',
                                    'Compartment']).reset_index(drop=True)
     # save as parquet file
     parquet_name = args['source'] + '_' + args['year']
     store_flowbyactivity(flow_df, parquet_name)
+    if args['partitioned']:
+        store_flowbyactivity_partitions(flow_df, args['source'])
+    # remove the url shards of the completed pull
+    clear_url_shards(args)
+    return flow_df
+
 
+if __name__ == '__main__':
+    # assign arguments
+    args = parse_args()
+    main(args['source'], args['year'], partitioned=args['partitioned'], offline=args['offline'],
+         resume=args['resume'], stream=args['stream'])
@@ -5,9 +5,12 @@ Helper functions for flowbyactivity and flowbysector data
 import flowsa
 import pandas as pd
 import numpy as np
-from flowsa.common import log, get_county_FIPS, get_state_FIPS, US_FIPS, activity_fields, \
+from flowsa.common import log, get_county_FIPS, get_state_FIPS, get_geoscale_FIPS, US_FIPS, activity_fields, \
     flow_by_activity_fields, flow_by_sector_fields, load_sector_crosswalk, sector_source_name, \
-    get_flow_by_groupby_cols, create_fill_na_dict, generalize_activity_field_names
+    get_flow_by_groupby_cols, create_fill_na_dict, generalize_activity_field_names, cast_flow_by_field, \
+    fill_missing_values, missing_flow_by_field, convert_units
+from flowsa.profiling import profile_stage
+import flowsa.profiling
 
 fba_activity_fields = [activity_fields['ProducedBy'][0]['flowbyactivity'],
                        activity_fields['ConsumedBy'][0]['flowbyactivity']]
@@ -34,15 +37,7 @@ def create_geoscale_list(df, geoscale, year='2015'):
     # filter by geoscale depends on Location System
     fips = []
     if df['LocationSystem'].str.contains('FIPS').any():
-        # all_FIPS = read_stored_FIPS()
-        if geoscale == "national":
-            fips.append(US_FIPS)
-        elif geoscale == "state":
-            state_FIPS = get_state_FIPS(year)
-            fips = list(state_FIPS['FIPS'])
-        elif geoscale == "county":
-            county_FIPS = get_county_FIPS(year)
-            fips = list(county_FIPS['FIPS'])
+        fips = get_geoscale_FIPS(geoscale, year)
 
     return fips
 
@@ -99,21 +94,20 @@ def agg_by_geoscale(df, from_scale, to_scale, groupbycolumns, activitynames):
     return fba_agg
 
 
-def aggregator(df, groupbycols):
+def aggregator(df, groupbycols, legacy_weighted_avg=False):
     """
-    Aggregates flowbyactivity or flowbysector df by given groupbycols
+    Aggregates flowbyactivity or flowbysector df by given groupbycols. Flow amounts are summed and the data quality
+    columns are averaged, weighted by the flow amounts. The weighted averages are calculated as sum(w*x)/sum(w) from
+    a single groupby sum. Groups with flow amounts that sum to zero take the unweighted average, and a missing value
+    or flow amount in a group makes that group's average missing.
 
     :param df: Either flowbyactivity or flowbysector
     :param groupbycols: Either flowbyactivity or flowbysector columns
+    :param legacy_weighted_avg: bool, True to calculate the weighted averages with np.ma.average for each group,
+    which returns nan or inf for groups with flow amounts that sum to zero
     :return:
     """
 
-    # weighted average function
-    try:
-        wm = lambda x: np.ma.average(x, weights=df.loc[x.index, "FlowAmount"])
-    except ZeroDivisionError:
-        wm = 0
-
     # list of column headers, that if exist in df, should be aggregated using the weighted avg fxn
     possible_column_headers = ('Spread', 'Min', 'Max', 'DataReliability', 'TemporalCorrelation',
                                'GeographicCorrelation', 'TechnologicalCorrelation', 'DataCollection')
@@ -121,35 +115,80 @@ def aggregator(df, groupbycols):
     # list of column headers that do exist in the df being aggregated
     column_headers = [e for e in possible_column_headers if e in df.columns.values.tolist()]
 
-    # initial dictionary of how a column should be aggregated
-    agg_funx = {"FlowAmount": "sum"}
+    if legacy_weighted_avg:
+        # weighted average function
+        wm = lambda x: np.ma.average(x, weights=df.loc[x.index, "FlowAmount"])
 
-    # add columns to the aggregation dictionary that should be aggregated using a weighted avg
-    for e in column_headers:
-        agg_funx.update({e: wm})
+        # initial dictionary of how a column should be aggregated
+        agg_funx = {"FlowAmount": "sum"}
 
-    # aggregate df by groupby columns, either summing or creating weighted averages
-    df_dfg = df.groupby(groupbycols, as_index=False).agg(agg_funx)
+        # add columns to the aggregation dictionary that should be aggregated using a weighted avg
+        for e in column_headers:
+            agg_funx.update({e: wm})
+
+        # aggregate df by groupby columns, either summing or creating weighted averages
+        df_dfg = df.groupby(groupbycols, as_index=False, observed=True).agg(agg_funx)
+
+        return df_dfg
+
+    # columns to sum for each group: the flow amount, and for each weighted column the weighted values,
+    # the values, and a count of the rows with missing values or weights
+    weights = df['FlowAmount'].astype(float)
+    sum_cols = {'FlowAmount': df['FlowAmount'], 'weight': weights, 'count': 1}
+    for e in column_headers:
+        values = df[e].astype(float)
+        sum_cols[e + '_weighted'] = values * weights
+        sum_cols[e + '_value'] = values
+        sum_cols[e + '_missing'] = (values.isna() | weights.isna()).astype(int)
+    df_sums = pd.concat([df[groupbycols], pd.DataFrame(sum_cols, index=df.index)], axis=1)
+    df_sums = df_sums.groupby(groupbycols, as_index=False, observed=True).sum()
+
+    df_dfg = df_sums[groupbycols + ['FlowAmount']].copy()
+    weight_sum = df_sums['weight'].values
+    for e in column_headers:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg = np.where(weight_sum != 0, df_sums[e + '_weighted'].values / weight_sum,
+                           df_sums[e + '_value'].values / df_sums['count'].values)
+        avg[df_sums[e + '_missing'].values > 0] = np.nan
+        df_dfg[e] = avg
 
     return df_dfg
 
 
 def add_missing_flow_by_fields(flowby_partial_df, flowbyfields):
     """
-    Add in missing fields to have a complete and ordered
+    Add in missing fields to have a complete and ordered df. Only the columns whose data type differs from the
+    field are cast, and the missing columns are created at once. The df passed in is not modified, and the
+    returned df shares its unchanged columns. With profiling on, the bytes of the cast and created columns are
+    recorded as the bytes copied by the stage, see flowsa.profiling
     :param flowby_partial_df: Either flowbyactivity or flowbysector df
     :param flowbyfields: Either flow_by_activity_fields or flow_by_sector_fields
     :return:
     """
-    for k in flowbyfields.keys():
-        if k not in flowby_partial_df.columns:
-            flowby_partial_df[k] = None
-    # convert data types to match those defined in flow_by_activity_fields
-    for k, v in flowbyfields.items():
-        flowby_partial_df[k] = flowby_partial_df[k].astype(v[0]['dtype'])
-    # Resort it so order is correct
-    flowby_partial_df = flowby_partial_df[flowbyfields.keys()]
-    return flowby_partial_df
+    with profile_stage('add_missing_flow_by_fields', flowby_partial_df) as record:
+        columns = []
+        copied = []
+        for k, v in flowbyfields.items():
+            if k in flowby_partial_df.columns:
+                s = flowby_partial_df[k]
+                # convert data types to match those defined in flowbyfields, or to categories (see common.py)
+                cast = cast_flow_by_field(s, k, v[0]['dtype'])
+                if cast is not s:
+                    copied.append(cast)
+            else:
+                cast = missing_flow_by_field(k, v[0]['dtype'], flowby_partial_df.index)
+                copied.append(cast)
+            columns.append(cast)
+        if len(copied) == 0 and list(flowby_partial_df.columns) == list(flowbyfields.keys()):
+            # a new df sharing the data, so columns assigned to the returned df are not added to the df passed in
+            df = flowby_partial_df.copy(deep=False)
+        else:
+            # the columns are put together without copying them, in the order of the fields
+            df = pd.concat(columns, axis=1, copy=False)
+        record['rows_out'] = len(df)
+        if flowsa.profiling.profiling_enabled:
+            record['bytes_copied'] = int(sum(c.memory_usage(index=False, deep=True) for c in copied))
+    return df
 
 
 def check_flow_by_fields(flowby_df, flowbyfields):
@@ -262,7 +301,7 @@ def check_if_location_systems_match(df1, df2):
     :return:
     """
 
-    if df1["LocationSystem"].all() == df2["LocationSystem"].all():
+    if set(df1["LocationSystem"].unique()) == set(df2["LocationSystem"].unique()):
         log.info("LocationSystems match")
     else:
         log.warning("LocationSystems do not match")
@@ -310,30 +349,17 @@ def check_if_data_exists_for_same_geoscales(fba_wsec_walloc, source, activity):
 
 def harmonize_units(df):
     """
-    Convert unit to standard
+    Convert unit to standard, with the 'harmonize' conversions of the unit registry (see common.convert_units)
     :param df: Either flowbyactivity or flowbysector
     :return: Df with standarized units
     """
     # class = employment, unit = 'p'
     # class = energy, unit = MJ
     # class = land, unit = m2/yr
-    df['FlowAmount'] = np.where(df['Unit'] == 'ACRES', df['FlowAmount'] * 4046.8564224, df['FlowAmount'])
-    df['Unit'] = np.where(df['Unit'] == 'ACRES', 'm2.yr', df['Unit'])
-
     # class = money, unit = USD/yr
-
     # class = water, unit = m3/yr
-    df['FlowAmount'] = np.where(df['Unit'] == 'gallons/animal/day', (df['FlowAmount'] / 264.172052) * 365,
-                                df['FlowAmount'])
-    df['Unit'] = np.where(df['Unit'] == 'gallons/animal/day', 'm3.p.yr', df['Unit'])
-
-    df['FlowAmount'] = np.where(df['Unit'] == 'ACRE FEET / ACRE', (df['FlowAmount'] / 4046.856422) * 1233.481837,
-                                df['FlowAmount'])
-    df['Unit'] = np.where(df['Unit'] == 'ACRE FEET / ACRE', 'm3.m2.yr', df['Unit'])
-
     # class = other, unit varies
-
-    return df
+    return convert_units(df, 'harmonize')
 
 
 def allocate_by_sector(df_w_sectors, allocation_method):
@@ -369,13 +395,12 @@ def allocate_by_sector(df_w_sectors, allocation_method):
         return allocation_df
 
 
-def allocation_helper(df_w_sector, method, attr):
+def load_allocation_helper(method, attr):
     """
-    Used when two df required to create allocation ratio
-    :param df_w_sector:
-    :param method: currently written for 'multiplication'
-    :param attr:
-    :return:
+    Loads the helper flowbyactivity used to modify an allocation dataset, with sectors
+    :param method: dictionary of the flowbysector method yaml
+    :param attr: dictionary of the activity set settings in the method yaml
+    :return: helper df with sectors and a 'HelperFlow' column
     """
 
     from flowsa.mapping import add_sectors_to_flowbyactivity
@@ -384,7 +409,7 @@ def allocation_helper(df_w_sector, method, attr):
                                                  datasource=attr['helper_source'],
                                                  years=[attr['helper_source_year']])
     # fill null values
-    helper_allocation = helper_allocation.fillna(value=fba_fill_na_dict)
+    helper_allocation = fill_missing_values(helper_allocation, fba_fill_na_dict)
     # convert unit
     helper_allocation = harmonize_units(helper_allocation)
 
@@ -399,6 +424,24 @@ def allocation_helper(df_w_sector, method, attr):
     # rename column
     helper_allocation = helper_allocation.rename(columns={"FlowAmount": 'HelperFlow'})
 
+    return helper_allocation
+
+
+def allocation_helper(df_w_sector, method, attr, helper_allocation=None):
+    """
+    Used when two df required to create allocation ratio
+    :param df_w_sector:
+    :param method: currently written for 'multiplication'
+    :param attr:
+    :param helper_allocation: helper df, see load_allocation_helper, loaded if None
+    :return:
+    """
+
+    if helper_allocation is None:
+        helper_allocation = load_allocation_helper(method, attr)
+    else:
+        helper_allocation = helper_allocation.copy()
+
     # merge allocation df with helper df based on sectors, depending on geo scales of dfs
     if attr['helper_from_scale'] == 'national':
         modified_fba_allocation = df_w_sector.merge(helper_allocation[['Sector', 'HelperFlow']], how='left')
@@ -445,10 +488,10 @@ def sector_aggregation_generalized(fbs_df, group_cols):
             # only keep data with length greater than i
             agg_sectors = agg_sectors.loc[agg_sectors['Sector'].apply(lambda x: len(x) > i)]
             agg_sectors['Sector'] = agg_sectors['Sector'].apply(lambda x: str(x[0:i]))
-            agg_sectors = agg_sectors.fillna(0).reset_index()
+            agg_sectors = fill_missing_values(agg_sectors, 0).reset_index()
             # aggregate the new sector flow amounts
             agg_sectors = aggregator(agg_sectors, group_cols)
-            agg_sectors = agg_sectors.fillna(0).reset_index(drop=True)
+            agg_sectors = fill_missing_values(agg_sectors, 0).reset_index(drop=True)
             # append to df
             fbs_df = fbs_df.append(agg_sectors, sort=True)
 
@@ -460,15 +503,78 @@ def sector_aggregation_generalized(fbs_df, group_cols):
 
 def sector_aggregation(df, group_cols):
     """
-    Function that checks if a sector length exists, and if not, sums the less aggregated sector
+    Function that checks if a sector length exists, and if not, sums the less aggregated sector.
+    Sector lengths are computed once and the parent sector pairs of each level are matched with a merge, so each
+    sector level is created with a single groupby. Results match sector_aggregation_legacy.
     :param df: Either a flowbyactivity df with sectors or a flowbysector df
     :param group_cols: columns by which to aggregate
     :return:
     """
 
-    # testing
-    # df = fbs.copy()
-    # group_cols = fbs_default_grouping_fields.copy()
+    sp, sc = fbs_activity_fields[0], fbs_activity_fields[1]
+
+    # drop any columns that contain a "-" in sector column
+    df = df[(~df[sp].str.contains('-', regex=True)) |
+            (~df[sc].str.contains('-', regex=True))]
+
+    # sector lengths, extended as aggregated rows are appended to df
+    sp_len = df[sp].str.len().values
+    sc_len = df[sc].str.len().values
+    # find the longest length sector
+    length = max(sp_len.max(), sc_len.max()) if len(df) > 0 else 0
+    # for loop in reverse order longest length naics minus 1 to 2
+    # appends missing naics levels to df
+    for i in range(length - 1, 1, -1):
+        # subset df to sectors with length = i and length = i + 1
+        in_subset = ((sp_len >= i) & (sp_len <= i + 1)) | ((sc_len >= i) & (sc_len <= i + 1))
+        df_subset = df.iloc[np.flatnonzero(in_subset)]
+        subset_sp_len = sp_len[in_subset]
+        subset_sc_len = sc_len[in_subset]
+        # i digit sector pairs in the df subset, in order of first appearance
+        sector_list = pd.DataFrame({sp: df_subset[sp].str[0:i].values,
+                                    sc: df_subset[sc].str[0:i].values}).drop_duplicates()
+        # sector pairs that are exactly i digits long
+        is_existing = (subset_sp_len == i) & (subset_sc_len == i)
+        existing_sectors = pd.MultiIndex.from_arrays([df_subset[sp].values[is_existing],
+                                                      df_subset[sc].values[is_existing]])
+        missing_sectors = sector_list[~pd.MultiIndex.from_frame(sector_list).isin(existing_sectors)]
+        missing_sectors = missing_sectors.reset_index(drop=True).rename_axis('pair').reset_index()
+        if len(missing_sectors) != 0:
+            # rows with sectors longer than i that start with a missing sector pair. A pair is shorter than
+            # i digits where the sector is, so match on the first len(pair) digits of the sectors
+            candidates = df_subset.iloc[np.flatnonzero(subset_sp_len > i)]
+            matches = []
+            for (x_len, y_len), pairs in missing_sectors.groupby([missing_sectors[sp].str.len(),
+                                                                 missing_sectors[sc].str.len()], sort=False):
+                keys = pd.DataFrame({sp: candidates[sp].str[0:x_len].values,
+                                     sc: candidates[sc].str[0:y_len].values,
+                                     'row': np.arange(len(candidates))})
+                matches.append(keys.merge(pairs, on=[sp, sc])[['pair', 'row']])
+            # keep the rows in order of the missing sector pairs, so flows are summed in the same order
+            matches = pd.concat(matches).sort_values(['pair', 'row'], kind='mergesort')
+            agg_sectors = candidates.iloc[matches['row'].values].copy()
+            agg_sectors[sp] = agg_sectors[sp].str[0:i]
+            agg_sectors[sc] = agg_sectors[sc].str[0:i]
+            agg_sectors = fill_missing_values(agg_sectors, 0).reset_index(drop=True)
+            # aggregate the new sector flow amounts
+            agg_sectors = aggregator(agg_sectors, group_cols)
+            agg_sectors = fill_missing_values(agg_sectors, 0).reset_index(drop=True)
+            # append to df
+            df = pd.concat([df, agg_sectors]).reset_index(drop=True)
+            sp_len = np.concatenate([sp_len, agg_sectors[sp].str.len().values])
+            sc_len = np.concatenate([sc_len, agg_sectors[sc].str.len().values])
+
+    return replace_non_naics_sector_codes(df)
+
+
+def sector_aggregation_legacy(df, group_cols):
+    """
+    Loop based version of sector_aggregation, which builds the missing sector pairs of each level as lists and
+    subsets the df once per missing pair. Kept to compare results and run time against sector_aggregation.
+    :param df: Either a flowbyactivity df with sectors or a flowbysector df
+    :param group_cols: columns by which to aggregate
+    :return:
+    """
 
     # drop any columns that contain a "-" in sector column
     df = df[(~df[fbs_activity_fields[0]].str.contains('-', regex=True)) |
@@ -491,7 +597,7 @@ def sector_aggregation(df, group_cols):
         # create a list of sectors that are exactly i digits long
         df_existing = sector_subset.copy()
         for col in df_existing:
-            df_existing[col] = df_existing.loc[df_existing[col].apply(lambda x: len(x) == i)]
+            df_existing[col] = df_existing[col].where(df_existing[col].apply(lambda x: len(x) == i))
         existing_sectors = df_existing.drop_duplicates().dropna().values.tolist()
         # list of sectors of length i that are not in sector list
         missing_sectors = [e for e in sector_list if e not in existing_sectors]
@@ -508,13 +614,22 @@ def sector_aggregation(df, group_cols):
             agg_sectors = agg_sectors.loc[agg_sectors[fbs_activity_fields[0]].apply(lambda x: len(x) > i)]
             agg_sectors[fbs_activity_fields[0]] = agg_sectors[fbs_activity_fields[0]].apply(lambda x: str(x[0:i]))
             agg_sectors[fbs_activity_fields[1]] = agg_sectors[fbs_activity_fields[1]].apply(lambda x: str(x[0:i]))
-            agg_sectors = agg_sectors.fillna(0).reset_index()
+            agg_sectors = fill_missing_values(agg_sectors, 0).reset_index()
             # aggregate the new sector flow amounts
             agg_sectors = aggregator(agg_sectors, group_cols)
-            agg_sectors = agg_sectors.fillna(0).reset_index(drop=True)
+            agg_sectors = fill_missing_values(agg_sectors, 0).reset_index(drop=True)
             # append to df
-            df = df.append(agg_sectors).reset_index(drop=True)
+            df = pd.concat([df, agg_sectors]).reset_index(drop=True)
+
+    return replace_non_naics_sector_codes(df)
+
 
+def replace_non_naics_sector_codes(df):
+    """
+    Replaces the truncated non-NAICS codes created by sector aggregation, drops duplicates, and sorts the df
+    :param df: flowbysector df
+    :return:
+    """
     # manually modify non-NAICS codes that might exist in sector
     df['SectorConsumedBy'] = np.where(df['SectorConsumedBy'].isin(['F0', 'F01']),
                                       'F010', df['SectorConsumedBy'])  # domestic/household
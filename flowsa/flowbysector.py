@@ -12,28 +12,49 @@ Example: "Parameters: --m Water_national_2015_m1"
 """
 
 import flowsa
+import os
+import glob
+import json
+import hashlib
 import yaml
 import argparse
 import sys
 import pandas as pd
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
 from flowsa.common import log, flowbyactivitymethodpath, flow_by_sector_fields, load_household_sector_codes, \
     generalize_activity_field_names, fbsoutputpath, fips_number_key, load_sector_length_crosswalk, \
-    flow_by_activity_fields
+    flow_by_activity_fields, get_FIPS_index, datapath, modulepath, fbs_shard_path, categorical_read_args, \
+    conform_categorical_fields, fill_missing_values, set_categorical_schema
 from flowsa.mapping import add_sectors_to_flowbyactivity, get_fba_allocation_subset, map_elementary_flows, \
-    get_sector_list, add_non_naics_sectors
+    get_sector_list, add_non_naics_sectors, get_sector_mapping
 from flowsa.flowbyfunctions import fba_activity_fields, fbs_default_grouping_fields, agg_by_geoscale, \
     fba_fill_na_dict, fbs_fill_na_dict, harmonize_units, fba_default_grouping_fields, \
     add_missing_flow_by_fields, fbs_activity_fields, allocate_by_sector, allocation_helper, sector_aggregation, \
     filter_by_geoscale, aggregator, check_if_data_exists_at_geoscale, check_if_location_systems_match, \
-    check_if_data_exists_at_less_aggregated_geoscale, check_if_data_exists_for_same_geoscales
+    check_if_data_exists_at_less_aggregated_geoscale, check_if_data_exists_for_same_geoscales, load_allocation_helper
 from flowsa.USGS_NWIS_WU import usgs_fba_data_cleanup, usgs_fba_w_sectors_data_cleanup
 from flowsa.datachecks import sector_flow_comparision
+from flowsa.profiling import profile_stage, profile_context_node, enable_profiling, clear_profile, count_rows, \
+    write_profile_report, stage_records
+import flowsa.profiling
+import flowsa.common
 
 
 def parse_args():
     """Make year and source script parameters"""
     ap = argparse.ArgumentParser()
     ap.add_argument("-m", "--method", required=True, help="Method for flow by sector file. A valid method config file must exist with this name.")
+    ap.add_argument("-w", "--workers", type=int, default=1,
+                    help="Number of method steps run at once in separate processes")
+    ap.add_argument("--plan", action='store_true',
+                    help="Print the steps of the method and their estimated sizes without running them")
+    ap.add_argument("--full", action='store_true',
+                    help="Create every activity set, even those with stored data and unchanged inputs")
+    ap.add_argument("--profile", action='store_true',
+                    help="Save the time and memory of each stage next to the flowbysector parquet")
+    ap.add_argument("--categorical", action='store_true',
+                    help="Store and process the text fields as categories, see common.categorical_schema")
     args = vars(ap.parse_args())
     return args
 
@@ -62,289 +83,791 @@ def store_flowbysector(fbs_df, parquet_name):
         log.error('Failed to save ' + parquet_name + ' file.')
 
 
-def main(method_name):
+def load_method_flowbyactivity(k, v):
     """
-    Creates a flowbysector dataset
-    :param method_name: Name of method corresponding to flowbysector method yaml name
-    :return: flowbysector
-    """
-
-    log.info("Initiating flowbysector creation for " + method_name)
-    # call on method
-    method = load_method(method_name)
-    # create dictionary of water data and allocation datasets
-    fbas = method['flowbyactivity_sources']
-    # Create empty list for storing fbs files
-    fbss = []
-    for k, v in fbas.items():
-        # pull water data for allocation
-        log.info("Retrieving flowbyactivity for datasource " + k + " in year " + str(v['year']))
-        flows = flowsa.getFlowByActivity(flowclass=[v['class']],
-                                         years=[v['year']],
-                                         datasource=k)
-
-        # clean up fba, if specified in yaml
-        if v["clean_fba_df_fxn"] != 'None':
-            log.info("Cleaning up " + k + " FlowByActivity")
-            flows = getattr(sys.modules[__name__], v["clean_fba_df_fxn"])(flows)
-
-        # ensure datatypes correct
-        flows = add_missing_flow_by_fields(flows, flow_by_activity_fields)
-
-        # drop description field
-        flows = flows.drop(columns='Description')
-        # fill null values
-        flows = flows.fillna(value=fba_fill_na_dict)
-
-        # map df to elementary flows - commented out until mapping complete
-        # log.info("Mapping flows in " + k + ' to federal elementary flow list')
-        # flows_mapped = map_elementary_flows(flows, k)
-
-        # create dictionary of allocation datasets for different activities
-        activities = v['activity_sets']
-        # subset activity data and allocate to sector
-        for aset, attr in activities.items():
-            # subset by named activities
-            names = [attr['names']]
-            log.info("Preparing to handle subset of flownames " + ', '.join(map(str, names)) + " in " + k)
-            # subset usgs data by activity
-            flow_subset = flows[(flows[fba_activity_fields[0]].isin(names)) |
-                                (flows[fba_activity_fields[1]].isin(names))].reset_index(drop=True)
-
-            # check if flowbyactivity data exists at specified geoscale to use
-            log.info("Checking if flowbyactivity data exists for " + ', '.join(map(str, names)) + " at the " +
-                     v['geoscale_to_use'] + ' level')
-            geocheck = check_if_data_exists_at_geoscale(flow_subset, names, v['geoscale_to_use'])
-            # aggregate geographically to the scale of the allocation dataset
-            if geocheck == "Yes":
-                activity_from_scale = v['geoscale_to_use']
-            else:
-                # if activity does not exist at specified geoscale, issue warning and use data at less aggregated
-                # geoscale, and sum to specified geoscale
-                log.info("Checking if flowbyactivity data exists for " + ', '.join(map(str, names)) + " at a less aggregated level")
-                new_geoscale_to_use = check_if_data_exists_at_less_aggregated_geoscale(flow_subset, names,
-                                                                                       v['geoscale_to_use'])
-                activity_from_scale = new_geoscale_to_use
-
-            activity_to_scale = attr['allocation_from_scale']
-            # if usgs is less aggregated than allocation df, aggregate usgs activity to target scale
-            if fips_number_key[activity_from_scale] > fips_number_key[activity_to_scale]:
-                log.info("Aggregating subset from " + activity_from_scale + " to " + activity_to_scale)
-                flow_subset = agg_by_geoscale(flow_subset, activity_from_scale, activity_to_scale, fba_default_grouping_fields, names)
-            # else, aggregate to geoscale want to use
-            elif fips_number_key[activity_from_scale] > fips_number_key[v['geoscale_to_use']]:
-                log.info("Aggregating subset from " + activity_from_scale + " to " + v['geoscale_to_use'])
-                flow_subset = agg_by_geoscale(flow_subset, activity_from_scale, v['geoscale_to_use'], fba_default_grouping_fields, names)
-            # else, if usgs is more aggregated than allocation table, filter relevant rows
-            else:
-                log.info("Filtering out " + activity_from_scale + " data")
-                flow_subset = filter_by_geoscale(flow_subset, activity_from_scale, names)
-
-            # location column pad zeros if necessary
-            flow_subset['Location'] = flow_subset['Location'].apply(lambda x: x.ljust(3 + len(x), '0') if len(x) < 5
-                                                                    else x)
-
-            # Add sectors to usgs activity, depending on level of specified sector aggregation
-            log.info("Adding sectors to " + k + " for " + ', '.join(map(str, names)))
-            if attr['allocation_sector_aggregation'] == 'agg':
-                flow_subset_wsec = add_sectors_to_flowbyactivity(flow_subset,
-                                                                 sectorsourcename=method['target_sector_source'],
-                                                                 levelofSectoragg='agg')
-            else:
-                flow_subset_wsec = add_sectors_to_flowbyactivity(flow_subset,
-                                                                 sectorsourcename=method['target_sector_source'])
-
-            # clean up fba with sectors, if specified in yaml
-            if v["clean_fba_w_sec_df_fxn"] != 'None':
-                log.info("Cleaning up " + k + " FlowByActivity with sectors")
-                flow_subset_wsec = getattr(sys.modules[__name__], v["clean_fba_w_sec_df_fxn"])(flow_subset_wsec)
-
-            # if allocation method is "direct", then no need to create alloc ratios, else need to use allocation
-            # dataframe to create sector allocation ratios
-            if attr['allocation_method'] == 'direct':
-                # if direct allocation, drop rows of data where an activity in either activity column is not in the
-                # direct allocation list. These non-direct activities are captured in other activity allocations
-                fbs = flow_subset_wsec.copy()
-                if "filter_activities" in attr:
-                    for i in attr["filter_activities"]:
-                        fbs = fbs.loc[~fbs[fba_activity_fields[0]].str.contains(i)]
-                        fbs = fbs.loc[~fbs[fba_activity_fields[1]].str.contains(i)].reset_index(drop=True)
-
-            else:
-                # determine appropriate allocation dataset
-                log.info("Loading allocation flowbyactivity " + attr['allocation_source'] + " for year " + str(attr['allocation_source_year']))
-                fba_allocation = flowsa.getFlowByActivity(flowclass=[attr['allocation_source_class']],
-                                                          datasource=attr['allocation_source'],
-                                                          years=[attr['allocation_source_year']]).reset_index(drop=True)
-                # ensure correct data types
-                fba_allocation = add_missing_flow_by_fields(fba_allocation, flow_by_activity_fields)
-
-                # fill null values
-                fba_allocation = fba_allocation.fillna(value=fba_fill_na_dict)
-                # harmonize units across dfs
-                fba_allocation = harmonize_units(fba_allocation)
-
-                # subset based on yaml settings
-                if attr['allocation_flow'] != 'None':
-                    fba_allocation = fba_allocation.loc[fba_allocation['FlowName'].isin(attr['allocation_flow'])]
-                if attr['allocation_compartment'] != 'None':
-                    fba_allocation = fba_allocation.loc[
-                        fba_allocation['Compartment'].isin(attr['allocation_compartment'])]
-                # reset index
-                fba_allocation = fba_allocation.reset_index(drop=True)
-
-                # check if allocation data exists at specified geoscale to use
-                log.info("Checking if" + " allocation data exists for " + ', '.join(map(str, names)) +
-                         " at the " + attr['allocation_from_scale'] + " level")
-                check_if_data_exists_at_geoscale(fba_allocation, names, attr['allocation_from_scale'])
-
-                # aggregate geographically to the scale of the flowbyactivty source, if necessary
-                from_scale = attr['allocation_from_scale']
-                to_scale = v['geoscale_to_use']
-                # if allocation df is less aggregated than FBA df, aggregate allocation df to target scale
-                if fips_number_key[from_scale] > fips_number_key[to_scale]:
-                    fba_allocation = agg_by_geoscale(fba_allocation, from_scale, to_scale, fba_default_grouping_fields, names)
-                # else, if usgs is more aggregated than allocation table, use usgs as both to and from scale
-                else:
-                    fba_allocation = filter_by_geoscale(fba_allocation, from_scale, names)
-
-                # assign sector to allocation dataset
-                log.info("Adding sectors to " + attr['allocation_source'])
-                fba_allocation = add_sectors_to_flowbyactivity(fba_allocation,
-                                                               sectorsourcename=method['target_sector_source'],
-                                                               levelofSectoragg=attr[
-                                                                   'allocation_sector_aggregation'])
-                # subset fba datsets to only keep the naics associated with usgs activity subset
-                log.info("Subsetting " + attr['allocation_source'] + " for sectors in " + k)
-                fba_allocation_subset = get_fba_allocation_subset(fba_allocation, k, names)
-                # Reset index values after subset
-                fba_allocation_subset = fba_allocation_subset.reset_index(drop=True)
-                # generalize activity field names to enable link to water withdrawal table
-                log.info("Generalizing activity names in subset of " + attr['allocation_source'])
-                fba_allocation_subset = generalize_activity_field_names(fba_allocation_subset)
-                # drop columns
-                fba_allocation_subset = fba_allocation_subset.drop(columns=['Activity'])
-
-                # if there is an allocation helper dataset, modify allocation df
+    Loads and cleans the flowbyactivity df of a flowbyactivity source in a method
+    :param k: name of the flowbyactivity source
+    :param v: dictionary of the flowbyactivity source settings in the method yaml
+    :return: flowbyactivity df
+    """
+    # pull water data for allocation
+    log.info("Retrieving flowbyactivity for datasource " + k + " in year " + str(v['year']))
+    flows = flowsa.getFlowByActivity(flowclass=[v['class']],
+                                     years=[v['year']],
+                                     datasource=k)
+
+    # clean up fba, if specified in yaml
+    if v["clean_fba_df_fxn"] != 'None':
+        log.info("Cleaning up " + k + " FlowByActivity")
+        flows = getattr(sys.modules[__name__], v["clean_fba_df_fxn"])(flows)
+
+    # ensure datatypes correct
+    flows = add_missing_flow_by_fields(flows, flow_by_activity_fields)
+
+    # drop description field
+    flows = flows.drop(columns='Description')
+    # fill null values
+    flows = fill_missing_values(flows, fba_fill_na_dict)
+
+    # map df to elementary flows - commented out until mapping complete
+    # log.info("Mapping flows in " + k + ' to federal elementary flow list')
+    # flows_mapped = map_elementary_flows(flows, k)
+
+    return flows
+
+
+def load_allocation_flowbyactivity(method, v, attr, names):
+    """
+    Loads the allocation flowbyactivity of an activity set, aggregated to the geoscale of the flowbyactivity source
+    and with sectors
+    :param method: dictionary of the flowbysector method yaml
+    :param v: dictionary of the flowbyactivity source settings in the method yaml
+    :param attr: dictionary of the activity set settings in the method yaml
+    :param names: list of the activity names using the allocation data
+    :return: allocation flowbyactivity df with sectors
+    """
+    # determine appropriate allocation dataset
+    log.info("Loading allocation flowbyactivity " + attr['allocation_source'] + " for year " + str(attr['allocation_source_year']))
+    fba_allocation = flowsa.getFlowByActivity(flowclass=[attr['allocation_source_class']],
+                                              datasource=attr['allocation_source'],
+                                              years=[attr['allocation_source_year']]).reset_index(drop=True)
+    # ensure correct data types
+    fba_allocation = add_missing_flow_by_fields(fba_allocation, flow_by_activity_fields)
+
+    # fill null values
+    fba_allocation = fill_missing_values(fba_allocation, fba_fill_na_dict)
+    # harmonize units across dfs
+    fba_allocation = harmonize_units(fba_allocation)
+
+    # subset based on yaml settings
+    if attr['allocation_flow'] != 'None':
+        fba_allocation = fba_allocation.loc[fba_allocation['FlowName'].isin(attr['allocation_flow'])]
+    if attr['allocation_compartment'] != 'None':
+        fba_allocation = fba_allocation.loc[
+            fba_allocation['Compartment'].isin(attr['allocation_compartment'])]
+    # reset index
+    fba_allocation = fba_allocation.reset_index(drop=True)
+
+    # check if allocation data exists at specified geoscale to use
+    log.info("Checking if" + " allocation data exists for " + ', '.join(map(str, names)) +
+             " at the " + attr['allocation_from_scale'] + " level")
+    check_if_data_exists_at_geoscale(fba_allocation, names, attr['allocation_from_scale'])
+
+    # aggregate geographically to the scale of the flowbyactivty source, if necessary
+    from_scale = attr['allocation_from_scale']
+    to_scale = v['geoscale_to_use']
+    # if allocation df is less aggregated than FBA df, aggregate allocation df to target scale
+    with profile_stage('allocation_agg_by_geoscale', fba_allocation) as record:
+        if fips_number_key[from_scale] > fips_number_key[to_scale]:
+            fba_allocation = agg_by_geoscale(fba_allocation, from_scale, to_scale, fba_default_grouping_fields,
+                                             names)
+        # else, if usgs is more aggregated than allocation table, use usgs as both to and from scale
+        else:
+            fba_allocation = filter_by_geoscale(fba_allocation, from_scale, names)
+        record['rows_out'] = len(fba_allocation)
+
+    # assign sector to allocation dataset
+    log.info("Adding sectors to " + attr['allocation_source'])
+    with profile_stage('allocation_add_sectors_to_flowbyactivity', fba_allocation) as record:
+        fba_allocation = add_sectors_to_flowbyactivity(fba_allocation,
+                                                       sectorsourcename=method['target_sector_source'],
+                                                       levelofSectoragg=attr[
+                                                           'allocation_sector_aggregation'])
+        record['rows_out'] = len(fba_allocation)
+
+    return fba_allocation
+
+
+def create_allocation_ratios(method, k, attr, names, fba_allocation, helper_allocation=None):
+    """
+    Creates the sector allocation ratios of an activity set from the allocation flowbyactivity
+    :param method: dictionary of the flowbysector method yaml
+    :param k: name of the flowbyactivity source
+    :param attr: dictionary of the activity set settings in the method yaml
+    :param names: list of activity names
+    :param fba_allocation: allocation flowbyactivity df with sectors, see load_allocation_flowbyactivity
+    :param helper_allocation: helper flowbyactivity df with sectors, see load_allocation_helper, loaded if
+    None and the activity set uses an allocation helper
+    :return: df of FlowAmountRatio for each location and sector
+    """
+    # subset fba datsets to only keep the naics associated with usgs activity subset
+    log.info("Subsetting " + attr['allocation_source'] + " for sectors in " + k)
+    fba_allocation_subset = get_fba_allocation_subset(fba_allocation, k, names)
+    # Reset index values after subset
+    fba_allocation_subset = fba_allocation_subset.reset_index(drop=True)
+    # generalize activity field names to enable link to water withdrawal table
+    log.info("Generalizing activity names in subset of " + attr['allocation_source'])
+    fba_allocation_subset = generalize_activity_field_names(fba_allocation_subset)
+    # drop columns
+    fba_allocation_subset = fba_allocation_subset.drop(columns=['Activity'])
+
+    # if there is an allocation helper dataset, modify allocation df
+    if attr['allocation_helper'] == 'yes':
+        log.info("Using the specified allocation help for subset of " + attr['allocation_source'])
+        fba_allocation_subset = allocation_helper(fba_allocation_subset, method, attr, helper_allocation)
+
+    # create flow allocation ratios
+    log.info("Creating allocation ratios for " + attr['allocation_source'])
+    with profile_stage('allocate_by_sector', fba_allocation_subset) as record:
+        flow_allocation = allocate_by_sector(fba_allocation_subset, attr['allocation_method'])
+        record['rows_out'] = len(flow_allocation)
+
+    # drop PR data
+    flow_allocation = flow_allocation.loc[flow_allocation['Location'].apply(lambda x: x[0:2] != '72')]
+
+    return flow_allocation
+
+
+def flowbysector_for_activity_set(method, k, v, attr, flows, flow_allocation=None):
+    """
+    Creates the flowbysector data for one activity set of a flowbyactivity source
+    :param method: dictionary of the flowbysector method yaml
+    :param k: name of the flowbyactivity source
+    :param v: dictionary of the flowbyactivity source settings in the method yaml
+    :param attr: dictionary of the activity set settings in the method yaml
+    :param flows: the cleaned flowbyactivity df of source k
+    :param flow_allocation: allocation ratios of the activity set, see create_allocation_ratios, created if
+    None and the activity set is not allocated directly
+    :return: flowbysector df for the activity set
+    """
+    # subset by named activities
+    names = [attr['names']]
+    log.info("Preparing to handle subset of flownames " + ', '.join(map(str, names)) + " in " + k)
+    # subset usgs data by activity
+    with profile_stage('subset_activities', flows) as record:
+        flow_subset = flows[(flows[fba_activity_fields[0]].isin(names)) |
+                            (flows[fba_activity_fields[1]].isin(names))].reset_index(drop=True)
+        record['rows_out'] = len(flow_subset)
+
+    # check if flowbyactivity data exists at specified geoscale to use
+    log.info("Checking if flowbyactivity data exists for " + ', '.join(map(str, names)) + " at the " +
+             v['geoscale_to_use'] + ' level')
+    with profile_stage('geocheck', flow_subset):
+        geocheck = check_if_data_exists_at_geoscale(flow_subset, names, v['geoscale_to_use'])
+        # aggregate geographically to the scale of the allocation dataset
+        if geocheck == "Yes":
+            activity_from_scale = v['geoscale_to_use']
+        else:
+            # if activity does not exist at specified geoscale, issue warning and use data at less aggregated
+            # geoscale, and sum to specified geoscale
+            log.info("Checking if flowbyactivity data exists for " + ', '.join(map(str, names)) + " at a less aggregated level")
+            new_geoscale_to_use = check_if_data_exists_at_less_aggregated_geoscale(flow_subset, names,
+                                                                                   v['geoscale_to_use'])
+            activity_from_scale = new_geoscale_to_use
+
+    activity_to_scale = attr['allocation_from_scale']
+    with profile_stage('activity_agg_by_geoscale', flow_subset) as record:
+        # if usgs is less aggregated than allocation df, aggregate usgs activity to target scale
+        if fips_number_key[activity_from_scale] > fips_number_key[activity_to_scale]:
+            log.info("Aggregating subset from " + activity_from_scale + " to " + activity_to_scale)
+            flow_subset = agg_by_geoscale(flow_subset, activity_from_scale, activity_to_scale, fba_default_grouping_fields, names)
+        # else, aggregate to geoscale want to use
+        elif fips_number_key[activity_from_scale] > fips_number_key[v['geoscale_to_use']]:
+            log.info("Aggregating subset from " + activity_from_scale + " to " + v['geoscale_to_use'])
+            flow_subset = agg_by_geoscale(flow_subset, activity_from_scale, v['geoscale_to_use'], fba_default_grouping_fields, names)
+        # else, if usgs is more aggregated than allocation table, filter relevant rows
+        else:
+            log.info("Filtering out " + activity_from_scale + " data")
+            flow_subset = filter_by_geoscale(flow_subset, activity_from_scale, names)
+        record['rows_out'] = len(flow_subset)
+
+    # location column pad zeros if necessary
+    flow_subset['Location'] = flow_subset['Location'].apply(lambda x: x.ljust(3 + len(x), '0') if len(x) < 5
+                                                            else x)
+
+    # Add sectors to usgs activity, depending on level of specified sector aggregation
+    log.info("Adding sectors to " + k + " for " + ', '.join(map(str, names)))
+    with profile_stage('add_sectors_to_flowbyactivity', flow_subset) as record:
+        if attr['allocation_sector_aggregation'] == 'agg':
+            flow_subset_wsec = add_sectors_to_flowbyactivity(flow_subset,
+                                                             sectorsourcename=method['target_sector_source'],
+                                                             levelofSectoragg='agg')
+        else:
+            flow_subset_wsec = add_sectors_to_flowbyactivity(flow_subset,
+                                                             sectorsourcename=method['target_sector_source'])
+        record['rows_out'] = len(flow_subset_wsec)
+
+    # clean up fba with sectors, if specified in yaml
+    if v["clean_fba_w_sec_df_fxn"] != 'None':
+        log.info("Cleaning up " + k + " FlowByActivity with sectors")
+        with profile_stage(v["clean_fba_w_sec_df_fxn"], flow_subset_wsec) as record:
+            flow_subset_wsec = getattr(sys.modules[__name__], v["clean_fba_w_sec_df_fxn"])(flow_subset_wsec)
+            record['rows_out'] = len(flow_subset_wsec)
+
+    # if allocation method is "direct", then no need to create alloc ratios, else need to use allocation
+    # dataframe to create sector allocation ratios
+    if attr['allocation_method'] == 'direct':
+        # if direct allocation, drop rows of data where an activity in either activity column is not in the
+        # direct allocation list. These non-direct activities are captured in other activity allocations
+        fbs = flow_subset_wsec.copy()
+        if "filter_activities" in attr:
+            for i in attr["filter_activities"]:
+                fbs = fbs.loc[~fbs[fba_activity_fields[0]].str.contains(i)]
+                fbs = fbs.loc[~fbs[fba_activity_fields[1]].str.contains(i)].reset_index(drop=True)
+
+    else:
+        if flow_allocation is None:
+            fba_allocation = load_allocation_flowbyactivity(method, v, attr, names)
+            flow_allocation = create_allocation_ratios(method, k, attr, names, fba_allocation)
+
+        # create list of sectors in the flow allocation df, drop any rows of data in the flow df that \
+        # aren't in list
+        sector_list = flow_allocation['Sector'].unique().tolist()
+
+        # subset fba allocation table to the values in the activity list, based on overlapping sectors
+        flow_subset_wsec = flow_subset_wsec.loc[
+            (flow_subset_wsec[fbs_activity_fields[0]].isin(sector_list)) |
+            (flow_subset_wsec[fbs_activity_fields[1]].isin(sector_list))]
+
+        # check if fba and allocation dfs have the same LocationSystem
+        log.info("Checking if flowbyactivity and allocation dataframes use the same location systems")
+        check_if_location_systems_match(flow_subset_wsec, flow_allocation)
+
+        # merge water withdrawal df w/flow allocation dataset
+        log.info("Merge " + k + " and subset of " + attr['allocation_source'])
+        with profile_stage('merge_allocation_produced_by', flow_subset_wsec) as record:
+            fbs = flow_subset_wsec.merge(
+                flow_allocation[['Location', 'LocationSystem', 'Sector', 'FlowAmountRatio']],
+                left_on=['Location', 'LocationSystem', 'SectorProducedBy'],
+                right_on=['Location', 'LocationSystem', 'Sector'], how='left')
+            record['rows_out'] = len(fbs)
+
+        with profile_stage('merge_allocation_consumed_by', fbs) as record:
+            fbs = fbs.merge(
+                flow_allocation[['Location', 'LocationSystem', 'Sector', 'FlowAmountRatio']],
+                left_on=['Location', 'LocationSystem', 'SectorConsumedBy'],
+                right_on=['Location', 'LocationSystem', 'Sector'], how='left')
+            record['rows_out'] = len(fbs)
+
+        # merge the flowamount columns
+        fbs['FlowAmountRatio'] = fbs['FlowAmountRatio_x'].fillna(fbs['FlowAmountRatio_y'])
+
+        # check if fba and allocation dfs have data for same geoscales
+        log.info("Checking if flowbyactivity and allocation dataframes have data at the same locations")
+        check_if_data_exists_for_same_geoscales(fbs, k, [attr['names']])
+
+        # drop rows where there is no allocation data
+        fbs = fbs.dropna(subset=['Sector_x', 'Sector_y'], how='all').reset_index()
+
+        # calculate flow amounts for each sector
+        log.info("Calculating new flow amounts using flow ratios")
+        fbs['FlowAmount'] = fbs['FlowAmount'] * fbs['FlowAmountRatio']
+
+        # drop columns
+        log.info("Cleaning up new flow by sector")
+        fbs = fbs.drop(columns=['Sector_x', 'FlowAmountRatio_x', 'Sector_y', 'FlowAmountRatio_y',
+                                'FlowAmountRatio', 'ActivityProducedBy', 'ActivityConsumedBy'])
+
+    # rename flow name to flowable - remove this once elementary flows are mapped
+    fbs = fbs.rename(columns={"FlowName": 'Flowable',
+                              "Compartment": "Context"
+                              })
+
+    # drop rows where flowamount = 0 (although this includes dropping suppressed data)
+    fbs = fbs[fbs['FlowAmount'] != 0].reset_index(drop=True)
+
+    # add missing data columns
+    fbs = add_missing_flow_by_fields(fbs, flow_by_sector_fields)
+    # fill null values
+    fbs = fill_missing_values(fbs, fbs_fill_na_dict)
+
+    # aggregate df geographically, if necessary
+    log.info("Aggregating flowbysector to " + method['target_geoscale'] + " level")
+    if fips_number_key[v['geoscale_to_use']] < fips_number_key[attr['allocation_from_scale']]:
+        from_scale = v['geoscale_to_use']
+    else:
+        from_scale = attr['allocation_from_scale']
+
+    to_scale = method['target_geoscale']
+
+    with profile_stage('fbs_agg_by_geoscale', fbs) as record:
+        fbs = agg_by_geoscale(fbs, from_scale, to_scale, fbs_default_grouping_fields, names)
+        record['rows_out'] = len(fbs)
+
+    # aggregate data to every sector level
+    log.info("Aggregating flowbysector to " + method['target_sector_level'])
+    with profile_stage('sector_aggregation', fbs) as record:
+        fbs = sector_aggregation(fbs, fbs_default_grouping_fields)
+        record['rows_out'] = len(fbs)
+
+    # test agg by sector
+    with profile_stage('sector_flow_comparision', fbs):
+        sector_agg_comparison = sector_flow_comparision(fbs)
+
+    # return sector level specified in method yaml
+    # load the crosswalk linking sector lengths
+    sector_list = get_sector_list(method['target_sector_level'])
+    # add any non-NAICS sectors used with NAICS
+    sector_list = add_non_naics_sectors(sector_list, method['target_sector_level'])
+
+    # subset df, necessary because not all of the sectors are NAICS
+    fbs = fbs.loc[(fbs[fbs_activity_fields[0]].isin(sector_list)) &
+                  (fbs[fbs_activity_fields[1]].isin(sector_list))].reset_index(drop=True)
+
+    # add any missing columns of data and cast to appropriate data type
+    fbs = add_missing_flow_by_fields(fbs, flow_by_sector_fields)
+
+    log.info("Completed flowbysector for activity subset with flows " + ', '.join(map(str, names)))
+    return fbs
+
+
+def build_method_plan(method):
+    """
+    Builds the execution plan of a flowbysector method, a graph of the steps creating each activity set: loading
+    the flowbyactivity source, loading the allocation flowbyactivity with sectors, loading the allocation helper,
+    creating the allocation ratios, and creating the activity set flowbysector. Steps with the same settings, like
+    an allocation source shared by several activity sets, are a single node, so they run once.
+    :param method: dictionary of the flowbysector method yaml
+    :return: dictionary of nodes by node name, ordered so each node follows the nodes it depends on. Each node is
+    a dictionary of the node 'type', the function ('fxn') and arguments ('args') that run the node, the names of
+    the nodes whose results are added to the arguments ('deps'), and the 'activity_sets' using the node
+    """
+    plan = {}
+    # node names by the settings that define each node
+    node_names = {}
+
+    def add_node(label, key, node_type, fxn, args, deps, aset):
+        key = repr((node_type, key, deps))
+        if key not in node_names:
+            name = label
+            while name in plan:
+                name = name + "'"
+            node_names[key] = name
+            plan[name] = {'type': node_type, 'fxn': fxn, 'args': args, 'deps': deps, 'activity_sets': []}
+        name = node_names[key]
+        plan[name]['activity_sets'].append(aset)
+        return name
+
+    for k, v in method['flowbyactivity_sources'].items():
+        for aset, attr in v['activity_sets'].items():
+            fba_node = add_node('flowbyactivity:' + k, k, 'flowbyactivity', 'load_method_flowbyactivity',
+                                (k, v), [], aset)
+            deps = [fba_node]
+            if attr['allocation_method'] != 'direct':
+                allocation_key = [attr['allocation_source'], attr['allocation_source_class'],
+                                  attr['allocation_source_year'], attr['allocation_flow'],
+                                  attr['allocation_compartment'], attr['allocation_from_scale'],
+                                  v['geoscale_to_use'], method['target_sector_source'],
+                                  attr['allocation_sector_aggregation']]
+                # activity names are only used in log messages when loading the allocation data
+                allocation_node = add_node('allocation:' + attr['allocation_source'] + '_' +
+                                           str(attr['allocation_source_year']), allocation_key, 'allocation',
+                                           'load_allocation_flowbyactivity', (method, v, attr, []), [], aset)
+                plan[allocation_node]['args'][3].append(attr['names'])
+                ratio_deps = [allocation_node]
                 if attr['allocation_helper'] == 'yes':
-                    log.info("Using the specified allocation help for subset of " + attr['allocation_source'])
-                    fba_allocation_subset = allocation_helper(fba_allocation_subset, method, attr)
-
-                # create flow allocation ratios
-                log.info("Creating allocation ratios for " + attr['allocation_source'])
-                flow_allocation = allocate_by_sector(fba_allocation_subset, attr['allocation_method'])
-
-                # drop PR data
-                flow_allocation = flow_allocation.loc[flow_allocation['Location'].apply(lambda x: x[0:2] != '72')]
-
-                # create list of sectors in the flow allocation df, drop any rows of data in the flow df that \
-                # aren't in list
-                sector_list = flow_allocation['Sector'].unique().tolist()
-
-                # subset fba allocation table to the values in the activity list, based on overlapping sectors
-                flow_subset_wsec = flow_subset_wsec.loc[
-                    (flow_subset_wsec[fbs_activity_fields[0]].isin(sector_list)) |
-                    (flow_subset_wsec[fbs_activity_fields[1]].isin(sector_list))]
-
-                # check if fba and allocation dfs have the same LocationSystem
-                log.info("Checking if flowbyactivity and allocation dataframes use the same location systems")
-                check_if_location_systems_match(flow_subset_wsec, flow_allocation)
-
-                # merge water withdrawal df w/flow allocation dataset
-                log.info("Merge " + k + " and subset of " + attr['allocation_source'])
-                fbs = flow_subset_wsec.merge(
-                    flow_allocation[['Location', 'LocationSystem', 'Sector', 'FlowAmountRatio']],
-                    left_on=['Location', 'LocationSystem', 'SectorProducedBy'],
-                    right_on=['Location', 'LocationSystem', 'Sector'], how='left')
-
-                fbs = fbs.merge(
-                    flow_allocation[['Location', 'LocationSystem', 'Sector', 'FlowAmountRatio']],
-                    left_on=['Location', 'LocationSystem', 'SectorConsumedBy'],
-                    right_on=['Location', 'LocationSystem', 'Sector'], how='left')
-
-                # merge the flowamount columns
-                fbs['FlowAmountRatio'] = fbs['FlowAmountRatio_x'].fillna(fbs['FlowAmountRatio_y'])
-
-                # check if fba and allocation dfs have data for same geoscales
-                log.info("Checking if flowbyactivity and allocation dataframes have data at the same locations")
-                check_if_data_exists_for_same_geoscales(fbs, k, [attr['names']])
-
-                # drop rows where there is no allocation data
-                fbs = fbs.dropna(subset=['Sector_x', 'Sector_y'], how='all').reset_index()
-
-                # calculate flow amounts for each sector
-                log.info("Calculating new flow amounts using flow ratios")
-                fbs['FlowAmount'] = fbs['FlowAmount'] * fbs['FlowAmountRatio']
-
-                # drop columns
-                log.info("Cleaning up new flow by sector")
-                fbs = fbs.drop(columns=['Sector_x', 'FlowAmountRatio_x', 'Sector_y', 'FlowAmountRatio_y',
-                                        'FlowAmountRatio', 'ActivityProducedBy', 'ActivityConsumedBy'])
-
-            # rename flow name to flowable - remove this once elementary flows are mapped
-            fbs = fbs.rename(columns={"FlowName": 'Flowable',
-                                      "Compartment": "Context"
-                                      })
-
-            # drop rows where flowamount = 0 (although this includes dropping suppressed data)
-            fbs = fbs[fbs['FlowAmount'] != 0].reset_index(drop=True)
-
-            # add missing data columns
-            fbs = add_missing_flow_by_fields(fbs, flow_by_sector_fields)
-            # fill null values
-            fbs = fbs.fillna(value=fbs_fill_na_dict)
-
-            # aggregate df geographically, if necessary
-            log.info("Aggregating flowbysector to " + method['target_geoscale'] + " level")
-            if fips_number_key[v['geoscale_to_use']] < fips_number_key[attr['allocation_from_scale']]:
-                from_scale = v['geoscale_to_use']
-            else:
-                from_scale = attr['allocation_from_scale']
-
-            to_scale = method['target_geoscale']
-
-            fbs = agg_by_geoscale(fbs, from_scale, to_scale, fbs_default_grouping_fields, names)
-
-            # aggregate data to every sector level
-            log.info("Aggregating flowbysector to " + method['target_sector_level'])
-            fbs = sector_aggregation(fbs, fbs_default_grouping_fields)
-
-            # test agg by sector
-            sector_agg_comparison = sector_flow_comparision(fbs)
-
-            # return sector level specified in method yaml
-            # load the crosswalk linking sector lengths
-            sector_list = get_sector_list(method['target_sector_level'])
-            # add any non-NAICS sectors used with NAICS
-            sector_list = add_non_naics_sectors(sector_list, method['target_sector_level'])
-
-            # subset df, necessary because not all of the sectors are NAICS
-            fbs = fbs.loc[(fbs[fbs_activity_fields[0]].isin(sector_list)) &
-                          (fbs[fbs_activity_fields[1]].isin(sector_list))].reset_index(drop=True)
-
-            # add any missing columns of data and cast to appropriate data type
-            fbs = add_missing_flow_by_fields(fbs, flow_by_sector_fields)
-
-            log.info("Completed flowbysector for activity subset with flows " + ', '.join(map(str, names)))
-            fbss.append(fbs)
-    # create single df of all activities
-    log.info("Concat data for all activities")
-    fbss = pd.concat(fbss, ignore_index=True, sort=False)
-    log.info("Clean final dataframe")
-    # drop duplicate rows (duplicates can arise when data is given in both "delivered to" and "delivered from" form)
-    fbss = fbss.drop_duplicates().reset_index(drop=True)
-    # aggregate df as activities might have data for the same specified sector length
-    fbss = aggregator(fbss, fbs_default_grouping_fields)
-    # sort df
-    log.info("Sort and store dataframe")
-    fbss = fbss.sort_values(
-        ['SectorProducedBy', 'SectorConsumedBy', 'Flowable', 'Context']).reset_index(drop=True)
-    # save parquet file
-    store_flowbysector(fbss, method_name)
+                    helper_key = [attr['helper_source'], attr['helper_source_class'], attr['helper_source_year'],
+                                  method['target_sector_source'], attr['helper_sector_aggregation']]
+                    ratio_deps.append(add_node('helper:' + attr['helper_source'] + '_' +
+                                               str(attr['helper_source_year']), helper_key, 'helper',
+                                               'load_allocation_helper', (method, attr), [], aset))
+                ratio_key = [k, attr['names'], attr['allocation_method'], attr['allocation_helper']] + \
+                    [attr[h] for h in ('helper_method', 'helper_from_scale') if h in attr]
+                deps.append(add_node('ratios:' + k + '/' + attr['names'], ratio_key, 'allocation_ratios',
+                                     'create_allocation_ratios', (method, k, attr, [attr['names']]),
+                                     ratio_deps, aset))
+            add_node('activity_set:' + k + '/' + aset, aset, 'activity_set', 'flowbysector_for_activity_set',
+                     (method, k, v, attr), deps, aset)
+    return plan
+
+
+def get_plan_levels(plan):
+    """
+    Groups the nodes of a plan into levels, where the nodes of each level only depend on nodes of earlier levels
+    :param plan: dictionary of nodes, see build_method_plan
+    :return: list of lists of node names
+    """
+    node_level = {}
+    for name, node in plan.items():
+        node_level[name] = max([node_level[d] + 1 for d in node['deps']], default=0)
+    return [[name for name in plan if node_level[name] == level] for level in range(max(node_level.values()) + 1)]
+
+
+def get_flowbyactivity_files(datasource, year):
+    """
+    Parquet files of a stored flowbyactivity dataset, either the single file or the files of the Year partition
+    :return: list of file paths, empty if the dataset is not stored
+    """
+    f = flowsa.fbaoutputpath + datasource + '_' + str(year) + '.parquet'
+    partition = flowsa.fbaoutputpath + datasource + '/Year=' + str(year)
+    return [f] if os.path.isfile(f) else sorted(glob.glob(partition + '/*.parquet'))
+
+
+def estimate_flowbyactivity_size(datasource, year):
+    """
+    Rows and bytes of a stored flowbyactivity dataset, from the parquet metadata
+    :return: tuple of rows and bytes, or (None, None) if the dataset is not stored
+    """
+    files = get_flowbyactivity_files(datasource, year)
+    try:
+        rows = sum(pq.ParquetFile(f).metadata.num_rows for f in files)
+    except Exception:
+        return None, None
+    if len(files) == 0:
+        return None, None
+    return rows, sum(os.path.getsize(f) for f in files)
+
+
+def plan_summary(plan, up_to_date=()):
+    """
+    Summarizes the nodes of a plan, with sizes estimated from the stored flowbyactivity datasets. Nodes without
+    a stored dataset are estimated by the largest dataset they depend on.
+    :param plan: dictionary of nodes, see build_method_plan
+    :param up_to_date: names of the activity set nodes with stored results matching their inputs, which will not run
+    :return: df with a row for each node
+    """
+    sizes = {}
+    for name, node in plan.items():
+        if node['type'] == 'flowbyactivity':
+            k, v = node['args']
+            sizes[name] = estimate_flowbyactivity_size(k, v['year'])
+        elif node['type'] == 'allocation':
+            attr = node['args'][2]
+            sizes[name] = estimate_flowbyactivity_size(attr['allocation_source'], attr['allocation_source_year'])
+        elif node['type'] == 'helper':
+            attr = node['args'][1]
+            sizes[name] = estimate_flowbyactivity_size(attr['helper_source'], attr['helper_source_year'])
+        else:
+            dep_sizes = [sizes[d] for d in node['deps'] if sizes[d][0] is not None]
+            sizes[name] = max(dep_sizes) if len(dep_sizes) > 0 else (None, None)
+    levels = {name: i for i, level in enumerate(get_plan_levels(plan)) for name in level}
+    summary = pd.DataFrame([{'node': name, 'type': node['type'], 'level': levels[name],
+                             'depends_on': ', '.join(node['deps']),
+                             'activity_sets': ', '.join(node['activity_sets']),
+                             'estimated_rows': sizes[name][0], 'estimated_bytes': sizes[name][1],
+                             'up_to_date': name in up_to_date}
+                            for name, node in plan.items()])
+    return summary
+
+
+def run_plan_node(node, results):
+    """
+    Runs a node of a plan
+    :param node: dictionary of the node, see build_method_plan
+    :param results: dictionary of the results of the nodes it depends on
+    :return: result of the node
+    """
+    deps = [results[d] for d in node['deps']]
+    with profile_stage(node['fxn'], next((d for d in deps if isinstance(d, pd.DataFrame)), None)) as record:
+        result = getattr(sys.modules[__name__], node['fxn'])(*node['args'], *deps)
+        record['rows_out'] = count_rows(result)
+    return result
+
+
+# plan and results shared by the nodes run in a worker process, see init_plan_worker
+plan_inputs = {}
+
+
+def init_plan_worker(plan, results, profiling=False, categorical=False):
+    """
+    Stores the plan and the results needed by the nodes run in a worker process, so each task only passes
+    the name of its node. Forked workers share the inputs of the parent process without copying them.
+    :param plan: dictionary of nodes, see build_method_plan
+    :param results: dictionary of the results of earlier nodes
+    :param profiling: bool, True to record the stages run in the worker, see flowsa.profiling
+    :param categorical: bool, True to use the categorical schema in the worker, see common.categorical_schema
+    """
+    plan_inputs['plan'] = plan
+    plan_inputs['results'] = results
+    enable_profiling(profiling)
+    set_categorical_schema(categorical)
+    clear_profile()
+
+
+def run_plan_node_in_worker(name):
+    """
+    Runs a node of the plan in a worker process, see init_plan_worker
+    :param name: name of the node
+    :return: tuple of the result of the node and the stages recorded while running it
+    """
+    start = len(stage_records)
+    with profile_context_node(name):
+        result = run_plan_node(plan_inputs['plan'][name], plan_inputs['results'])
+    return result, stage_records[start:]
+
+
+def execute_plan(plan, workers=1):
+    """
+    Runs each node of a plan once, level by level. With more than one worker, the nodes of a level run in a pool
+    of processes. Results are dropped once no remaining node depends on them.
+    :param plan: dictionary of nodes, see build_method_plan
+    :param workers: int, number of nodes run at once
+    :return: dictionary of the activity set flowbysector dfs, by node name, in plan order
+    """
+    remaining_dependents = {name: 0 for name in plan}
+    for node in plan.values():
+        for d in node['deps']:
+            remaining_dependents[d] += 1
+
+    results = {}
+    if len(plan) == 0:
+        return results
+    for level in get_plan_levels(plan):
+        if workers > 1 and len(level) > 1:
+            log.info("Running " + str(len(level)) + " plan nodes across " + str(min(workers, len(level))) +
+                     " processes")
+            deps = {d: results[d] for name in level for d in plan[name]['deps']}
+            with ProcessPoolExecutor(max_workers=min(workers, len(level)), initializer=init_plan_worker,
+                                     initargs=(plan, deps, flowsa.profiling.profiling_enabled,
+                                               flowsa.common.categorical_schema)) as executor:
+                level_results = []
+                for result, records in executor.map(run_plan_node_in_worker, level):
+                    level_results.append(result)
+                    stage_records.extend(records)
+        else:
+            level_results = []
+            for name in level:
+                with profile_context_node(name):
+                    level_results.append(run_plan_node(plan[name], results))
+        for name, result in zip(level, level_results):
+            results[name] = result
+            for d in plan[name]['deps']:
+                remaining_dependents[d] -= 1
+                if remaining_dependents[d] == 0 and plan[d]['type'] != 'activity_set':
+                    del results[d]
+    return {name: results[name] for name, node in plan.items() if node['type'] == 'activity_set'}
+
+
+def load_activity_set_mappings(method):
+    """
+    Loads the FIPS index and the activity to sector mappings used by the activity sets of a method, so forked worker
+    processes start with them loaded
+    :param method: dictionary of the flowbysector method yaml
+    """
+    get_FIPS_index()
+    for k, v in method['flowbyactivity_sources'].items():
+        for attr in v['activity_sets'].values():
+            get_sector_mapping(k, method['target_sector_source'],
+                               'agg' if attr['allocation_sector_aggregation'] == 'agg' else 'disagg')
+            if attr['allocation_method'] != 'direct':
+                get_sector_mapping(attr['allocation_source'], method['target_sector_source'],
+                                   attr['allocation_sector_aggregation'])
+
+
+def prune_plan(plan, names):
+    """
+    Subset of a plan with only the given nodes and the nodes they depend on
+    :param plan: dictionary of nodes, see build_method_plan
+    :param names: names of the nodes to keep
+    :return: dictionary of nodes, in plan order
+    """
+    keep = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name not in keep:
+            keep.add(name)
+            stack.extend(plan[name]['deps'])
+    return {name: node for name, node in plan.items() if name in keep}
+
+
+# file hashes calculated in this process, by path, size, and modification time, see get_file_hash
+file_hashes = {}
+
+# flowsa modules run by every activity set, hashed into the fingerprint of its stored flowbysector data. The
+# modules of the clean functions named in the method yaml are added for each activity set, see
+# activity_set_fingerprint. Add a module here if the activity sets start to run its code
+activity_set_modules = ['__init__.py', 'cache.py', 'common.py', 'datachecks.py', 'flowbyfunctions.py',
+                        'flowbysector.py', 'mapping.py']
+
+
+def get_file_hash(path):
+    """
+    sha256 hash of the contents of a file, calculated once per process unless the file is modified
+    :param path: str, path of the file
+    :return: str, hex digest, or None if the file does not exist
+    """
+    if not os.path.isfile(path):
+        return None
+    key = (path, os.path.getsize(path), os.path.getmtime(path))
+    if key not in file_hashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        file_hashes[key] = h.hexdigest()
+    return file_hashes[key]
+
+
+def activity_set_fingerprint(method, k, v, attr):
+    """
+    Fingerprint of the inputs of an activity set: the method yaml settings used by the activity set, the hashes of
+    the flowbyactivity parquets and crosswalks it reads, and the hashes of the flowsa modules it runs
+    :param method: dictionary of the flowbysector method yaml
+    :param k: name of the flowbyactivity source
+    :param v: dictionary of the flowbyactivity source settings in the method yaml
+    :param attr: dictionary of the activity set settings in the method yaml
+    :return: dictionary of the hashes of each input, with the combined hash in 'fingerprint'
+    """
+    settings = {'method': {m: method[m] for m in method if m != 'flowbyactivity_sources'},
+                'source': {s: v[s] for s in v if s != 'activity_sets'},
+                'activity_set': attr}
+    # flowbyactivity datasets and crosswalks read by the activity set
+    datasets = [(k, v['year'])]
+    sources = [k]
+    if attr['allocation_method'] != 'direct':
+        datasets.append((attr['allocation_source'], attr['allocation_source_year']))
+        sources.append(attr['allocation_source'])
+        if attr['allocation_helper'] == 'yes':
+            datasets.append((attr['helper_source'], attr['helper_source_year']))
+            sources.append(attr['helper_source'])
+    flowbyactivity = {}
+    for datasource, year in datasets:
+        for f in get_flowbyactivity_files(datasource, year):
+            flowbyactivity[os.path.relpath(f, flowsa.fbaoutputpath)] = get_file_hash(f)
+    crosswalk_files = ['activitytosectormapping/Crosswalk_' + s + '_toNAICS.csv' for s in sources] + \
+        ['source_catalog.yaml', 'NAICS_07_to_17_Crosswalk.csv', 'NAICS_2012_Crosswalk.csv',
+         'Household_SectorCodes.csv', 'FIPS_Crosswalk.csv']
+    crosswalks = {f: get_file_hash(datapath + f) for f in crosswalk_files}
+    # flowsa modules run by the activity set, so edits to other modules do not change the fingerprint
+    modules = list(activity_set_modules)
+    for fxn in ('clean_fba_df_fxn', 'clean_fba_w_sec_df_fxn'):
+        if v.get(fxn, 'None') != 'None' and hasattr(sys.modules[__name__], v[fxn]):
+            modules.append(os.path.basename(sys.modules[getattr(sys.modules[__name__], v[fxn]).__module__].__file__))
+    code = {f: get_file_hash(modulepath + f) for f in sorted(set(modules))}
+
+    fingerprint = {'settings': hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest(),
+                   'flowbyactivity': flowbyactivity, 'crosswalks': crosswalks, 'code': code}
+    fingerprint['fingerprint'] = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+    return fingerprint
+
+
+def get_activity_set_shard_file(method_name, k, aset):
+    """Path, without extension, of the stored flowbysector data of an activity set"""
+    return fbs_shard_path + method_name + '/' + k + '_' + aset
+
+
+def load_activity_set_shard(method_name, k, aset, fingerprint):
+    """
+    Loads the stored flowbysector data of an activity set, if it was created from inputs with the same fingerprint
+    :return: flowbysector df, or None if there is no stored data matching the fingerprint
+    """
+    f = get_activity_set_shard_file(method_name, k, aset)
+    try:
+        with open(f + '.json', 'r') as fi:
+            stored = json.load(fi)
+        if stored['fingerprint'] != fingerprint['fingerprint']:
+            return None
+        fbs = pd.read_parquet(f + '.parquet', engine="pyarrow", **categorical_read_args())
+        return conform_categorical_fields(fbs)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_activity_set_shard(method_name, k, aset, fingerprint, fbs):
+    """
+    Stores the flowbysector data of an activity set with the fingerprint of its inputs. The fingerprint is written
+    last, so data from an interrupted write is never matched.
+    """
+    f = get_activity_set_shard_file(method_name, k, aset)
+    try:
+        os.makedirs(os.path.dirname(f), exist_ok=True)
+        if os.path.isfile(f + '.json'):
+            os.remove(f + '.json')
+        fbs.to_parquet(f + '.parquet.tmp', engine="pyarrow", index=False)
+        os.replace(f + '.parquet.tmp', f + '.parquet')
+        with open(f + '.json.tmp', 'w') as fi:
+            json.dump(fingerprint, fi, indent=2)
+        os.replace(f + '.json.tmp', f + '.json')
+    except OSError:
+        log.warning("Unable to store the flowbysector data of " + k + " " + aset + " in " + fbs_shard_path)
+
+
+def main(method_name, workers=1, plan_only=False, full_rebuild=False, profile=False):
+    """
+    Creates a flowbysector dataset. The flowbysector data of each activity set is stored with the fingerprint
+    of its inputs, and only activity sets with changed inputs are created again, unless full_rebuild
+    :param method_name: Name of method corresponding to flowbysector method yaml name
+    :param workers: int, number of plan nodes run at once in a pool of processes. Results are combined in the
+    order of the method yaml, so the output does not depend on the number of workers
+    :param plan_only: bool, True to only log and return the summary of the method plan, see build_method_plan
+    :param full_rebuild: bool, True to create every activity set, ignoring stored activity set data
+    :param profile: bool, True to save the time and memory of each stage to a csv and json file next to the
+    flowbysector parquet, see flowsa.profiling. Also enabled by the FLOWSA_PROFILE environment variable
+    :return: flowbysector, or the plan summary if plan_only
+    """
+    profiling_enabled = flowsa.profiling.profiling_enabled
+    if profile:
+        enable_profiling()
+    clear_profile()
+    try:
+        log.info("Initiating flowbysector creation for " + method_name)
+        # call on method
+        method = load_method(method_name)
+        # plan the steps creating each activity set, running shared steps once
+        plan = build_method_plan(method)
+
+        # load the stored activity sets whose inputs have not changed
+        fingerprints = {}
+        stored = {}
+        for name, node in plan.items():
+            if node['type'] == 'activity_set':
+                method, k, v, attr = node['args']
+                aset = node['activity_sets'][0]
+                fingerprints[name] = activity_set_fingerprint(method, k, v, attr)
+                if not full_rebuild:
+                    fbs = load_activity_set_shard(method_name, k, aset, fingerprints[name])
+                    if fbs is not None:
+                        stored[name] = fbs
+        stale = [name for name in fingerprints if name not in stored]
+        log.info(str(len(stored)) + " of " + str(len(fingerprints)) + " activity sets are up to date")
+
+        if plan_only:
+            summary = plan_summary(plan, up_to_date=list(stored))
+            log.info("Plan for " + method_name + "\n" + summary.to_string(index=False))
+            return summary
+
+        if workers > 1 and len(stale) > 0:
+            load_activity_set_mappings(method)
+        # subset activity data and allocate to sector for each changed activity set
+        results = execute_plan(prune_plan(plan, stale), workers)
+        for name, fbs in results.items():
+            method, k, v, attr = plan[name]['args']
+            store_activity_set_shard(method_name, k, plan[name]['activity_sets'][0], fingerprints[name], fbs)
+        results.update(stored)
+        fbss = [results[name] for name in fingerprints]
+        # create single df of all activities
+        log.info("Concat data for all activities")
+        with profile_stage('concat') as record:
+            fbss = pd.concat(fbss, ignore_index=True, sort=False)
+            # activity sets with different categories are concatenated as str
+            fbss = conform_categorical_fields(fbss)
+            record['rows_out'] = len(fbss)
+        log.info("Clean final dataframe")
+        # drop duplicate rows (duplicates can arise when data is given in both "delivered to" and "delivered from"
+        # form)
+        with profile_stage('drop_duplicates', fbss) as record:
+            fbss = fbss.drop_duplicates().reset_index(drop=True)
+            record['rows_out'] = len(fbss)
+        # aggregate df as activities might have data for the same specified sector length
+        with profile_stage('aggregator', fbss) as record:
+            fbss = aggregator(fbss, fbs_default_grouping_fields)
+            record['rows_out'] = len(fbss)
+        # sort df
+        log.info("Sort and store dataframe")
+        with profile_stage('sort', fbss):
+            # sorted on every grouping field, and categories by their values rather than the order of the
+            # categories, so the rows are in the same order with or without the categorical schema
+            sort_fields = ['SectorProducedBy', 'SectorConsumedBy', 'Flowable', 'Context']
+            sort_fields = sort_fields + [c for c in fbs_default_grouping_fields if c not in sort_fields]
+            fbss = fbss.sort_values(
+                sort_fields, kind='mergesort',
+                key=lambda s: s.astype(object) if isinstance(s.dtype, pd.CategoricalDtype) else s
+            ).reset_index(drop=True)
+        # save parquet file
+        with profile_stage('store_flowbysector', fbss):
+            store_flowbysector(fbss, method_name)
+        write_profile_report(fbsoutputpath + method_name + '_profile')
+        return fbss
+    finally:
+        enable_profiling(profiling_enabled)
 
 
 if __name__ == '__main__':
     # assign arguments
     args = parse_args()
-    main(args["method"])
+    if args["categorical"]:
+        set_categorical_schema(True)
+    main(args["method"], workers=args["workers"], plan_only=args["plan"], full_rebuild=args["full"],
+         profile=args["profile"])
 
@@ -4,19 +4,107 @@
 """
 Contains mapping functions
 """
+import os
+import hashlib
 import pandas as pd
 import numpy as np
 from flowsa.common import datapath, sector_source_name, activity_fields, load_source_catalog, \
-    load_sector_crosswalk, log, load_sector_length_crosswalk, load_household_sector_codes
+    load_sector_crosswalk, log, load_sector_length_crosswalk, load_household_sector_codes, mapping_cache_path
 from flowsa.flowbyfunctions import fbs_activity_fields
 
+# activity to sector crosswalks read in this process, see get_activitytosector_mapping
+activitytosector_mappings = {}
+# activity to sector mappings built in this process, keyed by (source, sector source name, level of
+# sector aggregation), see get_sector_mapping
+sector_mappings = {}
+
+
 def get_activitytosector_mapping(source):
     """
-    Gets  the activity-to-sector mapping
+    Gets  the activity-to-sector mapping, read once per process
     :param source: The data source name
     :return: a pandas df for a standard ActivitytoSector mapping
     """
-    mapping = pd.read_csv(datapath+'activitytosectormapping/'+'Crosswalk_'+source+'_toNAICS.csv')
+    if source not in activitytosector_mappings:
+        activitytosector_mappings[source] = pd.read_csv(datapath+'activitytosectormapping/'+'Crosswalk_'+source+'_toNAICS.csv')
+    return activitytosector_mappings[source].copy()
+
+
+def get_sector_mapping(source, sectorsourcename=sector_source_name, levelofSectoragg='disagg'):
+    """
+    Gets the mapping of a source's activities to sectors. Each mapping is built once per process, and stored as
+    a parquet file in mapping_cache_path, named by the hash of the crosswalks it is built from, so it is only
+    rebuilt when a crosswalk changes.
+    :param source: The data source name
+    :param sectorsourcename: A sector source name, using package default
+    :param levelofSectoragg: Option of mapping to the most aggregated "agg" or the most disaggregated "disagg" level
+                            of NAICS for an activity
+    :return: a df with Activity and Sector columns, and ActivitySourceName and SectorType columns for sources
+    with text activities
+    """
+    key = (source, sectorsourcename, levelofSectoragg)
+    if key in sector_mappings:
+        return sector_mappings[key].copy()
+
+    src_info = load_source_catalog()[source]
+    sector_like_activities = src_info['sector-like_activities'] == 'True'
+    # crosswalks the mapping is built from
+    if sector_like_activities:
+        crosswalks = ['NAICS_07_to_17_Crosswalk.csv']
+    else:
+        crosswalks = ['activitytosectormapping/Crosswalk_' + source + '_toNAICS.csv']
+        if levelofSectoragg == 'disagg':
+            crosswalks = crosswalks + ['NAICS_07_to_17_Crosswalk.csv', 'Household_SectorCodes.csv']
+    crosswalk_hash = hashlib.sha256(repr((key, sector_like_activities)).encode())
+    for f in crosswalks:
+        with open(datapath + f, 'rb') as cw:
+            crosswalk_hash.update(cw.read())
+    mapping_file = mapping_cache_path + '_'.join(key) + '_' + crosswalk_hash.hexdigest()[0:16] + '.parquet'
+
+    if os.path.isfile(mapping_file):
+        mapping = pd.read_parquet(mapping_file, engine="pyarrow")
+    else:
+        mapping = build_sector_mapping(source, sector_like_activities, sectorsourcename, levelofSectoragg)
+        try:
+            os.makedirs(mapping_cache_path, exist_ok=True)
+            mapping.to_parquet(mapping_file + '.tmp', engine="pyarrow", index=False)
+            os.replace(mapping_file + '.tmp', mapping_file)
+        except OSError:
+            log.warning("Unable to store the sector mapping of " + source + " in " + mapping_cache_path)
+    sector_mappings[key] = mapping
+    return mapping.copy()
+
+
+def build_sector_mapping(source, sector_like_activities, sectorsourcename, levelofSectoragg):
+    """
+    Builds the mapping of a source's activities to sectors, see get_sector_mapping
+    :param source: The data source name
+    :param sector_like_activities: bool, True if the source activities are sectors
+    :param sectorsourcename: A sector source name
+    :param levelofSectoragg: "agg" or "disagg"
+    :return: a df mapping activities to sectors
+    """
+    # if data are provided in NAICS format, use the mastercrosswalk
+    if sector_like_activities:
+        cw = load_sector_crosswalk()
+        sectors = cw.loc[:,[sector_source_name]]
+        # Create mapping df that's just the sectors at first
+        mapping = sectors.drop_duplicates()
+        # Add the sector twice as activities so mapping is identical
+        mapping['Activity'] = sectors[sector_source_name]
+        mapping = mapping.rename(columns={sector_source_name: "Sector"})
+    else:
+        # if source data activities are text strings, call on the manually created source crosswalks
+        mapping = get_activitytosector_mapping(source)
+        # filter by SectorSourceName of interest
+        mapping = mapping[mapping['SectorSourceName']==sectorsourcename]
+        # drop SectorSourceName
+        mapping = mapping.drop(columns=['SectorSourceName'])
+        # Include all digits of naics in mapping, if levelofNAICSagg is specified as "disagg"
+        if levelofSectoragg == 'disagg':
+            mapping = expand_naics_list(mapping, sectorsourcename)
+    # missing values as None, as they are read from the stored parquet
+    mapping = mapping.astype(object).where(mapping.notna(), None).reset_index(drop=True)
     return mapping
 
 
@@ -32,33 +120,8 @@ def add_sectors_to_flowbyactivity(flowbyactivity_df, sectorsourcename=sector_sou
     """
 
     mappings = []
-
-    # First check if source activities are NAICS like - if so make it into a mapping file
-
-    cat = load_source_catalog()
-
     for s in pd.unique(flowbyactivity_df['SourceName']):
-        src_info = cat[s]
-        # if data are provided in NAICS format, use the mastercrosswalk
-        if src_info['sector-like_activities'] == 'True':
-            cw = load_sector_crosswalk()
-            sectors = cw.loc[:,[sector_source_name]]
-            # Create mapping df that's just the sectors at first
-            mapping = sectors.drop_duplicates()
-            # Add the sector twice as activities so mapping is identical
-            mapping['Activity'] = sectors[sector_source_name]
-            mapping = mapping.rename(columns={sector_source_name: "Sector"})
-        else:
-            # if source data activities are text strings, call on the manually created source crosswalks
-            mapping = get_activitytosector_mapping(s)
-            # filter by SectorSourceName of interest
-            mapping = mapping[mapping['SectorSourceName']==sectorsourcename]
-            # drop SectorSourceName
-            mapping = mapping.drop(columns=['SectorSourceName'])
-            # Include all digits of naics in mapping, if levelofNAICSagg is specified as "disagg"
-            if levelofSectoragg == 'disagg':
-                mapping = expand_naics_list(mapping, sectorsourcename)
-        mappings.append(mapping)
+        mappings.append(get_sector_mapping(s, sectorsourcename, levelofSectoragg))
     mappings_df = pd.concat(mappings)
     # Merge in with flowbyactivity by
     flowbyactivity_wsector_df = flowbyactivity_df
@@ -81,7 +144,20 @@ def add_sectors_to_flowbyactivity(flowbyactivity_df, sectorsourcename=sector_sou
     return flowbyactivity_wsector_df
 
 
-def expand_naics_list(df, sectorsourcename):
+# sector prefix indices, built once per sector source name, see get_sector_prefix_index
+sector_prefix_indices = {}
+
+
+def get_sector_prefix_index(sectorsourcename):
+    """
+    Index of every prefix of the sectors in the master crosswalk and the household (non-NAICS) codes, mapping
+    each prefix to all the sectors that start with it, including itself. Built once per sector source name.
+    :param sectorsourcename: A sector source name, a column of the master crosswalk
+    :return: df with the prefix in the 'Sector' column and the sectors that start with it in the
+    sectorsourcename column, ordered as in the crosswalk
+    """
+    if sectorsourcename in sector_prefix_indices:
+        return sector_prefix_indices[sectorsourcename]
 
     # load master crosswalk
     cw = load_sector_crosswalk()
@@ -92,20 +168,35 @@ def expand_naics_list(df, sectorsourcename):
     household = load_household_sector_codes()
     household = pd.DataFrame(household['Code'].drop_duplicates())
     household.columns = [sectorsourcename]
-    sectors = sectors.append(household, sort=True).drop_duplicates().reset_index(drop=True)
+    sectors = pd.concat([sectors, household]).drop_duplicates().reset_index(drop=True)
+
+    codes = sectors[sectorsourcename]
+    lengths = codes.str.len()
+    prefixes = []
+    for i in range(1, lengths.max() + 1):
+        n = codes[lengths >= i]
+        prefixes.append(pd.DataFrame({'Sector': n.str[0:i].values, sectorsourcename: n.values,
+                                      'position': n.index}))
+    index = pd.concat(prefixes).sort_values('position', kind='mergesort')
+    index = index.drop(columns='position').reset_index(drop=True)
+
+    sector_prefix_indices[sectorsourcename] = index
+    return index
+
+
+def expand_naics_list(df, sectorsourcename):
+    """
+    Adds a row for every more disaggregated sector of each sector in a crosswalk
+    :param df: activity to sector crosswalk
+    :param sectorsourcename: A sector source name
+    :return: crosswalk with the sectors expanded to all the sectors that start with them
+    """
 
     # fill null values
     df['Sector'] = df['Sector'].astype('str')
 
-    naics_df = pd.DataFrame([])
-    for i in df['Sector']:
-        dig = len(str(i))
-        n = sectors.loc[sectors[sectorsourcename].apply(lambda x: str(x[0:dig])) == i]
-        n['Sector'] = i
-        naics_df = naics_df.append(n)
-
-    # merge df to retain activityname/sectortype info
-    naics_expanded = df.merge(naics_df, how='left')
+    # merge df with each sector that starts with the sector, retaining activityname/sectortype info
+    naics_expanded = df.merge(get_sector_prefix_index(sectorsourcename), how='left', on='Sector')
     # drop column of aggregated naics and rename column of disaggregated naics
     naics_expanded = naics_expanded.drop(columns=["Sector"])
     naics_expanded = naics_expanded.rename(columns={sectorsourcename: 'Sector'})
@@ -125,10 +216,9 @@ def get_fba_allocation_subset(fba_allocation, source, activitynames):
     :return:
     """
 
-    # read in source crosswalk
-    df = pd.read_csv(datapath+'activitytosectormapping/'+'Crosswalk_'+source+'_toNAICS.csv')
-    sector_source_name = df['SectorSourceName'].all()
-    df = expand_naics_list(df, sector_source_name)
+    # source crosswalk, expanded to all sector levels, for the sector source name of the crosswalk
+    sectorsourcename = get_activitytosector_mapping(source)['SectorSourceName'].iloc[0]
+    df = get_sector_mapping(source, sectorsourcename, 'disagg')
     # subset source crosswalk to only contain values pertaining to list of activity names
     df = df.loc[df['Activity'].isin(activitynames)]
     # turn column of sectors related to activity names into list
@@ -0,0 +1,147 @@
+# profiling.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Records the wall time, cpu time, peak memory increase, and input and output rows of the stages of a
+FlowBySector run. Stages are recorded with the profile_stage context manager, and do nothing unless profiling
+is enabled, with enable_profiling or the FLOWSA_PROFILE environment variable.
+
+peak_rss_delta is how much a stage raised the peak resident memory of the process (ru_maxrss), not the memory
+the stage used. A stage that stays below the peak of an earlier stage records 0, so the column shows which
+stages set new peaks.
+"""
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+import pandas as pd
+from flowsa.common import log
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, where peak memory is not recorded
+    resource = None
+
+profiling_enabled = os.environ.get('FLOWSA_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+# stages recorded in this process, and the plan node or activity set they were recorded in
+stage_records = []
+profile_context = {'node': None}
+
+profile_fields = ['node', 'stage', 'wall_time', 'cpu_time', 'peak_rss_delta', 'rows_in', 'rows_out', 'bytes_copied',
+                  'pid']
+
+
+def enable_profiling(enabled=True):
+    """Turns the recording of stages on or off for this process"""
+    global profiling_enabled
+    profiling_enabled = enabled
+
+
+def clear_profile():
+    """Drops the stages recorded in this process"""
+    del stage_records[:]
+
+
+def get_peak_rss():
+    """Peak resident memory of this process in bytes, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def count_rows(obj):
+    """Number of rows of a df, or None for any other object"""
+    if isinstance(obj, pd.DataFrame):
+        return len(obj)
+    return None
+
+
+@contextmanager
+def profile_context_node(node):
+    """
+    Records the stages run inside the context under a plan node or activity set
+    :param node: str, name of the node
+    """
+    previous = profile_context['node']
+    profile_context['node'] = node
+    try:
+        yield
+    finally:
+        profile_context['node'] = previous
+
+
+@contextmanager
+def profile_stage(stage, df=None):
+    """
+    Records the time and memory of the code run inside the context. The output rows, and the bytes of data
+    copied by the stage if it counts them, are recorded by setting 'rows_out' and 'bytes_copied' on the
+    yielded record, EX:
+        with profile_stage('sector_aggregation', fbs) as record:
+            fbs = sector_aggregation(fbs, fbs_default_grouping_fields)
+            record['rows_out'] = len(fbs)
+    :param stage: str, name of the stage
+    :param df: df input to the stage, to record its rows
+    :return: dict of the stage record
+    """
+    record = {'node': profile_context['node'], 'stage': stage, 'rows_in': count_rows(df), 'rows_out': None,
+              'bytes_copied': None}
+    if not profiling_enabled:
+        yield record
+        return
+    peak_rss = get_peak_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_time'] = time.perf_counter() - wall_start
+        record['cpu_time'] = time.process_time() - cpu_start
+        record['peak_rss_delta'] = None if peak_rss is None else get_peak_rss() - peak_rss
+        record['pid'] = os.getpid()
+        stage_records.append(record)
+
+
+def get_profile():
+    """
+    Recorded stages, in the order they finished
+    :return: df with a row for each stage
+    """
+    return pd.DataFrame(stage_records, columns=profile_fields)
+
+
+def summarize_profile(profile):
+    """
+    Totals of the recorded stages by stage name, across nodes
+    :param profile: df of recorded stages, see get_profile
+    :return: df with the calls, wall time, cpu time, largest increase of the process peak memory, rows, and
+    bytes copied of each stage, sorted by wall time
+    """
+    summary = profile.groupby('stage', sort=False).agg(
+        calls=('wall_time', 'size'), wall_time=('wall_time', 'sum'), cpu_time=('cpu_time', 'sum'),
+        peak_rss_delta=('peak_rss_delta', 'max'), rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'),
+        bytes_copied=('bytes_copied', 'sum'))
+    return summary.sort_values('wall_time', ascending=False).reset_index()
+
+
+def write_profile_report(path):
+    """
+    Saves the recorded stages to a csv file and, with the totals of each stage, to a json file
+    :param path: str, path of the report without the file extension
+    """
+    if not profiling_enabled:
+        return
+    profile = get_profile()
+    try:
+        profile.to_csv(path + '.csv', index=False)
+        with open(path + '.json', 'w') as f:
+            json.dump({'stages': json.loads(profile.to_json(orient='records')),
+                       'summary': json.loads(summarize_profile(profile).to_json(orient='records'))}, f, indent=2)
+        log.info("Saved profile of stages to " + path + '.csv and ' + path + '.json')
+    except OSError:
+        log.error("Failed to save profile of stages to " + path)
@@ -14,7 +14,7 @@ setup(
         'pip>=9',
         'setuptools>=41',
         'pyyaml>=5.3',
-        'pyarrow == 0.15',
+        'pyarrow >= 1.0',
         'requests >=2.22.0'],
     url='https://github.com/USEPA/FLOWSA',
     license='CC0',
@@ -0,0 +1,156 @@
+# synthetic_inputs.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Generators of synthetic flowbyactivity inputs of a flowbysector method, with real FIPS codes and activity names,
+so a method runs through flowsa without network access. Also used by the benchmarks, see benchmarks/synthetic.py
+"""
+
+import yaml
+import numpy as np
+import pandas as pd
+from flowsa.common import flow_by_activity_fields, get_geoscale_FIPS, datapath, flowbyactivitymethodpath
+
+
+def get_locations(geoscale, year=2015):
+    """
+    FIPS codes of a geoscale
+    :param geoscale: 'national', 'state', or 'county'
+    :return: array of FIPS codes
+    """
+    return np.array(get_geoscale_FIPS(geoscale, str(year)), dtype=object)
+
+
+def load_crosswalk_activities(source):
+    """Activity names in the activity to sector crosswalk of a source"""
+    cw = pd.read_csv(datapath + 'activitytosectormapping/Crosswalk_' + source + '_toNAICS.csv', dtype='str')
+    return cw['Activity'].drop_duplicates().values
+
+
+def make_flowbyactivity(n_rows, geoscale='county', source='BLS_QCEW', activities=None, flow_class='Employment',
+                        flowname='Number of employees', unit='p', activity_field='ActivityProducedBy', year=2015,
+                        seed=0):
+    """
+    Synthetic flowbyactivity df with the locations of a geoscale and unique location and activity pairs
+    :param n_rows: int, number of rows, at most the number of locations times the number of activities
+    :param geoscale: 'national', 'state', or 'county'
+    :param source: SourceName, also used to load the activities from the source crosswalk
+    :param activities: list of activity names, defaults to the activities in the crosswalk of source
+    :param activity_field: 'ActivityProducedBy' or 'ActivityConsumedBy', the other field is 'None'
+    :return: df with the flowbyactivity fields
+    """
+    rng = np.random.default_rng(seed)
+    locations = get_locations(geoscale, year)
+    if activities is None:
+        activities = load_crosswalk_activities(source)
+    activities = np.array(activities, dtype=object)
+    n_rows = min(n_rows, len(locations) * len(activities))
+    pair = rng.choice(len(locations) * len(activities), n_rows, replace=False)
+    other_field = 'ActivityConsumedBy' if activity_field == 'ActivityProducedBy' else 'ActivityProducedBy'
+
+    df = pd.DataFrame({'Class': flow_class, 'SourceName': source, 'FlowName': flowname,
+                       'FlowAmount': rng.gamma(1.0, 100.0, n_rows), 'Unit': unit,
+                       activity_field: activities[pair % len(activities)], other_field: 'None',
+                       'Compartment': 'None', 'Location': locations[pair // len(activities)],
+                       'LocationSystem': 'FIPS_' + str(year), 'Year': year})
+    for k, v in flow_by_activity_fields.items():
+        if k not in df.columns:
+            df[k] = '' if v[0]['dtype'] == 'str' else rng.integers(1, 6, n_rows).astype(float)
+    return df[list(flow_by_activity_fields.keys())]
+
+
+# usgs water use columns, in the format of the data service responses
+usgs_nwis_wu_descriptions = [
+    'Public Supply total population served, in thousands',
+    'Public Supply self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Public Supply self-supplied surface-water withdrawals, fresh, in Mgal/d',
+    'Public Supply total self-supplied withdrawals, fresh, in Mgal/d',
+    'Public Supply deliveries to domestic, in Mgal/d',
+    'Public Supply deliveries to industrial, in Mgal/d',
+    'Domestic self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Domestic self-supplied surface-water withdrawals, fresh, in Mgal/d',
+    'Domestic deliveries from public supply, in Mgal/d',
+    'Domestic total self-supplied withdrawals plus deliveries, in Mgal/d',
+    'Industrial self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Industrial self-supplied surface-water withdrawals, saline, in Mgal/d',
+    'Industrial total self-supplied withdrawals, fresh, in Mgal/d',
+    'Commercial self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Irrigation, Crop self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Irrigation, Crop self-supplied surface-water withdrawals, fresh, in Mgal/d',
+    'Irrigation, Crop sprinkler irrigation, in thousand acres',
+    'Irrigation, Golf Courses self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Irrigation, Golf Courses total consumptive use, fresh, in Mgal/d',
+    'Livestock self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Aquaculture self-supplied surface-water withdrawals, saline, in Mgal/d',
+    'Mining self-supplied groundwater withdrawals, saline, in Mgal/d',
+    'Mining self-supplied surface-water withdrawals, fresh, in Mgal/d',
+    'Total Thermoelectric Power self-supplied surface-water withdrawals, fresh, in Mgal/d',
+    'Total Thermoelectric Power power generation, in gigawatt-hours',
+    'Thermoelectric Power (Once-through cooling) self-supplied groundwater withdrawals, fresh, in Mgal/d',
+    'Thermoelectric Power (Closed-loop cooling) total consumptive use, fresh, in Mgal/d',
+    'Hydroelectric Power instream withdrawals, fresh, in Mgal/d',
+    'Total withdrawals, fresh, in Mgal/d',
+    'Total Groundwater withdrawals, fresh, in Mgal/d',
+]
+
+
+def make_usgs_amounts(n, rng):
+    """usgs flow amounts as text, with the '-' of missing data and the footnote letters of the data service"""
+    amounts = np.char.mod('%.2f', rng.gamma(1.0, 20.0, n)).astype(object)
+    kind = rng.random(n)
+    amounts[kind < 0.05] = '-'
+    amounts[(kind >= 0.05) & (kind < 0.08)] = amounts[(kind >= 0.05) & (kind < 0.08)] + 'a'
+    return amounts
+
+
+def make_usgs_nwis_wu_responses(geoscales=('national', 'state', 'county'), year=2015, seed=0):
+    """
+    Synthetic USGS_NWIS_WU data service responses, as returned by usgs_call, for every state or county of each
+    geoscale, like the responses of a data pull
+    :param geoscales: geoscales of the responses, usgs_parse requires state or county responses
+    :return: list of dfs, one for the nation and one per state for the state and county geoscales, to pass
+    to usgs_parse
+    """
+    rng = np.random.default_rng(seed)
+    dfs = []
+    if 'national' in geoscales:
+        dfs.append(pd.DataFrame({'geo': 'national', 'Description': usgs_nwis_wu_descriptions,
+                                 'FlowAmount': make_usgs_amounts(len(usgs_nwis_wu_descriptions), rng),
+                                 'year': str(year)}))
+    for geoscale in [g for g in geoscales if g != 'national']:
+        locations = pd.Series(get_locations(geoscale, year))
+        for state, fips in locations.groupby(locations.str[0:2]):
+            df = pd.DataFrame({'geo': geoscale, 'state_cd': state, 'state_name': 'State ' + state,
+                               'county_cd': fips.str[2:5].values, 'county_nm': 'County ' + fips.values,
+                               'year': str(year)})
+            if geoscale == 'state':
+                df = df.drop(columns=['county_cd', 'county_nm'])
+            for d in usgs_nwis_wu_descriptions:
+                df[d] = make_usgs_amounts(len(df), rng)
+            dfs.append(df)
+    return dfs
+
+
+def make_water_method_inputs(fbaoutputpath, geoscales=('national', 'state', 'county'), allocation_rows=50000,
+                             seed=0):
+    """
+    Stores synthetic 2015 USGS_NWIS_WU and BLS_QCEW flowbyactivity parquets, parsed from synthetic responses,
+    and creates a method from Water_national_2015_m1 with the activity sets that use only those sources
+    :param fbaoutputpath: str, directory the flowbyactivity parquets are saved to
+    :param geoscales: geoscales of the USGS_NWIS_WU responses, see make_usgs_nwis_wu_responses
+    :param allocation_rows: int, number of state BLS_QCEW rows
+    :return: dictionary of the flowbysector method
+    """
+    from flowsa.USGS_NWIS_WU import usgs_parse
+
+    usgs = usgs_parse(make_usgs_nwis_wu_responses(geoscales, seed=seed), {'year': '2015'})
+    usgs.to_parquet(fbaoutputpath + 'USGS_NWIS_WU_2015.parquet')
+    make_flowbyactivity(allocation_rows, geoscale='state', seed=seed).to_parquet(
+        fbaoutputpath + 'BLS_QCEW_2015.parquet')
+
+    with open(flowbyactivitymethodpath + 'Water_national_2015_m1.yaml', 'r') as f:
+        method = yaml.safe_load(f)
+    source = method['flowbyactivity_sources']['USGS_NWIS_WU']
+    source['activity_sets'] = {k: v for k, v in source['activity_sets'].items()
+                               if v['allocation_source'] in ('None', 'BLS_QCEW')}
+    return method
@@ -0,0 +1,58 @@
+# test_BLS_QCEW.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of reading the zipped pre-2014 bls qcew data """
+import io
+import zipfile
+import unittest
+import requests
+from urllib3.response import HTTPResponse
+from flowsa.BLS_QCEW import bls_qcew_call, bls_qcew_parse
+
+
+def make_zip():
+    header = ('area_fips,own_code,industry_code,agglvl_code,year,qtr,annual_avg_estabs_count,'
+              'annual_avg_emplvl,total_annual_wages\n')
+    files = {'2013.annual.by_area/2013.annual 01000 Alabama -- Statewide.csv':
+                 header + '"01000",0,"10",50,2013,"A",100,1000,50000\n'
+                          '"01000",5,"10",51,2013,"A",80,900,40000\n'
+                          '"01000",5,"31-33",54,2013,"A",10,300,20000\n',
+             '2013.annual.by_area/2013.annual 02000 Alaska -- Statewide.csv':
+                 header + '"02000",1,"10",51,2013,"A",5,60,3000\n',
+             '2013.annual.by_area/2013.annual 01001 Autauga County, Alabama.csv':
+                 header + '"01001",5,"10",71,2013,"A",7,70,700\n'}
+    b = io.BytesIO()
+    with zipfile.ZipFile(b, 'w') as z:
+        for name, text in files.items():
+            z.writestr(name, text)
+    return b.getvalue()
+
+
+def make_response(content):
+    response = requests.models.Response()
+    response.status_code = 200
+    # a streamed response, which can not be seeked
+    response.raw = HTTPResponse(body=io.BytesIO(content), preload_content=False)
+    return response
+
+
+class TestBlsQcewCall(unittest.TestCase):
+
+    def test_read_zip(self):
+        df = bls_qcew_call('https://data.bls.gov/cew/data/files/2013/csv/2013_annual_by_area.zip',
+                           make_response(make_zip()), {'year': '2013'})
+        self.assertEqual(['area_fips', 'own_code', 'industry_code', 'year', 'annual_avg_estabs',
+                          'annual_avg_emplvl', 'total_annual_wages'], list(df.columns))
+        # county files and the total of all ownerships are not read
+        self.assertEqual(['01000', '01000', '02000'], list(df['area_fips']))
+        self.assertEqual(['10', '31-33', '10'], list(df['industry_code']))
+        self.assertEqual([80, 10, 5], list(df['annual_avg_estabs']))
+
+        fba = bls_qcew_parse([df], {'year': '2013'}).set_index(['Location', 'ActivityProducedBy', 'FlowName'])
+        self.assertEqual(960, fba.loc[('02000', '10', 'Number of employees'), 'FlowAmount']
+                         + fba.loc[('01000', '10', 'Number of employees'), 'FlowAmount'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# test_EPA_NEI.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of reading the zipped epa nei data """
+import io
+import shutil
+import zipfile
+import tempfile
+import unittest
+import pandas as pd
+import requests
+import flowsa.common
+import flowsa.EPA_NEI
+import flowsa.flowbyactivity
+from flowsa.common import set_categorical_schema
+from flowsa.EPA_NEI import epa_nei_call, epa_nei_onroad_parse, store_epa_nei_onroad_partition
+
+
+def make_zip(n_sccs=1):
+    header = ('epa region code,state,fips state code,tribal name,fips code,county,data category,'
+              'emissions type code,scc,sector,aetc,reporting period,emissions operating type,pollutant code,'
+              'pollutant desc,pollutant type(s),total emissions,emissions uom,data set\n')
+    row = '{region},AL,01,,"{fips}",Autauga,Onroad,,{scc},Mobile,,,,{code},{desc},CAP,{amount},TON,2017NEI\n'
+    files = {'onroad_123.csv': header + row.format(region=4, fips='01001', scc='2201001110', code='CO',
+                                                   desc='Carbon Monoxide', amount=1.5) +
+                                        row.format(region=4, fips='01003', scc='2201001110', code='NOX',
+                                                   desc='Nitrogen Oxides', amount=2.5),
+             'onroad_45.csv': header + row.format(region=5, fips='17031', scc='2202001110', code='CO',
+                                                  desc='Carbon Monoxide', amount=4.0) +
+                                       row.format(region=5, fips='17031', scc='2202001110', code='VOC',
+                                                  desc='Volatile Organic Compounds', amount=0.5) +
+                                       ''.join(row.format(region=5, fips='17031', scc=str(2203000000 + i),
+                                                          code='CO', desc='Carbon Monoxide', amount=1.0)
+                                               for i in range(n_sccs - 1)),
+             'readme.txt': 'not data'}
+    b = io.BytesIO()
+    with zipfile.ZipFile(b, 'w') as z:
+        for name, text in files.items():
+            z.writestr(name, text)
+    return b.getvalue()
+
+
+def make_response(content):
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(content)
+    return response
+
+
+class TestEpaNeiCall(unittest.TestCase):
+
+    def test_read_zip(self):
+        df = epa_nei_call('', make_response(make_zip()), {'year': '2017'})
+        self.assertEqual(['fips code', 'scc', 'pollutant code', 'pollutant desc', 'total emissions',
+                          'emissions uom'], list(df.columns))
+        self.assertEqual(4, len(df))
+        # the categories of each csv are combined
+        self.assertEqual('category', df['pollutant code'].dtype.name)
+        self.assertEqual(['CO', 'NOX', 'CO', 'VOC'], list(df['pollutant code']))
+        self.assertEqual(['01001', '01003', '17031', '17031'], list(df['fips code']))
+
+        fba = epa_nei_onroad_parse([df], {'year': '2017'})
+        self.assertEqual(8.5, fba['FlowAmount'].sum())
+        self.assertEqual(['2201001110', '2201001110', '2202001110', '2202001110'],
+                         list(fba['ActivityProducedBy']))
+
+
+class TestStoreEpaNeiPartition(unittest.TestCase):
+
+    def setUp(self):
+        self.fbaoutputpath = flowsa.EPA_NEI.fbaoutputpath
+        self.categorical_schema = flowsa.common.categorical_schema
+        flowsa.EPA_NEI.fbaoutputpath = tempfile.mkdtemp() + '/'
+
+    def tearDown(self):
+        shutil.rmtree(flowsa.EPA_NEI.fbaoutputpath)
+        flowsa.EPA_NEI.fbaoutputpath = self.fbaoutputpath
+        set_categorical_schema(self.categorical_schema)
+
+    def test_store_partition(self):
+        rows = store_epa_nei_onroad_partition(make_response(make_zip()), {'year': '2017'}, chunksize=1)
+        self.assertEqual(4, rows)
+        df = pd.read_parquet(flowsa.EPA_NEI.fbaoutputpath + 'EPA_NEI_Onroad')
+        self.assertEqual(['2017'] * 4, list(df['Year'].astype(str)))
+        self.assertEqual(['CO', 'NOX', 'CO', 'VOC'], list(df['FlowName']))
+
+    def test_store_categorical_partition(self):
+        set_categorical_schema(True)
+        # the chunk of the second csv has more categories than fit in the int8 codes of the first chunk
+        rows = store_epa_nei_onroad_partition(make_response(make_zip(n_sccs=200)), {'year': '2017'})
+        self.assertEqual(203, rows)
+        df = pd.read_parquet(flowsa.EPA_NEI.fbaoutputpath + 'EPA_NEI_Onroad')
+        self.assertEqual('category', df['ActivityProducedBy'].dtype.name)
+        self.assertEqual(201, df['ActivityProducedBy'].nunique())
+        self.assertEqual(['CO', 'NOX', 'CO', 'VOC'], list(df['FlowName'][:4]))
+
+    def test_stream_from_main(self):
+        make_http_request = flowsa.flowbyactivity.make_http_request
+        flowsa.flowbyactivity.make_http_request = lambda url, cache_ttl=None, offline=None: \
+            make_response(make_zip())
+        try:
+            self.assertIsNone(flowsa.flowbyactivity.main('EPA_NEI_Onroad', '2017', stream=True))
+        finally:
+            flowsa.flowbyactivity.make_http_request = make_http_request
+        df = pd.read_parquet(flowsa.EPA_NEI.fbaoutputpath + 'EPA_NEI_Onroad')
+        self.assertEqual(4, len(df))
+
+
+if __name__ == '__main__':
+    unittest.main()
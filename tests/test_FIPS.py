@@ -6,7 +6,7 @@
 """Add docstring in public module."""  # TODO add docstring.
 
 import unittest
-from flowsa.common import getFIPS
+from flowsa.common import getFIPS, get_FIPS_index, get_geoscale_FIPS, get_FIPS_year
 
 
 class TestFIPS(unittest.TestCase):
@@ -33,3 +33,18 @@ class TestFIPS(unittest.TestCase):
         state = "IOWA"
         county = "Dubuque"
         self.assertEqual(getFIPS(state=state, county=county), "19061")
+
+    def test_geoscale_FIPS(self):
+        """State and county FIPS lists come from the index read once per year."""
+        self.assertIs(get_FIPS_index('2015'), get_FIPS_index(2015))
+        states = get_geoscale_FIPS('state')
+        self.assertIn('13000', states)
+        self.assertNotIn('19061', states)
+        self.assertIn('19061', get_geoscale_FIPS('county'))
+        self.assertEqual(states, get_FIPS_index('2015')['state_FIPS'])
+        self.assertEqual(len(states), len(set(states)))
+
+    def test_FIPS_year(self):
+        """Data years use the latest FIPS crosswalk year not after them."""
+        self.assertEqual(['2010', '2010', '2013', '2015', '2015'],
+                         [get_FIPS_year(y) for y in (2005, '2012', 2013, 2015, 2019)])
@@ -0,0 +1,59 @@
+# test_USGS_NWIS_WU.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of reading and parsing usgs water use data into flowbyactivity format """
+import unittest
+import pandas as pd
+import requests
+from flowsa.USGS_NWIS_WU import usgs_call, usgs_parse
+
+
+def make_response(text):
+    response = requests.models.Response()
+    response._content = text.encode()
+    response.encoding = 'utf-8'
+    return response
+
+
+class TestUsgsCall(unittest.TestCase):
+
+    def test_read_rdb(self):
+        text = ('# US Geological Survey\n#  water use data\n#\n'
+                'state_cd\tstate_name\tcounty_cd\tcounty_nm\tyear\tDomestic total, in Mgal/d\n'
+                '2s\t12s\t3s\t16s\t4n\t12n\n'
+                '01\tAlabama\t001\tAutauga County\t2015\t1.23\n'
+                '01\tAlabama\t003\tBaldwin County\t2015\t\n')
+        df = usgs_call('https://waterdata.usgs.gov/al/nwis/water_use?wu_area=County', make_response(text), {})
+        self.assertEqual(['geo', 'state_cd', 'state_name', 'county_cd', 'county_nm', 'year',
+                          'Domestic total, in Mgal/d'], list(df.columns))
+        self.assertEqual(['001', '003'], list(df['county_cd']))
+        self.assertEqual(['1.23', ''], list(df['Domestic total, in Mgal/d']))
+        self.assertEqual(['county', 'county'], list(df['geo']))
+
+
+class TestUsgsParse(unittest.TestCase):
+
+    def test_parse_descriptions(self):
+        national = pd.DataFrame({'geo': 'national',
+                                 'Description': ['Public Supply total self-supplied withdrawals, fresh, in Mgal/d',
+                                                 'Commercial self-supplied groundwater withdrawals, fresh, in Mgal/d'],
+                                 'FlowAmount': ['10.5', '1.0']})
+        state = pd.DataFrame({'geo': 'state', 'state_cd': ['01', '02'], 'state_name': ['Alabama', 'Alaska'],
+                              'Public Supply deliveries to domestic, in Mgal/d': ['2.0a', '-'],
+                              'Mining self-supplied groundwater withdrawals, saline, in Mgal/d': ['3.0', '4.0'],
+                              'Public Supply total population served, in thousands': ['5', '6']})
+        df = usgs_parse([national, state], {'year': '2015'}).set_index(['Location', 'Description'])
+        self.assertEqual(4, len(df))
+        row = df.loc[('01000', 'Public Supply deliveries to domestic, in Mgal/d')]
+        self.assertEqual(['2.0', 'Mgal/d', 'total', 'Public Supply', 'Domestic', '2'],
+                         row[['FlowAmount', 'Unit', 'FlowName', 'ActivityProducedBy', 'ActivityConsumedBy',
+                              'DataReliability']].tolist())
+        row = df.loc[('02000', 'Mining self-supplied groundwater withdrawals, saline, in Mgal/d')]
+        self.assertEqual(['saline', 'ground', 'None', 'Mining', '4'],
+                         row[['FlowName', 'Compartment', 'ActivityProducedBy', 'ActivityConsumedBy',
+                              'DataReliability']].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+# test_batch.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of building flowbyactivity datasets in batches """
+import unittest
+from flowsa.batch import get_batch_datasets, batch_main
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_get_batch_datasets(self):
+        self.assertEqual([('USGS_NWIS_WU', '2010'), ('USGS_NWIS_WU', '2015')],
+                         get_batch_datasets(['USGS_NWIS_WU']))
+        self.assertEqual([('USGS_NWIS_WU', '2015')], get_batch_datasets(['USGS_NWIS_WU'], years=[2015]))
+        self.assertEqual([('BLS_QCEW', '2016')], get_batch_datasets(['BLS_QCEW:2016']))
+        datasets = get_batch_datasets(['USDA_CoA_*'], years=['2017'])
+        self.assertIn(('USDA_CoA_Cropland', '2017'), datasets)
+        self.assertIn(('USDA_CoA_Livestock', '2017'), datasets)
+
+    def test_failed_dataset_reported(self):
+        summary = batch_main([('not_a_source', '2015')], workers=1)
+        self.assertEqual(['failed'], list(summary['status']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# test_call_urls.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of calling the urls of a flowbyactivity pull """
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import flowsa.flowbyactivity
+from flowsa.flowbyactivity import call_urls, get_url_shard_file
+
+
+def fake_call(url, r, args):
+    fake_call.urls_called.append(url)
+    return pd.DataFrame({'Location': ['01000', '02000'], 'FlowAmount': [1, 2]},
+                        index=pd.Index([5, 7], name='row')).astype({'Location': 'category'})
+
+
+class TestCallUrls(unittest.TestCase):
+
+    def setUp(self):
+        self.fba_shard_path = flowsa.flowbyactivity.fba_shard_path
+        flowsa.flowbyactivity.fba_shard_path = tempfile.mkdtemp() + '/'
+        self.make_http_request = flowsa.flowbyactivity.make_http_request
+        flowsa.flowbyactivity.make_http_request = lambda url, cache_ttl=None, offline=None: None
+        flowsa.flowbyactivity.fake_call = fake_call
+        fake_call.urls_called = []
+        self.urls = ['http://example.com/1', 'http://example.com/2']
+        self.args = {'source': 'test', 'year': '2015'}
+        self.config = {'call_response_fxn': 'fake_call'}
+
+    def tearDown(self):
+        shutil.rmtree(flowsa.flowbyactivity.fba_shard_path)
+        flowsa.flowbyactivity.fba_shard_path = self.fba_shard_path
+        flowsa.flowbyactivity.make_http_request = self.make_http_request
+        del flowsa.flowbyactivity.fake_call
+
+    def test_dataframes_not_round_tripped(self):
+        dfs = call_urls(self.urls, self.args, self.config)
+        self.assertEqual(self.urls, fake_call.urls_called)
+        for df in dfs:
+            # the dtypes and index are as returned by the call_response_fxn
+            pd.testing.assert_frame_equal(fake_call('', None, {}), df)
+        # shards are saved in case the pull fails and is resumed
+        self.assertTrue(all(os.path.isfile(get_url_shard_file(url, self.args)) for url in self.urls))
+
+    def test_resume_skips_called_urls(self):
+        call_urls(self.urls[:1], self.args, self.config)
+        fake_call.urls_called = []
+        dfs = call_urls(self.urls, dict(self.args, resume=True), self.config)
+        self.assertEqual(self.urls[1:], fake_call.urls_called)
+        self.assertEqual(2, len(dfs))
+        pd.testing.assert_frame_equal(fake_call('', None, {}), dfs[0])
+        # without resume, every url is called
+        fake_call.urls_called = []
+        call_urls(self.urls, self.args, self.config)
+        self.assertEqual(self.urls, fake_call.urls_called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+# test_datachecks.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the flowbysector data checks """
+import unittest
+import pandas as pd
+from flowsa.datachecks import sector_flow_comparision
+
+
+class TestSectorFlowComparision(unittest.TestCase):
+
+    def test_sector_lengths_summed(self):
+        fbs = pd.DataFrame({'Flowable': 'Water', 'Class': 'Water',
+                            'SectorProducedBy': ['None', 'None', 'None', '221310', '21'],
+                            'SectorConsumedBy': ['111110', '111120', '221310', '1121', 'None'],
+                            'Context': 'resource/water', 'Location': '00000', 'LocationSystem': 'FIPS_2015',
+                            'FlowAmount': [1.0, 2.0, 4.0, 16.0, 32.0], 'Unit': 'Mgal',
+                            'FlowType': 'ELEMENTARY_FLOW', 'Year': 2015, 'MeasureofSpread': '',
+                            'DistributionType': '', 'DataReliability': 1.0})
+        df = sector_flow_comparision(fbs).set_index(['SectorProducedBy', 'SectorConsumedBy', 'SectorLength'])
+        # flows with no produced by sector are compared by consumed by sector, and the reverse
+        self.assertEqual(7.0, df.loc[('None', 'All', 2), 'FlowAmount'])
+        self.assertEqual(7.0, df.loc[('None', 'All', 6), 'FlowAmount'])
+        self.assertEqual(32.0, df.loc[('All', 'None', 2), 'FlowAmount'])
+        # public supply deliveries are compared by consumed by sector
+        self.assertEqual(16.0, df.loc[('221310', 'All', 4), 'FlowAmount'])
+
+
+if __name__ == '__main__':
+    unittest.main()
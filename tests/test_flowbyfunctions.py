@@ -0,0 +1,214 @@
+# test_flowbyfunctions.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of flowbysector aggregation functions """
+import unittest
+import numpy as np
+import pandas as pd
+import flowsa.common
+import flowsa.profiling
+from flowsa.common import set_categorical_schema, flow_by_sector_fields, convert_units, convert_fba_unit, \
+    generalize_activity_field_names
+from flowsa.flowbyfunctions import aggregator, sector_aggregation, sector_aggregation_legacy, \
+    fbs_default_grouping_fields, add_missing_flow_by_fields, harmonize_units
+
+
+class TestAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'Location': ['06001', '06001', '06037', '06037', '06075', '06075'],
+                                'FlowAmount': [1.0, 3.0, 0.0, 0.0, 2.0, 2.0],
+                                'DataReliability': [1.0, 5.0, 2.0, 4.0, 3.0, np.nan],
+                                'Min': [0.5, 1.5, 1.0, 3.0, 1.0, 2.0]})
+
+    def test_weighted_average(self):
+        df = aggregator(self.df, ['Location']).set_index('Location')
+        self.assertEqual(['FlowAmount', 'Min', 'DataReliability'], list(df.columns))
+        self.assertEqual(4.0, df.loc['06001', 'FlowAmount'])
+        self.assertEqual(4.0, df.loc['06001', 'DataReliability'])
+        self.assertEqual(1.25, df.loc['06001', 'Min'])
+        # flows that sum to zero take the unweighted average
+        self.assertEqual(3.0, df.loc['06037', 'DataReliability'])
+        self.assertTrue(np.isnan(df.loc['06075', 'DataReliability']))
+        self.assertEqual(1.5, df.loc['06075', 'Min'])
+
+    def test_matches_legacy(self):
+        df = aggregator(self.df, ['Location'])
+        legacy = aggregator(self.df, ['Location'], legacy_weighted_avg=True)
+        # the legacy averages of flows that sum to zero are nan
+        pd.testing.assert_frame_equal(legacy.drop(1), df.drop(1))
+
+
+class TestSectorAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.fbs = pd.DataFrame({'Flowable': 'Water', 'Class': 'Water',
+                                 'SectorProducedBy': ['None', 'None', 'None', 'None', '221310', 'None', 'None'],
+                                 'SectorConsumedBy': ['111110', '111120', '112111', '1121', '111110', 'F01000',
+                                                      '31-33'],
+                                 'Context': 'resource/water', 'Location': ['06037', '06037', '06037', '06037',
+                                                                           '06037', '06037', '06001'],
+                                 'LocationSystem': 'FIPS_2015', 'FlowAmount': [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0],
+                                 'Unit': 'Mgal', 'FlowType': 'ELEMENTARY_FLOW', 'Year': 2015,
+                                 'MeasureofSpread': '', 'DistributionType': '',
+                                 'DataReliability': [1.0, 3.0, 5.0, 5.0, 2.0, 1.0, 1.0]})
+
+    def test_parent_sectors_summed(self):
+        fbs = sector_aggregation(self.fbs, fbs_default_grouping_fields)
+        fbs = fbs.set_index(['SectorProducedBy', 'SectorConsumedBy'])
+        self.assertEqual(3.0, fbs.loc[('None', '111'), 'FlowAmount'])
+        self.assertEqual(15.0, fbs.loc[('None', '11'), 'FlowAmount'])
+        # existing 4 digit sectors are not replaced by the sum of the longer sectors
+        self.assertEqual(12.0, fbs.loc[('None', '112'), 'FlowAmount'])
+        self.assertEqual(16.0, fbs.loc[('2213', '1111'), 'FlowAmount'])
+        self.assertAlmostEqual(7 / 3, fbs.loc[('None', '111'), 'DataReliability'])
+        self.assertEqual(32.0, fbs.loc[('None', 'F010'), 'FlowAmount'])
+
+    def test_matches_legacy(self):
+        fbs = sector_aggregation(self.fbs, fbs_default_grouping_fields)
+        legacy = sector_aggregation_legacy(self.fbs, fbs_default_grouping_fields)
+        pd.testing.assert_frame_equal(legacy, fbs)
+
+
+class TestAddMissingFlowByFields(unittest.TestCase):
+
+    def setUp(self):
+        TestSectorAggregation.setUp(self)
+        self.profiling_enabled = flowsa.profiling.profiling_enabled
+        flowsa.profiling.enable_profiling()
+        flowsa.profiling.clear_profile()
+        self.categorical_schema = flowsa.common.categorical_schema
+        set_categorical_schema(False)
+
+    def tearDown(self):
+        flowsa.profiling.enable_profiling(self.profiling_enabled)
+        flowsa.profiling.clear_profile()
+        set_categorical_schema(self.categorical_schema)
+
+    def test_only_differing_columns_cast(self):
+        columns = list(self.fbs.columns)
+        fbs = add_missing_flow_by_fields(self.fbs, flow_by_sector_fields)
+        self.assertEqual(list(flow_by_sector_fields.keys()), list(fbs.columns))
+        # the df passed in is not modified
+        self.assertEqual(columns, list(self.fbs.columns))
+        self.assertTrue(np.shares_memory(fbs['FlowAmount'].values, self.fbs['FlowAmount'].values))
+        self.assertEqual('float64', fbs['Spread'].dtype.name)
+        self.assertTrue(fbs['Spread'].isna().all())
+        # a df that already has the fields is returned as a new df sharing its data
+        conformed = add_missing_flow_by_fields(fbs, flow_by_sector_fields)
+        self.assertIsNot(fbs, conformed)
+        pd.testing.assert_frame_equal(fbs, conformed)
+        self.assertTrue(np.shares_memory(fbs['FlowAmount'].values, conformed['FlowAmount'].values))
+        conformed['SectorLength'] = 1
+        self.assertNotIn('SectorLength', fbs.columns)
+        profile = flowsa.profiling.get_profile()
+        self.assertEqual(['add_missing_flow_by_fields'] * 2, list(profile['stage']))
+        # the missing columns are the only bytes copied
+        self.assertEqual(0, profile['bytes_copied'][1])
+        self.assertEqual(7 * 7 * 8, profile['bytes_copied'][0])
+
+    def test_only_differing_columns_cast_categorical(self):
+        set_categorical_schema(True)
+        fbs = add_missing_flow_by_fields(self.fbs, flow_by_sector_fields)
+        self.assertEqual('category', fbs['Location'].dtype.name)
+        self.assertEqual('object', self.fbs['Location'].dtype.name)
+        self.assertTrue(np.shares_memory(fbs['FlowAmount'].values, self.fbs['FlowAmount'].values))
+        # a df that already has the categorical fields is not cast again
+        conformed = add_missing_flow_by_fields(fbs, flow_by_sector_fields)
+        self.assertTrue(np.shares_memory(fbs['Location'].cat.codes.values, conformed['Location'].cat.codes.values))
+        self.assertEqual(0, flowsa.profiling.get_profile()['bytes_copied'][1])
+
+    def test_values_cast(self):
+        df = pd.DataFrame({'Flowable': ['Water', None], 'FlowAmount': ['1.5', 2], 'Year': ['2015', 2015]})
+        fbs = add_missing_flow_by_fields(df, flow_by_sector_fields)
+        self.assertEqual(['Water', 'None'], list(fbs['Flowable']))
+        self.assertEqual([1.5, 2.0], list(fbs['FlowAmount']))
+        self.assertEqual('int64', fbs['Year'].dtype.name)
+        self.assertEqual(['None', 'None'], list(fbs['Context']))
+
+
+class TestGeneralizeActivityFieldNames(unittest.TestCase):
+
+    def test_none_fields_dropped(self):
+        df = pd.DataFrame({'ActivityProducedBy': ['None', 'None'], 'ActivityConsumedBy': ['Mining', 'Domestic'],
+                           'SectorProducedBy': ['21', '22'], 'SectorConsumedBy': ['None', 'None']})
+        df = generalize_activity_field_names(df)
+        self.assertEqual(['Activity', 'Sector'], list(df.columns))
+        self.assertEqual(['Mining', 'Domestic'], list(df['Activity']))
+        self.assertEqual(['21', '22'], list(df['Sector']))
+
+
+class TestCategoricalSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.categorical_schema = flowsa.common.categorical_schema
+        TestSectorAggregation.setUp(self)
+
+    def tearDown(self):
+        set_categorical_schema(self.categorical_schema)
+
+    def get_fbs(self, categorical):
+        set_categorical_schema(categorical)
+        return add_missing_flow_by_fields(self.fbs.copy(), flow_by_sector_fields)
+
+    def test_fields_are_categories(self):
+        fbs = self.get_fbs(True)
+        self.assertEqual('category', fbs['SectorConsumedBy'].dtype.name)
+        self.assertEqual('category', fbs['Location'].dtype.name)
+        self.assertEqual('float64', fbs['FlowAmount'].dtype.name)
+        # the values are the same as with plain str columns
+        plain = self.get_fbs(False)
+        self.assertEqual('object', plain['SectorConsumedBy'].dtype.name)
+        pd.testing.assert_frame_equal(plain, fbs.astype({c: object for c in fbs.columns
+                                                         if fbs[c].dtype.name == 'category'}))
+
+    def test_aggregation_matches_plain(self):
+        plain = sector_aggregation(self.get_fbs(False), fbs_default_grouping_fields)
+        fbs = sector_aggregation(self.get_fbs(True), fbs_default_grouping_fields)
+        fbs = fbs.astype({c: object for c in fbs.columns if fbs[c].dtype.name == 'category'})
+        pd.testing.assert_frame_equal(plain.reset_index(drop=True), fbs.reset_index(drop=True))
+        # only the combinations of categories in the data are grouped
+        self.assertEqual(len(aggregator(self.get_fbs(False), fbs_default_grouping_fields)),
+                         len(aggregator(self.get_fbs(True), fbs_default_grouping_fields)))
+
+
+class TestConvertUnits(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'Class': ['Water', 'Water', 'Land', 'Land', 'Employment', None],
+                                'Unit': ['Bgal/d', 'Mgal/d', 'ACRES', 'ACRE FEET / ACRE', 'p', np.nan],
+                                'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+
+    def test_registry_conversions(self):
+        df = convert_fba_unit(self.df.copy())
+        self.assertEqual(['Mgal', 'Mgal', 'ACRES', 'ACRE FEET / ACRE', 'p'], list(df['Unit'][:5]))
+        self.assertTrue(pd.isnull(df['Unit'][5]))
+        self.assertEqual([365000.0, 730.0, 3.0, 4.0, 5.0, 6.0], list(df['FlowAmount']))
+        df = harmonize_units(df)
+        self.assertEqual(['Mgal', 'Mgal', 'm2.yr', 'm3.m2.yr', 'p'], list(df['Unit'][:5]))
+        self.assertAlmostEqual(3 * 4046.8564224, df['FlowAmount'][2])
+        self.assertAlmostEqual(4 / 4046.856422 * 1233.481837, df['FlowAmount'][3])
+        # categorical units stay categorical
+        df = convert_fba_unit(self.df.astype({'Unit': 'category'}))
+        self.assertEqual('category', df['Unit'].dtype.name)
+        self.assertEqual(['Mgal', 'Mgal', 'ACRES'], list(df['Unit'][:3]))
+
+    def test_class_conversions(self):
+        flowsa.common.unit_conversions['test'] = pd.DataFrame(
+            {'Class': ['Land', np.nan], 'SourceUnit': ['ACRES', 'ACRES'], 'TargetUnit': ['ha', 'm2'],
+             'Factor': [0.40468564224, 4046.8564224]})
+        try:
+            df = self.df.copy()
+            df.loc[5, 'Unit'] = 'ACRES'
+            df = convert_units(df, 'test')
+            # the conversion for the class is used over the conversion for any class
+            self.assertEqual(['ha', 'm2'], list(df['Unit'][[2, 5]]))
+            self.assertAlmostEqual(3 * 0.40468564224, df['FlowAmount'][2])
+            self.assertAlmostEqual(6 * 4046.8564224, df['FlowAmount'][5])
+        finally:
+            del flowsa.common.unit_conversions['test']
+
+
+if __name__ == '__main__':
+    unittest.main()
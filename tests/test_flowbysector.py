@@ -0,0 +1,201 @@
+# test_flowbysector.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of planning the steps of a flowbysector method and storing the activity sets """
+import shutil
+import tempfile
+import unittest
+import yaml
+import pandas as pd
+import flowsa
+import flowsa.flowbysector
+import flowsa.profiling
+import flowsa.common
+from flowsa.common import set_categorical_schema
+from flowsa.flowbysector import build_method_plan, get_plan_levels, plan_summary, prune_plan, \
+    activity_set_fingerprint, load_activity_set_shard, store_activity_set_shard
+from flowsa.cache import clear_cache
+from synthetic_inputs import make_water_method_inputs
+
+
+def make_activity_set(names, allocation_source='BLS_QCEW', allocation_method='proportional'):
+    return {'names': names, 'allocation_source': allocation_source, 'allocation_method': allocation_method,
+            'allocation_source_class': 'Employment', 'allocation_sector_aggregation': 'agg',
+            'allocation_source_year': 2015, 'allocation_flow': ['Number of employees'],
+            'allocation_compartment': 'None', 'allocation_from_scale': 'state', 'allocation_helper': 'no'}
+
+
+class TestMethodPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.method = {'target_sector_level': 'NAICS_2', 'target_sector_source': 'NAICS_2012_Code',
+                       'target_geoscale': 'national',
+                       'flowbyactivity_sources': {
+                           'test': {'class': 'Water', 'geoscale_to_use': 'county', 'year': 2015,
+                                    'activity_sets': {'set_1': make_activity_set('Industrial'),
+                                                      'set_2': make_activity_set('Mining'),
+                                                      'set_3': make_activity_set('Domestic', 'None', 'direct')}}}}
+
+    def test_shared_allocation_node(self):
+        plan = build_method_plan(self.method)
+        types = [node['type'] for node in plan.values()]
+        self.assertEqual(1, types.count('flowbyactivity'))
+        self.assertEqual(1, types.count('allocation'))
+        self.assertEqual(2, types.count('allocation_ratios'))
+        self.assertEqual(3, types.count('activity_set'))
+        self.assertEqual(['set_1', 'set_2'], plan['allocation:BLS_QCEW_2015']['activity_sets'])
+        self.assertEqual(['Industrial', 'Mining'], plan['allocation:BLS_QCEW_2015']['args'][3])
+        levels = get_plan_levels(plan)
+        self.assertEqual(['flowbyactivity:test', 'allocation:BLS_QCEW_2015'], levels[0])
+        self.assertEqual(['activity_set:test/set_1', 'activity_set:test/set_2'], levels[2])
+
+    def test_plan_summary_sizes(self):
+        outputpath = tempfile.mkdtemp() + '/'
+        fbaoutputpath = flowsa.fbaoutputpath
+        flowsa.fbaoutputpath = outputpath
+        try:
+            pd.DataFrame({'Class': ['Water'] * 3, 'FlowAmount': [1.0, 2.0, 3.0]}).to_parquet(
+                outputpath + 'test_2015.parquet')
+            summary = plan_summary(build_method_plan(self.method)).set_index('node')
+        finally:
+            flowsa.fbaoutputpath = fbaoutputpath
+            shutil.rmtree(outputpath)
+        self.assertEqual(3, summary.loc['flowbyactivity:test', 'estimated_rows'])
+        self.assertEqual(3, summary.loc['activity_set:test/set_3', 'estimated_rows'])
+        self.assertTrue(pd.isna(summary.loc['allocation:BLS_QCEW_2015', 'estimated_rows']))
+
+    def test_prune_plan(self):
+        plan = build_method_plan(self.method)
+        pruned = prune_plan(plan, ['activity_set:test/set_2'])
+        self.assertEqual(['flowbyactivity:test', 'allocation:BLS_QCEW_2015', 'ratios:test/Mining',
+                          'activity_set:test/set_2'], list(pruned))
+
+
+class TestActivitySetShards(unittest.TestCase):
+
+    def setUp(self):
+        self.outputpath = tempfile.mkdtemp() + '/'
+        self.fbaoutputpath = flowsa.fbaoutputpath
+        self.fbs_shard_path = flowsa.flowbysector.fbs_shard_path
+        flowsa.fbaoutputpath = self.outputpath
+        flowsa.flowbysector.fbs_shard_path = self.outputpath + 'shards/'
+        pd.DataFrame({'Class': ['Water'] * 3, 'FlowAmount': [1.0, 2.0, 3.0]}).to_parquet(
+            self.outputpath + 'test_2015.parquet')
+        self.method = {'target_sector_level': 'NAICS_2', 'target_sector_source': 'NAICS_2012_Code',
+                       'target_geoscale': 'national'}
+        self.v = {'class': 'Water', 'geoscale_to_use': 'county', 'year': 2015}
+        self.attr = make_activity_set('Domestic', 'None', 'direct')
+        self.categorical_schema = flowsa.common.categorical_schema
+        set_categorical_schema(False)
+
+    def tearDown(self):
+        flowsa.fbaoutputpath = self.fbaoutputpath
+        flowsa.flowbysector.fbs_shard_path = self.fbs_shard_path
+        shutil.rmtree(self.outputpath)
+        set_categorical_schema(self.categorical_schema)
+
+    def test_fingerprint_changes_with_inputs(self):
+        fingerprint = activity_set_fingerprint(self.method, 'test', self.v, self.attr)
+        self.assertEqual(fingerprint, activity_set_fingerprint(self.method, 'test', self.v, self.attr))
+        self.assertEqual(['test_2015.parquet'], list(fingerprint['flowbyactivity']))
+        # changing the yaml settings of the activity set
+        attr = dict(self.attr, names='Industrial')
+        self.assertNotEqual(fingerprint['fingerprint'],
+                            activity_set_fingerprint(self.method, 'test', self.v, attr)['fingerprint'])
+        # changing the flowbyactivity data
+        pd.DataFrame({'Class': ['Water'] * 3, 'FlowAmount': [1.0, 2.0, 4.0]}).to_parquet(
+            self.outputpath + 'test_2015.parquet')
+        self.assertNotEqual(fingerprint['fingerprint'],
+                            activity_set_fingerprint(self.method, 'test', self.v, self.attr)['fingerprint'])
+
+    def test_fingerprint_code(self):
+        fingerprint = activity_set_fingerprint(self.method, 'test', self.v, self.attr)
+        self.assertIn('flowbysector.py', fingerprint['code'])
+        # source modules are only hashed if the activity set runs their functions
+        self.assertNotIn('USGS_NWIS_WU.py', fingerprint['code'])
+        self.assertNotIn('BLS_QCEW.py', fingerprint['code'])
+        v = dict(self.v, clean_fba_df_fxn='usgs_fba_data_cleanup', clean_fba_w_sec_df_fxn='None')
+        fingerprint = activity_set_fingerprint(self.method, 'test', v, self.attr)
+        self.assertIn('USGS_NWIS_WU.py', fingerprint['code'])
+
+    def test_shard_round_trip(self):
+        fbs = pd.DataFrame({'SectorProducedBy': ['21', '22'], 'FlowAmount': [1.0, 2.0]})
+        fingerprint = activity_set_fingerprint(self.method, 'test', self.v, self.attr)
+        self.assertIsNone(load_activity_set_shard('method', 'test', 'set_1', fingerprint))
+        store_activity_set_shard('method', 'test', 'set_1', fingerprint, fbs)
+        pd.testing.assert_frame_equal(fbs, load_activity_set_shard('method', 'test', 'set_1', fingerprint))
+        # stored data is not used once the inputs change
+        changed = activity_set_fingerprint(self.method, 'test', dict(self.v, year=2016), self.attr)
+        self.assertIsNone(load_activity_set_shard('method', 'test', 'set_1', changed))
+
+    def test_categorical_shard_round_trip(self):
+        fbs = pd.DataFrame({'SectorProducedBy': ['21', '22'], 'FlowAmount': [1.0, 2.0]})
+        fingerprint = activity_set_fingerprint(self.method, 'test', self.v, self.attr)
+        store_activity_set_shard('method', 'test', 'set_1', fingerprint, fbs)
+        # stored data is read with the categorical schema in use when it is loaded
+        set_categorical_schema(True)
+        loaded = load_activity_set_shard('method', 'test', 'set_1', fingerprint)
+        self.assertEqual('category', loaded['SectorProducedBy'].dtype.name)
+        pd.testing.assert_frame_equal(fbs.astype({'SectorProducedBy': 'category'}), loaded)
+
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.outputpath = tempfile.mkdtemp() + '/'
+        self.paths = {'fbaoutputpath': flowsa.fbaoutputpath,
+                      'fbsoutputpath': flowsa.flowbysector.fbsoutputpath,
+                      'flowbyactivitymethodpath': flowsa.flowbysector.flowbyactivitymethodpath,
+                      'fbs_shard_path': flowsa.flowbysector.fbs_shard_path}
+        method = make_water_method_inputs(self.outputpath, geoscales=('state', 'county'), allocation_rows=2000)
+        with open(self.outputpath + 'test_method.yaml', 'w') as f:
+            yaml.safe_dump(method, f)
+        flowsa.fbaoutputpath = self.outputpath
+        flowsa.flowbysector.fbsoutputpath = self.outputpath
+        flowsa.flowbysector.flowbyactivitymethodpath = self.outputpath
+        flowsa.flowbysector.fbs_shard_path = self.outputpath + 'shards/'
+
+    def tearDown(self):
+        flowsa.fbaoutputpath = self.paths['fbaoutputpath']
+        flowsa.flowbysector.fbsoutputpath = self.paths['fbsoutputpath']
+        flowsa.flowbysector.flowbyactivitymethodpath = self.paths['flowbyactivitymethodpath']
+        flowsa.flowbysector.fbs_shard_path = self.paths['fbs_shard_path']
+        shutil.rmtree(self.outputpath)
+
+    def test_workers_match_serial(self):
+        clear_cache()
+        serial = flowsa.flowbysector.main('test_method', workers=1, full_rebuild=True)
+        clear_cache()
+        pooled = flowsa.flowbysector.main('test_method', workers=2, full_rebuild=True)
+        self.assertGreater(len(serial), 0)
+        pd.testing.assert_frame_equal(serial, pooled)
+
+    def test_categorical_matches_plain(self):
+        categorical_schema = flowsa.common.categorical_schema
+        try:
+            set_categorical_schema(False)
+            clear_cache()
+            plain = flowsa.flowbysector.main('test_method', full_rebuild=True)
+            set_categorical_schema(True)
+            clear_cache()
+            fbs = flowsa.flowbysector.main('test_method', full_rebuild=True)
+        finally:
+            set_categorical_schema(categorical_schema)
+        self.assertEqual('category', fbs['SectorConsumedBy'].dtype.name)
+        # the rows are in the same order in both modes
+        pd.testing.assert_frame_equal(plain, fbs.astype({c: object for c in fbs.columns
+                                                         if fbs[c].dtype.name == 'category'}))
+
+    def test_profiling_restored(self):
+        profiling_enabled = flowsa.profiling.profiling_enabled
+        flowsa.profiling.enable_profiling(False)
+        try:
+            flowsa.flowbysector.main('test_method', plan_only=True, profile=True)
+            self.assertFalse(flowsa.profiling.profiling_enabled)
+        finally:
+            flowsa.profiling.enable_profiling(profiling_enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
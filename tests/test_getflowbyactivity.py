@@ -0,0 +1,135 @@
+# test_getflowbyactivity.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of reading stored flowbyactivity parquet files """
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import flowsa
+import flowsa.flowbyactivity
+from flowsa.cache import cache_info, clear_cache
+
+
+class TestGetFlowByActivity(unittest.TestCase):
+
+    def setUp(self):
+        clear_cache()
+        self.outputpath = tempfile.mkdtemp() + '/'
+        self.fbaoutputpath = flowsa.fbaoutputpath
+        flowsa.fbaoutputpath = self.outputpath
+        flowsa.flowbyactivity.fbaoutputpath = self.outputpath
+        fba = pd.DataFrame({'Class': ['Water', 'Water', 'Water', 'Land'],
+                            'SourceName': 'test',
+                            'FlowName': ['fresh', 'fresh', 'saline', 'ACRES'],
+                            'FlowAmount': [1.0, 2.0, 3.0, 4.0],
+                            'ActivityProducedBy': ['None', 'None', 'Mining', 'None'],
+                            'ActivityConsumedBy': ['Domestic', 'Domestic', 'None', 'Cropland'],
+                            'Location': ['00000', '06000', '06037', '06000'],
+                            'LocationSystem': 'FIPS_2015',
+                            'Year': 2015})
+        fba.to_parquet(self.outputpath + 'test_2015.parquet', row_group_size=2)
+        fba.assign(Year=2010, FlowAmount=fba['FlowAmount'] * 10).to_parquet(self.outputpath + 'test_2010.parquet')
+
+    def tearDown(self):
+        flowsa.fbaoutputpath = self.fbaoutputpath
+        flowsa.flowbyactivity.fbaoutputpath = self.fbaoutputpath
+        shutil.rmtree(self.outputpath)
+
+    def test_class_filter(self):
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test')
+        self.assertEqual(3, len(fba))
+
+    def test_column_projection(self):
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test',
+                                       columns=['Location', 'FlowAmount'])
+        self.assertEqual(['Location', 'FlowAmount'], list(fba.columns))
+
+    def test_activity_filter(self):
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test',
+                                       activities=['Domestic', 'Mining'])
+        self.assertEqual(6.0, fba['FlowAmount'].sum())
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test',
+                                       activities=['Mining'])
+        self.assertEqual(['06037'], list(fba['Location']))
+
+    def test_location_and_geoscale_filter(self):
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test',
+                                       geoscale='state')
+        self.assertEqual(['06000'], list(fba['Location']))
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test',
+                                       locations=['00000', '06037'], geoscale='county')
+        self.assertEqual(['06037'], list(fba['Location']))
+
+    def test_geoscale_filter_by_year(self):
+        # Wade Hampton Census Area, AK (02270) was renamed Kusilvak Census Area (02158) in 2015
+        for y, county in ((2010, '02270'), (2015, '02158')):
+            pd.DataFrame({'Class': 'Water', 'FlowAmount': [1.0, 2.0], 'Location': [county, '06037'],
+                          'Year': y}).to_parquet(self.outputpath + 'test_' + str(y) + '.parquet')
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test',
+                                       geoscale='county')
+        self.assertEqual(['02270', '06037', '02158', '06037'], list(fba['Location']))
+        flowsa.flowbyactivity.partition_stored_flowbyactivity('test', [2010, 2015])
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test',
+                                       geoscale='county')
+        self.assertEqual(['02158', '02270', '06037', '06037'], sorted(fba['Location']))
+
+    def test_multiple_years(self):
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test')
+        self.assertEqual(66.0, fba['FlowAmount'].sum())
+
+    def test_partitioned_dataset(self):
+        flat = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test')
+        flowsa.flowbyactivity.partition_stored_flowbyactivity('test', [2010, 2015])
+        self.assertTrue(os.path.isdir(self.outputpath + 'test/Year=2010'))
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test')
+        pd.testing.assert_frame_equal(flat.reset_index(drop=True), fba)
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test',
+                                       geoscale='state', columns=['Year', 'FlowAmount'])
+        self.assertEqual([2015], list(fba['Year']))
+        self.assertEqual([2.0], list(fba['FlowAmount']))
+
+    def test_partitioned_and_flat_years(self):
+        flat = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test')
+        # only 2010 is in the partitioned dataset, 2015 is read from its file
+        flowsa.flowbyactivity.partition_stored_flowbyactivity('test', [2010])
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2010, 2015], datasource='test')
+        pd.testing.assert_frame_equal(flat.reset_index(drop=True), fba.reset_index(drop=True))
+
+    def test_failed_partition_write_keeps_previous(self):
+        flowsa.flowbyactivity.partition_stored_flowbyactivity('test', [2015])
+        fba = pd.read_parquet(self.outputpath + 'test_2015.parquet')
+        # a column of mixed types can not be written to parquet
+        flowsa.flowbyactivity.store_flowbyactivity_partitions(fba.assign(Unit=['a', 1, 'b', 2]), 'test')
+        self.assertEqual(['Year=2015'], os.listdir(self.outputpath + 'test'))
+        stored = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test')
+        self.assertEqual(6.0, stored['FlowAmount'].sum())
+        self.assertNotIn('Unit', stored.columns)
+
+    def test_cached_read(self):
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test')
+        # modifying the returned frame does not change the cached frame
+        fba['FlowAmount'] = 0.0
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test')
+        self.assertEqual(6.0, fba['FlowAmount'].sum())
+        self.assertEqual(1, cache_info()['hits'])
+        self.assertEqual(1, cache_info()['misses'])
+        # a different filter is a different cache entry
+        flowsa.getFlowByActivity(flowclass=['Land'], years=[2015], datasource='test')
+        self.assertEqual(2, cache_info()['entries'])
+
+    def test_cache_invalidated_by_mtime(self):
+        flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test')
+        f = self.outputpath + 'test_2015.parquet'
+        pd.read_parquet(f).assign(FlowAmount=1.0).to_parquet(f)
+        mtime = os.path.getmtime(f) + 10
+        os.utime(f, (mtime, mtime))
+        fba = flowsa.getFlowByActivity(flowclass=['Water'], years=[2015], datasource='test')
+        self.assertEqual(3.0, fba['FlowAmount'].sum())
+        self.assertEqual(1, cache_info()['invalidations'])
+
+
+if __name__ == '__main__':
+    unittest.main()
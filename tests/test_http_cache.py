@@ -0,0 +1,113 @@
+# test_http_cache.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the on-disk http response cache """
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+import requests
+import flowsa.common
+from flowsa.common import make_http_request
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    requests_made = []
+
+    def do_GET(self):
+        QuietHandler.requests_made.append(self.headers.get('If-Modified-Since'))
+        # fail the first call to /flaky.csv with a transient error
+        if self.path == '/flaky.csv' and len(QuietHandler.requests_made) == 1:
+            self.send_error(503)
+            return
+        self.path = self.path.replace('flaky', 'data')
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.served = tempfile.mkdtemp()
+        with open(os.path.join(self.served, 'data.csv'), 'w') as f:
+            f.write('a,b\n1,2\n')
+        self.http_cache_path = flowsa.common.http_cache_path
+        flowsa.common.http_cache_path = tempfile.mkdtemp() + '/'
+        QuietHandler.requests_made = []
+        self.server = HTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=self.served))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/data.csv'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.served)
+        shutil.rmtree(flowsa.common.http_cache_path)
+        flowsa.common.http_cache_path = self.http_cache_path
+
+    def test_response_is_cached(self):
+        r = make_http_request(self.url)
+        self.assertEqual('a,b\n1,2\n', r.text)
+        # a second call revalidates the cached response rather than downloading it
+        r = make_http_request(self.url)
+        self.assertEqual(b'a,b\n1,2\n', r.content)
+        self.assertEqual(2, len(QuietHandler.requests_made))
+        self.assertIsNotNone(QuietHandler.requests_made[1])
+
+    def test_cache_ttl_and_offline(self):
+        make_http_request(self.url)
+        r = make_http_request(self.url, cache_ttl=1)
+        self.assertEqual('a,b\n1,2\n', r.text)
+        r = make_http_request(self.url, offline=True)
+        self.assertEqual('a,b\n1,2\n', r.text)
+        self.assertEqual(1, len(QuietHandler.requests_made))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            make_http_request(self.url + '?uncached', offline=True)
+
+    def test_url_not_stored(self):
+        url = self.url + '?api_key=secret'
+        make_http_request(url)
+        index_path = flowsa.common.http_cache_path + 'index/'
+        for f in os.listdir(index_path):
+            with open(index_path + f) as fp:
+                self.assertNotIn('secret', fp.read())
+        r = make_http_request(url, offline=True)
+        self.assertEqual(url, r.url)
+
+    def test_cache_file_closed(self):
+        make_http_request(self.url)
+        r = make_http_request(self.url, offline=True)
+        self.assertFalse(r.raw.closed)
+        self.assertEqual(b'a,b\n1,2\n', r.content)
+        self.assertTrue(r.raw.closed)
+
+    def test_replaced_content_removed(self):
+        make_http_request(self.url)
+        with open(os.path.join(self.served, 'data.csv'), 'w') as f:
+            f.write('a,b\n3,4\n')
+        # a newer modification time, so the revalidation downloads the data
+        t = os.path.getmtime(os.path.join(self.served, 'data.csv')) + 10
+        os.utime(os.path.join(self.served, 'data.csv'), (t, t))
+        r = make_http_request(self.url)
+        self.assertEqual('a,b\n3,4\n', r.text)
+        self.assertEqual(1, len(os.listdir(flowsa.common.http_cache_path + 'content/')))
+
+    def test_retry_transient_error(self):
+        r = make_http_request(self.url.replace('data.csv', 'flaky.csv'))
+        self.assertEqual('a,b\n1,2\n', r.text)
+        self.assertEqual(2, len(QuietHandler.requests_made))
+
+    def test_error_raised_after_retries(self):
+        with self.assertRaises(requests.exceptions.HTTPError):
+            make_http_request(self.url.replace('data.csv', 'missing.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
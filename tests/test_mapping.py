@@ -0,0 +1,56 @@
+# test_mapping.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of activity to sector mapping functions """
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import flowsa.mapping
+from flowsa.common import load_sector_crosswalk, sector_source_name
+from flowsa.mapping import expand_naics_list, get_sector_prefix_index, get_sector_mapping
+
+
+class TestExpandNaicsList(unittest.TestCase):
+
+    def test_expand_naics_list(self):
+        df = pd.DataFrame({'ActivitySourceName': 'test', 'Activity': ['Crops', 'Crops', 'Households'],
+                           'Sector': ['1111', '11111', 'F010'], 'SectorType': 'I'})
+        expanded = expand_naics_list(df, sector_source_name)
+        sectors = load_sector_crosswalk()[sector_source_name].dropna().unique()
+        expected = sorted(s for s in sectors if s.startswith('1111'))
+        self.assertEqual(expected, sorted(expanded.loc[expanded['Activity'] == 'Crops', 'Sector']))
+        self.assertIn('F01000', expanded.loc[expanded['Activity'] == 'Households', 'Sector'].tolist())
+
+    def test_prefix_index_reused(self):
+        self.assertIs(get_sector_prefix_index(sector_source_name), get_sector_prefix_index(sector_source_name))
+
+
+class TestSectorMapping(unittest.TestCase):
+
+    def setUp(self):
+        self.mapping_cache_path = flowsa.mapping.mapping_cache_path
+        flowsa.mapping.mapping_cache_path = tempfile.mkdtemp() + '/'
+        flowsa.mapping.sector_mappings.clear()
+
+    def tearDown(self):
+        shutil.rmtree(flowsa.mapping.mapping_cache_path)
+        flowsa.mapping.mapping_cache_path = self.mapping_cache_path
+        flowsa.mapping.sector_mappings.clear()
+
+    def test_mapping_stored_and_reused(self):
+        mapping = get_sector_mapping('USGS_NWIS_WU', sector_source_name, 'disagg')
+        self.assertEqual(['ActivitySourceName', 'Activity', 'Sector', 'SectorType'], list(mapping.columns))
+        self.assertEqual(1, len(os.listdir(flowsa.mapping.mapping_cache_path)))
+        # the mapping is rebuilt from the stored parquet in a new process
+        flowsa.mapping.sector_mappings.clear()
+        pd.testing.assert_frame_equal(mapping, get_sector_mapping('USGS_NWIS_WU', sector_source_name, 'disagg'))
+        agg = get_sector_mapping('USGS_NWIS_WU', sector_source_name, 'agg')
+        self.assertLess(len(agg), len(mapping))
+        self.assertEqual(2, len(os.listdir(flowsa.mapping.mapping_cache_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
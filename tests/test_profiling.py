@@ -0,0 +1,72 @@
+# test_profiling.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of recording the time and memory of flowbysector stages """
+import json
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import flowsa.profiling
+from flowsa.profiling import profile_stage, profile_context_node, enable_profiling, clear_profile, \
+    get_profile, write_profile_report
+
+
+def double_rows(df):
+    with profile_stage('double_rows', df) as record:
+        df = pd.concat([df, df])
+        record['rows_out'] = len(df)
+    return df
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.profiling_enabled = flowsa.profiling.profiling_enabled
+        self.df = pd.DataFrame({'FlowAmount': [1.0, 2.0, 3.0]})
+        clear_profile()
+
+    def tearDown(self):
+        enable_profiling(self.profiling_enabled)
+        clear_profile()
+
+    def test_disabled_records_nothing(self):
+        enable_profiling(False)
+        with profile_stage('stage', self.df) as record:
+            record['rows_out'] = 3
+        self.assertEqual(6, len(double_rows(self.df)))
+        self.assertEqual(0, len(get_profile()))
+
+    def test_stage_records(self):
+        enable_profiling()
+        with profile_context_node('activity_set:test/set_1'):
+            with profile_stage('subset', self.df) as record:
+                record['rows_out'] = 2
+            double_rows(self.df)
+        profile = get_profile()
+        self.assertEqual(['subset', 'double_rows'], list(profile['stage']))
+        self.assertEqual(['activity_set:test/set_1'] * 2, list(profile['node']))
+        self.assertEqual([3, 3], list(profile['rows_in']))
+        self.assertEqual([2, 6], list(profile['rows_out']))
+        self.assertTrue((profile['wall_time'] >= 0).all())
+
+    def test_report(self):
+        enable_profiling()
+        double_rows(self.df)
+        double_rows(self.df)
+        path = tempfile.mkdtemp() + '/'
+        try:
+            write_profile_report(path + 'method_profile')
+            self.assertEqual(2, len(pd.read_csv(path + 'method_profile.csv')))
+            with open(path + 'method_profile.json') as f:
+                summary = json.load(f)['summary']
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(1, len(summary))
+        self.assertEqual(2, summary[0]['calls'])
+        self.assertEqual(12, summary[0]['rows_out'])
+
+
+if __name__ == '__main__':
+    unittest.main()